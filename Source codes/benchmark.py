@@ -0,0 +1,477 @@
+import os
+import io
+import sys
+import json
+import ctypes
+import time
+import shutil
+import subprocess
+import argparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from compute_cgRMSD import (read_atom_table, parse_pdb_buffer, process_structures, superpose_batch, is_structure_file,
+                            structure_name, ATOM_TABLE_DTYPE, CoordinateBuffers)
+from reference_metrics import score_metrics
+from merge_and_corr import merge_metrics_and_cgRMSD
+from correlation_engine import correlation_table
+from leaderboard import target_summaries, update_summaries, leaderboard
+
+SOURCE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DATA_FOLDER = os.path.join(SOURCE_FOLDER, "..", "data")
+
+# Representations scored by the pipeline stage (sweep mode)
+REPRESENTATIONS = ["P", "C4'", "P+C4'+N1/N9", "all"]
+
+# Atoms of one synthetic residue (adenosine)
+RESIDUE_ATOMS = ["P", "OP1", "OP2", "O5'", "C5'", "C4'", "O4'", "C3'", "O3'", "C2'", "O2'", "C1'",
+                 "N9", "C8", "N7", "C5", "C6", "N6", "N1", "C2", "N3", "C4"]
+
+# Modules whose import time is tracked: the scoring core, the scoring entry points and the pipeline
+IMPORT_MODULES = ("cg_core", "compute_cgRMSD", "scoring_service", "main_all")
+
+# Measures where a larger value is a regression; every '<count>_per_s' rate is a regression when smaller
+COST_MEASURES = ("peak_mb",)
+
+
+def _status_bytes(field):
+    """
+    Read a memory field of /proc/self/status (e.g. 'VmRSS', 'VmHWM'), in bytes.
+    """
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"{field} not found in /proc/self/status")
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process (Linux only), after returning freed heap memory
+    to the system (glibc).
+
+    :return: Current resident set size in bytes, or None when the peak cannot be reset.
+    """
+    try:
+        # Give the memory freed by earlier stages back to the system, so that reusing it counts
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+        return _status_bytes("VmRSS")
+    except OSError:
+        return None
+
+
+def measure(stage, repeat=1, memory=True, min_time=1.0):
+    """
+    Time a benchmark stage and measure its peak memory.
+
+    The stage is run `repeat` times, and again while the runs total less than `min_time` seconds
+    (short stages are noisy), and the fastest run is kept. On Linux, peak memory is the growth
+    of the peak resident set size during the runs, so it costs nothing; elsewhere the stage is run
+    once more under tracemalloc (which traces numpy buffers too, but slows Python-heavy stages a lot).
+
+    :param stage: Function running the stage and returning {count name: count}, e.g. {"files": 53},
+                  or tuple (setup, stage) where setup prepares the inputs of the stage, untimed.
+    :param repeat: Number of timed runs.
+    :param memory: Boolean, if True, also measure the peak memory.
+    :param min_time: Minimum total time of the timed runs, in seconds.
+    :return: Dictionary with 'seconds', the counts, one '<count>_per_s' rate per count and 'peak_mb'.
+    """
+    times, peak = [], None
+    with contextlib.redirect_stdout(io.StringIO()):
+        if isinstance(stage, tuple):
+            setup, stage = stage
+            setup()
+        while len(times) < repeat or sum(times) < min_time:
+            start_rss = reset_peak_rss() if memory else None
+            start = time.perf_counter()
+            counts = stage()
+            times.append(time.perf_counter() - start)
+            if start_rss is not None:
+                peak = max(peak or 0, _status_bytes("VmHWM") - start_rss)
+        if memory and peak is None:
+            tracemalloc.start()
+            try:
+                stage()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    seconds = min(times)
+    result = {"seconds": seconds}
+    for name, count in counts.items():
+        result[name] = count
+        result[f"{name}_per_s"] = count / seconds if seconds > 0 else float("inf")
+    if memory:
+        result["peak_mb"] = peak / 1024 ** 2
+    return result
+
+
+def dataset_jobs(data_folder):
+    """
+    List the natives of a dataset folder (NATIVE, PREDS and SCORES subfolders) with their predictions.
+
+    :param data_folder: Path to the dataset folder.
+    :return: List of (structure_id, native file, list of prediction files, score file or None) tuples.
+    """
+    jobs = []
+    native_folder = os.path.join(data_folder, "NATIVE")
+    for native_file in sorted(os.listdir(native_folder)):
+        if not is_structure_file(native_file):
+            continue
+        structure_id = structure_name(native_file)
+        predicted_folder = os.path.join(data_folder, "PREDS", structure_id)
+        if not os.path.isdir(predicted_folder):
+            continue
+        predicted_paths = [os.path.join(predicted_folder, name)
+                           for name in sorted(os.listdir(predicted_folder)) if is_structure_file(name)]
+        score_file = os.path.join(data_folder, "SCORES", f"{structure_id}.csv")
+        jobs.append((structure_id, os.path.join(native_folder, native_file), predicted_paths,
+                     score_file if os.path.exists(score_file) else None))
+    return jobs
+
+
+def dataset_stages(data_folder, work_folder):
+    """
+    Benchmark stages of the pipeline on a real dataset: parsing, CG-RMSD scoring, reference metrics,
+    and merge + correlations.
+
+    :param data_folder: Path to the dataset folder.
+    :param work_folder: Folder receiving the outputs of the stages.
+    :return: Dictionary {stage name: stage function or (setup, stage function)}.
+    """
+    jobs = dataset_jobs(data_folder)
+    n_predictions = sum(len(paths) for _, _, paths, _ in jobs)
+    structure_files = [path for _, native, paths, _ in jobs for path in [native] + paths]
+    cg_folder = os.path.join(work_folder, "cg_rmsd")
+    score_jobs = [(structure_id, native, os.path.dirname(paths[0]), os.path.join(cg_folder, f"{structure_id}.csv"))
+                  for structure_id, native, paths, _ in jobs if paths]
+
+    def parse():
+        atoms = sum(len(read_atom_table(path)) for path in structure_files)
+        return {"files": len(structure_files), "atoms": atoms}
+
+    def score():
+        scored = n_predictions - len(process_structures(score_jobs, ["C4'"], representations=REPRESENTATIONS))
+        return {"files": scored, "superpositions": scored * len(REPRESENTATIONS)}
+
+    def metrics():
+        scored = 0
+        for _, native, paths, _ in jobs:
+            scored += len(score_metrics(native, paths)[0])
+        return {"files": scored, "superpositions": scored}
+
+    def scored():
+        if not all(os.path.exists(output_file) for *_, output_file in score_jobs):
+            score()
+
+    def merge_correlate():
+        frames = []
+        for structure_id, _, _, score_file in jobs:
+            cg_file = os.path.join(cg_folder, f"{structure_id}.csv")
+            if score_file is None or not os.path.exists(cg_file):
+                continue
+            merged_file = os.path.join(work_folder, "merged", f"merged_{structure_id}.csv")
+            merge_metrics_and_cgRMSD(cg_file, score_file, merged_file)
+            frames.append(pd.read_csv(merged_file).assign(structure=structure_id))
+        merged = pd.concat(frames, ignore_index=True)
+        correlation_table(long_results(merged))
+        return {"files": len(frames), "models": len(merged)}
+
+    stages = {"parse": parse, "score": score, "metrics": metrics}
+    if any(score_file for *_, score_file in jobs):
+        stages["merge_correlate"] = (scored, merge_correlate)
+    return stages
+
+
+def long_results(merged):
+    """
+    Reshape merged CSV rows (one 'CG-RMSD <representation>' column per representation) into the long
+    format of ResultsStore.merged.
+    """
+    value_columns = [column for column in merged.columns if column.startswith("CG-RMSD")]
+    data = merged.melt(id_vars=["structure", "Model", "RMSD", "MCQ", "TM-score"], value_vars=value_columns,
+                       var_name="representation", value_name="cg_rmsd")
+    return data.rename(columns={"Model": "model", "RMSD": "rmsd", "MCQ": "mcq", "TM-score": "tm_score"})
+
+
+def synthetic_structure(n_atoms, rng):
+    """
+    Build a synthetic RNA-like atom table: repeated adenosine residues along a random walk.
+
+    :param n_atoms: Number of atoms.
+    :param rng: numpy Generator.
+    :return: Numpy structured array with dtype ATOM_TABLE_DTYPE.
+    """
+    table = np.empty(n_atoms, dtype=ATOM_TABLE_DTYPE)
+    atom_index = np.arange(n_atoms)
+    table["record"] = "ATOM"
+    table["chain"] = "A"
+    table["resseq"] = atom_index // len(RESIDUE_ATOMS) % 10000
+    table["icode"] = ""
+    table["resname"] = "A"
+    table["name"] = np.array(RESIDUE_ATOMS)[atom_index % len(RESIDUE_ATOMS)]
+    table["altloc"] = ""
+    table["xyz"] = np.cumsum(rng.normal(scale=0.9, size=(n_atoms, 3)), axis=0).astype(np.float32)
+    return table
+
+
+def pdb_bytes(table):
+    """
+    Write an atom table as the ATOM records of a PDB file.
+    """
+    lines = [f"{record:<6}{index % 100000:>5} {name:<4}{altloc:1}{resname:>3} {chain:1}{resseq:>4}{icode:1}   "
+             f"{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n"
+             for index, (record, chain, resseq, icode, resname, name, altloc, (x, y, z))
+             in enumerate(table.tolist(), start=1)]
+    return "".join(lines).encode()
+
+
+def synthetic_decoys(native, n_decoys, rng, noise=2.0):
+    """
+    Randomly rotated, translated and perturbed copies of a structure.
+
+    :param native: Numpy array (N, 3) of coordinates.
+    :param n_decoys: Number of decoys.
+    :param rng: numpy Generator.
+    :param noise: Standard deviation of the coordinate noise, in Angstrom.
+    :return: Numpy array (n_decoys, N, 3).
+    """
+    rotations = np.linalg.qr(rng.normal(size=(n_decoys, 3, 3)))[0]
+    decoys = native[None] + rng.normal(scale=noise, size=(n_decoys,) + native.shape)
+    return decoys @ rotations + rng.normal(scale=10.0, size=(n_decoys, 1, 3))
+
+
+def synthetic_stages(atom_counts, n_decoys, batch_bytes=64 * 1024 ** 2, seed=0):
+    """
+    Benchmark stages on synthetic structures scaled up beyond the bundled dataset.
+
+    For every size in `atom_counts`, 'synthetic_parse_<N>' parses about one million atoms of PDB text
+    and 'synthetic_superpose_<N>' superposes `n_decoys` decoys on a native, in batches of about
+    `batch_bytes` of coordinates ('synthetic_superpose_float32_<N>' with float32 decoys and reused
+    scratch buffers). 'synthetic_correlate' correlates `n_decoys` models spread over 10 structures
+    and the 4 representations of REPRESENTATIONS; 'synthetic_leaderboard' ranks their 7 predictor
+    families and 'synthetic_leaderboard_update' refreshes the leaderboard after one structure changed.
+
+    :param atom_counts: List of structure sizes, in atoms.
+    :param n_decoys: Number of decoys per size.
+    :param batch_bytes: Size of the coordinates of one batch of decoys.
+    :param seed: Seed of the synthetic data.
+    :return: Dictionary {stage name: stage function}.
+    """
+    rng = np.random.default_rng(seed)
+    stages = {}
+    for n_atoms in atom_counts:
+        native = synthetic_structure(n_atoms, rng)
+        text = pdb_bytes(native)
+        copies = max(1, -(-1000000 // n_atoms))
+        native_atoms = native["xyz"].astype(np.float64)
+        batch = int(np.clip(batch_bytes // (n_atoms * 3 * 8), 1, n_decoys))
+        decoys = synthetic_decoys(native_atoms, batch, rng)
+
+        def parse(text=text, copies=copies, n_atoms=n_atoms):
+            for _ in range(copies):
+                parse_pdb_buffer(text)
+            return {"files": copies, "atoms": copies * n_atoms}
+
+        def superpose(native_atoms=native_atoms, decoys=decoys, n_atoms=n_atoms, buffers=None):
+            # The same batch of decoys is superposed again until n_decoys superpositions are done
+            done = 0
+            while done < n_decoys:
+                size = min(len(decoys), n_decoys - done)
+                superpose_batch(native_atoms, decoys[:size], buffers)
+                done += size
+            return {"superpositions": n_decoys, "atoms": n_decoys * n_atoms}
+
+        def superpose_float32(native_atoms=native_atoms, decoys=decoys.astype(np.float32), n_atoms=n_atoms):
+            return superpose(native_atoms, decoys, n_atoms, CoordinateBuffers(np.float32))
+
+        stages[f"synthetic_parse_{n_atoms}"] = parse
+        stages[f"synthetic_superpose_{n_atoms}"] = superpose
+        stages[f"synthetic_superpose_float32_{n_atoms}"] = superpose_float32
+
+    n_structures = 10
+    n_families = 7
+    models = np.arange(n_decoys)
+    quality = rng.gamma(2.0, 4.0, size=n_decoys)
+    base = pd.DataFrame({
+        "structure": [f"s{index % n_structures:02d}" for index in models],
+        "model": [f"family{index % n_families}_s{index % n_structures:02d}_{index}.pdb" for index in models],
+        "rmsd": quality,
+        "mcq": quality * 6.0 + rng.normal(scale=5.0, size=n_decoys),
+        "tm_score": 1.0 / (1.0 + quality / 5.0),
+    })
+    data = pd.concat([base.assign(representation=representation,
+                                  cg_rmsd=quality * (0.8 + 0.1 * index) + rng.normal(size=n_decoys))
+                      for index, representation in enumerate(REPRESENTATIONS)], ignore_index=True)
+
+    def correlate():
+        correlation_table(data)
+        return {"models": n_decoys}
+
+    def aggregate():
+        leaderboard(target_summaries(data))
+        return {"models": n_decoys}
+
+    summaries = target_summaries(data)
+    changed = data[data["structure"] == "s00"]
+
+    def aggregate_update():
+        leaderboard(update_summaries(summaries, changed))
+        return {"models": len(changed) // len(REPRESENTATIONS)}
+
+    stages["synthetic_correlate"] = correlate
+    stages["synthetic_leaderboard"] = aggregate
+    stages["synthetic_leaderboard_update"] = aggregate_update
+    return stages
+
+
+def compare(results, baseline, tolerance=0.15, min_memory_mb=16.0):
+    """
+    Compare benchmark results with a baseline and flag regressions.
+
+    A rate ('<count>_per_s') is a regression when it is more than `tolerance` below the baseline;
+    peak memory is a regression when it is more than `tolerance` and `min_memory_mb` above it
+    (small stages vary by a few MB from run to run). Stages missing from either side are ignored.
+
+    :param results: Dictionary {stage: measures} of the current run.
+    :param baseline: Dictionary {stage: measures} of the baseline run.
+    :param tolerance: Relative change allowed before flagging.
+    :param min_memory_mb: Peak memory increase, in MB, allowed before flagging.
+    :return: DataFrame with stage, measure, baseline, current, change and regression columns.
+    """
+    rows = []
+    for stage, measures in results.items():
+        if stage not in baseline:
+            continue
+        for name, value in measures.items():
+            reference = baseline[stage].get(name)
+            if not (name.endswith("_per_s") or name in COST_MEASURES) or not reference:
+                continue
+            change = value / reference - 1.0
+            if name.endswith("_per_s"):
+                regression = change < -tolerance
+            else:
+                regression = change > tolerance and value - reference > min_memory_mb
+            rows.append((stage, name, reference, value, change, regression))
+    return pd.DataFrame(rows, columns=["stage", "measure", "baseline", "current", "change", "regression"])
+
+
+def import_stages(modules):
+    """
+    Benchmark stages timing the startup of a fresh interpreter importing each module.
+
+    Every 'import_<module>' stage runs `python -c "import <module>"` in a new process, so the
+    measure includes the interpreter startup and every dependency loaded by the module; a module
+    starting to import pandas, SciPy or matplotlib at the top shows as a drop of its startup rate.
+    `python -X importtime -c "import <module>"` details where the time goes.
+
+    :param modules: List of module names of the source folder.
+    :return: Dictionary {stage name: stage function}.
+    """
+    stages = {}
+    for module in modules:
+        def startup(module=module):
+            subprocess.run([sys.executable, "-c", f"import {module}"], cwd=SOURCE_FOLDER, check=True)
+            return {"startups": 1}
+
+        stages[f"import_{module}"] = startup
+    return stages
+
+
+def run_benchmarks(stages, selected=None, repeat=1, memory=True):
+    """
+    Run the selected stages and print one line per stage.
+
+    :param stages: Dictionary {stage name: stage function or (setup, stage function)}.
+    :param selected: Optional list of stage names, or prefixes of stage names, to run.
+    :param repeat: Number of timed runs of each stage.
+    :param memory: Boolean, if True, also measure the peak memory of each stage.
+    :return: Dictionary {stage name: measures}.
+    """
+    results = {}
+    for name, stage in stages.items():
+        if selected and not any(name.startswith(prefix) for prefix in selected):
+            continue
+        results[name] = measure(stage, repeat, memory)
+        rates = ", ".join(f"{value:,.0f} {key[:-len('_per_s')]}/s"
+                          for key, value in results[name].items() if key.endswith("_per_s"))
+        peak = f", peak {results[name]['peak_mb']:.1f} MB" if memory else ""
+        print(f"{name}: {results[name]['seconds']:.3f} s ({rates}{peak})")
+    return results
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command-line arguments of the benchmark suite.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the CG-RMSD pipeline.")
+    parser.add_argument("--data", default=DATA_FOLDER, help="Dataset folder with NATIVE, PREDS and SCORES subfolders.")
+    parser.add_argument("--output", help="JSON file receiving the results.")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative change flagged as a regression.")
+    parser.add_argument("--stages", help="Comma-separated stage names or prefixes (e.g. 'parse,synthetic_superpose').")
+    parser.add_argument("--atoms", type=int, nargs="+", default=[10000, 100000], help="Sizes of the synthetic structures.")
+    parser.add_argument("--decoys", type=int, default=10000, help="Number of synthetic decoys.")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Minimum number of timed runs of each stage (the fastest is kept).")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure peak memory.")
+    parser.add_argument("--quick", action="store_true", help="Small synthetic sizes (1000 and 10000 atoms, 1000 decoys).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.quick:
+        args.atoms, args.decoys = [1000, 10000], 1000
+    selected = [name.strip() for name in args.stages.split(",")] if args.stages else None
+
+    work_folder = tempfile.mkdtemp(prefix="cg_rmsd_benchmark_")
+    try:
+        stages = dataset_stages(args.data, work_folder) if os.path.isdir(os.path.join(args.data, "NATIVE")) else {}
+        stages.update(synthetic_stages(args.atoms, args.decoys))
+        stages.update(import_stages(IMPORT_MODULES))
+        results = run_benchmarks(stages, selected, args.repeat, not args.no_memory)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "parameters": {"data": os.path.abspath(args.data), "atoms": args.atoms, "decoys": args.decoys,
+                       "repeat": args.repeat},
+        "stages": results,
+    }
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Benchmark results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        if baseline.get("parameters") != report["parameters"]:
+            print("Warning: the baseline was run with different parameters.")
+        comparison = compare(results, baseline["stages"], args.tolerance)
+        print(comparison.to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+        regressions = comparison[comparison["regression"]]
+        if not regressions.empty:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for stage, name, reference, value, change, _ in regressions.itertuples(index=False):
+                print(f"  {stage} {name}: {reference:.4g} -> {value:.4g} ({change:+.0%})")
+            sys.exit(1)
+        print(f"No regression beyond {args.tolerance:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
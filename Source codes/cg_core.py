@@ -0,0 +1,1007 @@
+import os
+import re
+import gzip
+from itertools import repeat
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from instrumentation import timer, count, for_target, collector, log_event
+
+# Fixed-width PDB columns (0-based start, width) of the fields kept in an atom table.
+# Lines shorter than PDB_LINE_WIDTH are padded with blanks before slicing.
+PDB_LINE_WIDTH = 54
+PDB_COLUMNS = {
+    "record": (0, 6),
+    "name": (12, 4),
+    "altloc": (16, 1),
+    "resname": (17, 3),
+    "chain": (21, 1),
+    "resseq": (22, 4),
+    "icode": (26, 1),
+    "x": (30, 8),
+    "y": (38, 8),
+    "z": (46, 8),
+}
+
+# One row per ATOM/HETATM record, coordinates kept in float32.
+ATOM_TABLE_DTYPE = np.dtype([
+    ("record", "U6"),
+    ("chain", "U4"),
+    ("resseq", "i4"),
+    ("icode", "U1"),
+    ("resname", "U3"),
+    ("name", "U4"),
+    ("altloc", "U1"),
+    ("xyz", "f4", (3,)),
+])
+
+# Version of the atom tables read by read_atom_table; increase it whenever the parsers or ATOM_TABLE_DTYPE
+# change, so the tables cached by an older version are parsed again (see structure_cache.AtomTableCache)
+ATOM_TABLE_VERSION = 2
+
+_PDB_LINE_DTYPE = np.dtype({
+    "names": list(PDB_COLUMNS),
+    "formats": [f"S{width}" for _, width in PDB_COLUMNS.values()],
+    "offsets": [start for start, _ in PDB_COLUMNS.values()],
+    "itemsize": PDB_LINE_WIDTH,
+})
+
+
+def _residue_number(text):
+    """
+    Read one residue number, decimal or hybrid-36 ('A000' is 10000, 'a000' follows 'ZZZZ'); None if unreadable.
+    """
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    if len(text) == 4 and text.isalnum() and text[0].isalpha() and (text.isupper() or text.islower()):
+        value = int(text, 36) - 10 * 36 ** 3 + 10000
+        return value if text.isupper() else value + 26 * 36 ** 3
+    return None
+
+
+def parse_residue_numbers(values):
+    """
+    Convert an array of residue number strings to integers, tolerating blank and unreadable numbers.
+
+    Decimal numbers are converted at once; otherwise every distinct string is read by _residue_number,
+    which also accepts the hybrid-36 numbers of large structures.
+
+    :param values: Numpy array of residue number strings (bytes or str).
+    :return: Tuple (numbers, invalid): int32 numpy array, 0 for blank or unreadable numbers, and boolean
+             numpy array flagging them.
+    """
+    try:
+        return values.astype(np.int32), np.zeros(len(values), dtype=bool)
+    except ValueError:
+        pass
+    unique, inverse = np.unique(values, return_inverse=True)
+    parsed = [_residue_number(value.decode("ascii", "replace") if isinstance(value, bytes) else str(value))
+              for value in unique]
+    invalid = np.array([number is None for number in parsed], dtype=bool)
+    numbers = np.array([0 if number is None else number for number in parsed], dtype=np.int32)
+    return numbers[inverse.ravel()], invalid[inverse.ravel()]
+
+
+def parse_pdb_buffer(data, bad_lines=None):
+    """
+    Parse the ATOM/HETATM records of a PDB text buffer into an atom table.
+
+    The buffer is scanned once: line starts are located with NumPy, every
+    coordinate record is copied into a fixed-width byte matrix and the columns
+    are read by slicing that matrix, without a Python loop over the lines.
+    Blank or unreadable residue numbers are read as 0 (see parse_residue_numbers).
+
+    :param data: Content of a PDB file as bytes.
+    :param bad_lines: Optional list receiving the line numbers (1-based, within `data`) of the records
+                      whose residue number could not be read.
+    :return: Numpy structured array with dtype ATOM_TABLE_DTYPE.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return np.empty(0, dtype=ATOM_TABLE_DTYPE)
+
+    # Start and end offset of every line in the buffer
+    newlines = np.flatnonzero(buffer == ord("\n"))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [buffer.size]))
+    keep = starts < buffer.size
+    starts, ends = starts[keep], ends[keep]
+
+    # Keep ATOM and HETATM records only
+    head = np.full((starts.size, 6), ord(" "), dtype=np.uint8)
+    for offset in range(6):
+        inside = starts + offset < ends
+        head[inside, offset] = buffer[starts[inside] + offset]
+    head = head.view("S6").ravel()
+    is_atom = (head == b"ATOM  ") | (head == b"HETATM")
+    starts, ends = starts[is_atom], ends[is_atom]
+    line_numbers = np.flatnonzero(is_atom) + 1
+
+    # Copy the records into a blank-padded (n_atoms, PDB_LINE_WIDTH) byte matrix
+    columns = starts[:, None] + np.arange(PDB_LINE_WIDTH)
+    inside = columns < ends[:, None]
+    lines = np.full(columns.shape, ord(" "), dtype=np.uint8)
+    lines[inside] = buffer[columns[inside]]
+    fields = lines.view(_PDB_LINE_DTYPE).ravel()
+
+    table = np.empty(fields.size, dtype=ATOM_TABLE_DTYPE)
+    for name in ("record", "chain", "icode", "resname", "name", "altloc"):
+        table[name] = np.char.strip(fields[name]).astype(ATOM_TABLE_DTYPE[name])
+    table["resseq"], invalid = parse_residue_numbers(fields["resseq"])
+    if bad_lines is not None:
+        bad_lines.extend(line_numbers[invalid].tolist())
+    for axis, name in enumerate(("x", "y", "z")):
+        table["xyz"][:, axis] = fields[name].astype(np.float32)
+    return table
+
+
+def parse_pdb_stream(stream, block_size=1 << 22, bad_lines=None):
+    """
+    Parse the ATOM/HETATM records of a PDB stream block by block.
+
+    Each block is cut at its last line break and parsed with parse_pdb_buffer, so a file
+    (or a decompressing stream) is never held in memory as a whole.
+
+    :param stream: Binary file object.
+    :param block_size: Number of bytes read at a time.
+    :param bad_lines: Optional list receiving the line numbers of the records with an unreadable residue number.
+    :return: Numpy structured array with dtype ATOM_TABLE_DTYPE.
+    """
+    tables, remainder, lines_read = [], b"", 0
+    block_bad_lines = None if bad_lines is None else []
+
+    def parse(block):
+        tables.append(parse_pdb_buffer(block, block_bad_lines))
+        if block_bad_lines:
+            bad_lines.extend(lines_read + line for line in block_bad_lines)
+            block_bad_lines.clear()
+
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        remainder = block[cut:]
+        if cut:
+            parse(block[:cut])
+            lines_read += block.count(b"\n", 0, cut)
+    if remainder:
+        parse(remainder)
+    return np.concatenate(tables) if tables else np.empty(0, dtype=ATOM_TABLE_DTYPE)
+
+
+# mmCIF _atom_site items of each atom table field, in order of preference
+CIF_COLUMNS = {
+    "record": ("group_PDB",),
+    "chain": ("auth_asym_id", "label_asym_id"),
+    "resseq": ("auth_seq_id", "label_seq_id"),
+    "icode": ("pdbx_PDB_ins_code",),
+    "resname": ("auth_comp_id", "label_comp_id"),
+    "name": ("auth_atom_id", "label_atom_id"),
+    "altloc": ("label_alt_id",),
+    "x": ("Cartn_x",),
+    "y": ("Cartn_y",),
+    "z": ("Cartn_z",),
+}
+
+_CIF_TOKEN = re.compile(r"""'(?:[^']|'(?=\S))*'|"(?:[^"]|"(?=\S))*"|\S+""")
+
+
+def _cif_tokens(line):
+    """
+    Split a line of a CIF loop into values, removing the quotes of quoted values (e.g. "C4'").
+    """
+    if '"' not in line and "'" not in line:
+        return line.split()
+    return [token[1:-1] if token[0] in "'\"" else token for token in _CIF_TOKEN.findall(line)]
+
+
+def parse_cif_stream(stream, bad_lines=None, dropped_lines=None):
+    """
+    Parse the _atom_site loop of an mmCIF stream into an atom table.
+
+    The stream is read line by line and only the atom records are kept. When the file holds
+    several models, only the first one is read (as for PDB files with a single model).
+    Missing residue numbers ('.' or '?') are read as 0, as are unreadable ones, which are reported in `bad_lines`.
+    Rows whose number of values differs from the number of _atom_site items are dropped and reported
+    in `dropped_lines`.
+
+    :param stream: Binary file object.
+    :param bad_lines: Optional list receiving the line numbers of the atoms with an unreadable residue number.
+    :param dropped_lines: Optional list receiving the line numbers of the dropped rows.
+    :return: Numpy structured array with dtype ATOM_TABLE_DTYPE.
+    """
+    items, rows, row_lines = [], [], []
+    in_loop = reading = False
+    for line_number, raw_line in enumerate(stream, start=1):
+        line = raw_line.decode("utf-8", "replace").strip()
+        if reading:
+            if not line or line[0] in "_#" or line.startswith(("loop_", "data_")):
+                break
+            rows.append(_cif_tokens(line))
+            row_lines.append(line_number)
+        elif line.startswith("loop_"):
+            in_loop, items = True, []
+        elif in_loop and line.startswith("_atom_site."):
+            items.append(line.split()[0][len("_atom_site."):])
+        elif line.startswith("_"):
+            in_loop = False  # Loop of another category
+        elif in_loop and items:
+            reading = True
+            rows.append(_cif_tokens(line))
+            row_lines.append(line_number)
+
+    if not rows:
+        return np.empty(0, dtype=ATOM_TABLE_DTYPE)
+    complete = [index for index, row in enumerate(rows) if len(row) == len(items)]
+    if dropped_lines is not None and len(complete) < len(rows):
+        dropped_lines.extend(line for row, line in zip(rows, row_lines) if len(row) != len(items))
+    values = np.array([rows[index] for index in complete], dtype=str)
+    row_lines = np.array(row_lines)[complete]
+    if "pdbx_PDB_model_num" in items:
+        models = values[:, items.index("pdbx_PDB_model_num")]
+        values, row_lines = values[models == models[0]], row_lines[models == models[0]]
+
+    def column(field, default=""):
+        for item in CIF_COLUMNS[field]:
+            if item in items:
+                entries = values[:, items.index(item)]
+                return np.where(np.isin(entries, [".", "?"]), default, entries)
+        return np.full(len(values), default)
+
+    table = np.empty(len(values), dtype=ATOM_TABLE_DTYPE)
+    for field in ("record", "chain", "icode", "resname", "name", "altloc"):
+        table[field] = column(field)
+    table["resseq"], invalid = parse_residue_numbers(column("resseq", "0"))
+    if bad_lines is not None:
+        bad_lines.extend(row_lines[invalid].tolist())
+    for axis, field in enumerate(("x", "y", "z")):
+        table["xyz"][:, axis] = column(field, "nan").astype(np.float32)
+    return table
+
+
+# Accepted structure file extensions
+STRUCTURE_EXTENSIONS = (".pdb", ".pdb.gz", ".cif", ".cif.gz")
+
+
+def is_structure_file(file_name):
+    """
+    Check whether a file name has one of the STRUCTURE_EXTENSIONS.
+    """
+    return file_name.lower().endswith(STRUCTURE_EXTENSIONS)
+
+
+def structure_name(file_name):
+    """
+    Remove the structure extension of a file name (e.g. 'rp05.cif.gz' gives 'rp05').
+    """
+    base = os.path.basename(file_name)
+    for extension in sorted(STRUCTURE_EXTENSIONS, key=len, reverse=True):
+        if base.lower().endswith(extension):
+            return base[:-len(extension)]
+    return os.path.splitext(base)[0]
+
+
+def read_atom_table(pdb_file):
+    """
+    Read a structure file once into an atom table.
+
+    PDB and mmCIF files are accepted, plain or gzip-compressed ('.pdb', '.pdb.gz', '.cif', '.cif.gz');
+    compressed files are decompressed while they are parsed. Records with an unreadable residue number
+    are kept (as residue 0) and mmCIF rows with a wrong number of values are skipped; both are reported
+    with their line numbers.
+
+    :param pdb_file: Path to the structure file.
+    :return: Numpy structured array with dtype ATOM_TABLE_DTYPE.
+    """
+    name = pdb_file.lower()
+    opener = gzip.open if name.endswith(".gz") else open
+    bad_lines, dropped_lines = [], []
+    with opener(pdb_file, 'rb') as stream:
+        if name.endswith((".cif", ".cif.gz")):
+            atom_table = parse_cif_stream(stream, bad_lines, dropped_lines)
+        else:
+            atom_table = parse_pdb_stream(stream, bad_lines=bad_lines)
+    _report_lines(pdb_file, bad_lines, "with an unreadable residue number", "read as residue 0",
+                  "unreadable residue number")
+    _report_lines(pdb_file, dropped_lines, "with a wrong number of values", "skipped", "wrong number of values")
+    return atom_table
+
+
+def _report_lines(pdb_file, lines, problem, action, reason):
+    """
+    Print and log the line numbers of the atom records of a file that could not be read as they are.
+    """
+    if not lines:
+        return
+    shown = ", ".join(str(line) for line in lines[:5]) + (", ..." if len(lines) > 5 else "")
+    print(f"{pdb_file}: {len(lines)} atom record(s) {problem} (line {shown}), {action}.")
+    log_event("bad_lines", file=pdb_file, lines=len(lines), first_lines=lines[:5], reason=reason)
+
+
+def load_atom_table(pdb_file, cache=None):
+    """
+    Load the atom table of a PDB file, through the on-disk cache when one is given.
+
+    :param pdb_file: Path to the PDB file.
+    :param cache: Optional AtomTableCache; if None, the file is parsed directly.
+    :return: Numpy structured array with dtype ATOM_TABLE_DTYPE.
+    """
+    with timer("parse"):
+        atom_table = cache.load(pdb_file) if cache is not None else read_atom_table(pdb_file)
+    count("atoms", len(atom_table))
+    return atom_table
+
+
+def _load_or_error(pdb_file, cache=None):
+    """
+    Load an atom table, returning the exception instead of raising it.
+    """
+    try:
+        return load_atom_table(pdb_file, cache)
+    except Exception as e:
+        return e
+
+
+def _load_for_target(pdb_file, cache, target):
+    """
+    Load an atom table in a background thread, with the parse time and counters recorded under `target`.
+    """
+    with for_target(target):
+        return _load_or_error(pdb_file, cache)
+
+
+def read_ahead(paths, cache=None, depth=4, targets=None):
+    """
+    Load atom tables in order, with the next files read and parsed in background threads.
+
+    At most `depth` files are loaded ahead of the consumer, so reading and decompression overlap
+    with the computation on the tables already returned, without holding a whole folder in memory.
+
+    :param paths: Iterable of paths to structure files.
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param depth: Number of files loaded ahead; 0 loads each file when it is requested.
+    :param targets: Optional iterable of the target (structure id) of every path, under which its parse time
+                    and counters are recorded; defaults to the target of the caller for every path.
+    :return: Iterator of (path, atom table or exception) tuples, in the order of `paths`.
+    """
+    if targets is None:
+        targets = repeat(collector().current_target)
+    if depth <= 0:
+        for path, target in zip(paths, targets):
+            yield path, _load_for_target(path, cache, target)
+        return
+
+    jobs = zip(paths, targets)
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        pending = deque()
+        for path, target in jobs:
+            pending.append((path, executor.submit(_load_for_target, path, cache, target)))
+            if len(pending) >= depth:
+                break
+        while pending:
+            path, future = pending.popleft()
+            job = next(jobs, None)
+            if job is not None:
+                pending.append((job[0], executor.submit(_load_for_target, job[0], cache, job[1])))
+            yield path, future.result()
+
+
+def select_atoms(atom_table, atom_names=None, all_atoms=False):
+    """
+    Build the boolean mask selecting ATOM records of the given types in an atom table.
+
+    :param atom_table: Atom table returned by read_atom_table.
+    :param atom_names: List of atom names to select.
+    :param all_atoms: Boolean, if True, select every ATOM record.
+    :return: Boolean numpy array, one entry per row of the table.
+    """
+    mask = atom_table["record"] == "ATOM"
+    if all_atoms:
+        return mask
+    if not atom_names:
+        return np.zeros(len(atom_table), dtype=bool)
+    names = [name.strip() for name in atom_names]
+    return mask & np.isin(atom_table["name"], names)
+
+
+def residue_ids(atom_table):
+    """
+    Number the residues of an atom table in order of appearance.
+
+    A new residue starts whenever the chain, residue number or insertion code changes.
+
+    :param atom_table: Atom table returned by read_atom_table.
+    :return: Integer numpy array, one residue id per row of the table.
+    """
+    if len(atom_table) == 0:
+        return np.zeros(0, dtype=np.int64)
+    changed = np.zeros(len(atom_table), dtype=bool)
+    for field in ("chain", "resseq", "icode"):
+        changed[1:] |= atom_table[field][1:] != atom_table[field][:-1]
+    return np.cumsum(changed)
+
+
+def residue_labels(atom_table):
+    """
+    Label the rows of an atom table by residue: chain, ':', residue number and insertion code (e.g. 'A:12', 'A:12A').
+    """
+    labels = np.char.add(np.char.add(atom_table["chain"], ":"), atom_table["resseq"].astype(str))
+    return np.char.add(labels, atom_table["icode"])
+
+
+def parse_representation(representation):
+    """
+    Parse a coarse-grained representation into its beads.
+
+    Beads are separated by '+'. A bead may list alternative atom names separated by '/',
+    in which case one atom per residue is kept: the right-most alternative present in
+    the residue (e.g. 'N1/N9' gives N9 for purines and N1 for pyrimidines).
+    The special representation 'all' selects every atom.
+
+    :param representation: Representation string, e.g. "P+C4'+N1/N9".
+    :return: List of tuples of atom names, or None for 'all'.
+    """
+    representation = representation.strip()
+    if not representation:
+        return []
+    if representation.lower() == "all":
+        return None
+    beads = []
+    for bead in representation.split("+"):
+        names = tuple(name.strip() for name in bead.split("/") if name.strip())
+        if not names:
+            raise ValueError(f"Empty bead in representation '{representation}'")
+        beads.append(names)
+    return beads
+
+
+def select_representation(atom_table, representation):
+    """
+    Build the boolean mask selecting the atoms of a coarse-grained representation.
+
+    :param atom_table: Atom table returned by read_atom_table.
+    :param representation: Representation string, see parse_representation.
+    :return: Boolean numpy array, one entry per row of the table.
+    """
+    beads = parse_representation(representation)
+    if beads is None:
+        return select_atoms(atom_table, all_atoms=True)
+
+    is_atom = atom_table["record"] == "ATOM"
+    single_names = [names[0] for names in beads if len(names) == 1]
+    mask = is_atom & np.isin(atom_table["name"], single_names)
+
+    alternatives = [names for names in beads if len(names) > 1]
+    if alternatives:
+        residues = residue_ids(atom_table)
+        for names in alternatives:
+            # Priority of each candidate atom: position of its name in the bead
+            candidates = is_atom & np.isin(atom_table["name"], names)
+            priority = np.full(len(atom_table), -1)
+            for rank, name in enumerate(names):
+                priority[candidates & (atom_table["name"] == name)] = rank
+            best = np.full(residues.max() + 1, -1)
+            np.maximum.at(best, residues[candidates], priority[candidates])
+            mask |= candidates & (priority == best[residues])
+    return mask
+
+
+def _chain_residues(atom_table):
+    """
+    Locate chains and residues of an atom table in order of appearance.
+
+    :return: Tuple (chain_index, residue_index, residue_starts): per-row chain ordinal, per-row position
+             of the residue along its chain, and the first row of every residue. Positions follow the
+             residue numbers, so residues are consecutive only when their numbers are: a missing residue
+             leaves a gap. A residue with an insertion code (or numbered backwards) takes the next position.
+    """
+    residues = residue_ids(atom_table)
+    chain_changed = np.zeros(len(atom_table), dtype=bool)
+    chain_changed[1:] = atom_table["chain"][1:] != atom_table["chain"][:-1]
+    chain_index = np.cumsum(chain_changed)
+    residue_starts = np.flatnonzero(np.diff(residues, prepend=-1))
+    # Step from the previous residue of the chain: the difference of residue numbers, at least 1
+    chain_starts = np.diff(chain_index[residue_starts], prepend=-1) != 0
+    steps = np.maximum(np.diff(atom_table["resseq"][residue_starts].astype(np.int64), prepend=0), 1)
+    steps[chain_starts] = 0
+    positions = np.cumsum(steps)
+    # Count the positions from the first residue of each chain
+    positions -= np.maximum.accumulate(np.where(chain_starts, positions, 0))
+    return chain_index, positions[residues], residue_starts
+
+
+def align_residues(native_numbers, native_labels, predicted_numbers, predicted_labels, max_offset=10):
+    """
+    Pair the residues of a predicted chain with the residues of the paired native chain.
+
+    Residues are paired either by residue number, shifted by no offset or by an offset within `max_offset`
+    of the difference between the first residue numbers, or by position in the chain, shifted by up to
+    `max_offset`. Only residues with the same label (residue name and insertion code) are paired. The
+    pairing with the most pairs wins; ties prefer residue numbers and the smallest shift, so a missing
+    residue leaves the other residues in place, while a chain renumbered from 1 still pairs by position.
+
+    :param native_numbers: Numpy array of residue numbers of a native chain.
+    :param native_labels: Numpy array of integer codes of the residue names and insertion codes of that chain.
+    :param predicted_numbers: Numpy array of residue numbers of the matching predicted chain.
+    :param predicted_labels: Numpy array of integer codes of its residue names and insertion codes.
+    :param max_offset: Largest shift tried around each pairing.
+    :return: Integer numpy array: for every predicted residue, the index of its native residue, or -1.
+    """
+    n_native, n_predicted = len(native_numbers), len(predicted_numbers)
+    if n_native == 0 or n_predicted == 0:
+        return np.full(n_predicted, -1)
+    native_numbers, predicted_numbers = native_numbers.astype(np.int64), predicted_numbers.astype(np.int64)
+    span = int(max(native_labels.max(), predicted_labels.max())) + 1
+    native_keys, native_first = np.unique(native_numbers * span + native_labels, return_index=True)
+
+    def by_number(offset):
+        wanted = (predicted_numbers + offset) * span + predicted_labels
+        found = np.clip(np.searchsorted(native_keys, wanted), 0, len(native_keys) - 1)
+        return np.where(native_keys[found] == wanted, native_first[found], -1)
+
+    def by_position(offset):
+        positions = np.arange(n_predicted) + offset
+        inside = (positions >= 0) & (positions < n_native)
+        positions = np.clip(positions, 0, n_native - 1)
+        return np.where(inside & (native_labels[positions] == predicted_labels), positions, -1)
+
+    shifts = sorted(range(-max_offset, max_offset + 1), key=abs)
+    start = int(native_numbers[0] - predicted_numbers[0])
+    candidates = [(by_number, 0)] + [(by_number, start + shift) for shift in shifts] + \
+                 [(by_position, shift) for shift in shifts]
+    best, best_pairs = None, -1
+    for pairing, offset in candidates:
+        paired = pairing(offset)
+        pairs = np.count_nonzero(paired >= 0)
+        if pairs > best_pairs:
+            best, best_pairs = paired, pairs
+            if pairs == min(n_native, n_predicted):
+                break
+    return best
+
+
+def pair_chains(native_ids, predicted_ids):
+    """
+    Pair the chains of a predicted structure with the chains of the native structure.
+
+    Chains are paired by chain ID; the chains whose ID has no match are then paired in order of appearance.
+    A prediction listing its chains in another order, or missing a chain, thus keeps every chain with
+    its native chain, while a prediction with other chain IDs (e.g. blank ones) is paired chain by chain.
+
+    :param native_ids: Sequence of the chain IDs of the native, in order of appearance.
+    :param predicted_ids: Sequence of the chain IDs of the prediction, in order of appearance.
+    :return: List of (native chain index, predicted chain index) pairs.
+    """
+    free_native = list(range(len(native_ids)))
+    pairs, unpaired = [], []
+    for predicted, chain_id in enumerate(predicted_ids):
+        native = next((index for index in free_native if native_ids[index] == chain_id), None)
+        if native is None:
+            unpaired.append(predicted)
+            continue
+        free_native.remove(native)
+        pairs.append((native, predicted))
+    return pairs + list(zip(free_native, unpaired))
+
+
+def pair_residues(native_table, predicted_table, max_offset=10):
+    """
+    Pair the residues of a predicted structure with the residues of the native structure.
+
+    Chains are paired by chain ID (see pair_chains) and the residues of every predicted chain are paired with
+    native residues of the same name and insertion code (see align_residues), so a missing residue leaves
+    the other residues in place and residues of another nucleotide are not matched. The pairing does not
+    depend on the atoms selected, so it is computed once per prediction and reused by match_atoms for
+    every representation.
+
+    :param native_table: Atom table of the native structure.
+    :param predicted_table: Atom table of the predicted structure.
+    :param max_offset: Largest shift of residue numbers or positions tried between paired chains.
+    :return: Dictionary with, per row, the native residue of the native atoms ("native_residues") and of
+             the predicted atoms ("predicted_residues", -1 when unpaired), and the integer codes of the
+             atom names of both tables ("native_names", "predicted_names", "n_names").
+    """
+    native_chains, _, native_starts = _chain_residues(native_table)
+    predicted_chains, _, predicted_starts = _chain_residues(predicted_table)
+
+    # Integer code of every residue label (residue name and insertion code) and of every atom name
+    def codes(field, starts=None):
+        native_values = native_table[field] if starts is None else native_table[field][native_starts]
+        predicted_values = predicted_table[field] if starts is None else predicted_table[field][predicted_starts]
+        values, inverse = np.unique(np.concatenate((native_values, predicted_values)), return_inverse=True)
+        return inverse.ravel(), len(values)
+
+    resname_codes, n_resnames = codes("resname", True)
+    icode_codes, _ = codes("icode", True)
+    label_codes = icode_codes * n_resnames + resname_codes
+    native_labels, predicted_labels = label_codes[:len(native_starts)], label_codes[len(native_starts):]
+
+    # Native residue paired with every predicted residue (-1 when unpaired)
+    native_residue_chains = native_chains[native_starts]
+    predicted_residue_chains = predicted_chains[predicted_starts]
+    paired_residues = np.full(len(predicted_starts), -1)
+    native_ids = native_table["chain"][native_starts][np.diff(native_residue_chains, prepend=-1) != 0]
+    predicted_ids = predicted_table["chain"][predicted_starts][np.diff(predicted_residue_chains, prepend=-1) != 0]
+    for native_chain, predicted_chain in pair_chains(native_ids, predicted_ids):
+        native_residues = np.flatnonzero(native_residue_chains == native_chain)
+        predicted_residues = np.flatnonzero(predicted_residue_chains == predicted_chain)
+        paired = align_residues(native_table["resseq"][native_starts[native_residues]], native_labels[native_residues],
+                                predicted_table["resseq"][predicted_starts[predicted_residues]],
+                                predicted_labels[predicted_residues], max_offset)
+        paired_residues[predicted_residues] = np.where(paired >= 0, native_residues[paired], -1)
+
+    name_codes, n_names = codes("name")
+    return {
+        "native_residues": residue_ids(native_table),
+        "predicted_residues": paired_residues[residue_ids(predicted_table)],
+        "native_names": name_codes[:len(native_table)],
+        "predicted_names": name_codes[len(native_table):],
+        "n_names": n_names,
+    }
+
+
+def match_atoms(native_table, predicted_table, native_mask=None, predicted_mask=None, max_offset=10, pairing=None):
+    """
+    Match the atoms of a predicted structure to the atoms of the native structure.
+
+    Residues are paired by pair_residues. Atoms are then keyed by (native residue, atom name); alternate
+    locations and duplicated records keep their first occurrence. Keys are intersected with vectorized
+    set operations.
+
+    :param native_table: Atom table of the native structure.
+    :param predicted_table: Atom table of the predicted structure.
+    :param native_mask: Optional boolean mask of the native atoms to match.
+    :param predicted_mask: Optional boolean mask of the predicted atoms to match.
+    :param max_offset: Largest shift of residue numbers or positions tried between paired chains.
+    :param pairing: Optional dictionary returned by pair_residues for these two tables, reused by the
+                    calls of every representation of one prediction.
+    :return: Tuple (native_rows, predicted_rows, coverage): matched row indices in both tables,
+             in native order, and the fraction of selected native atoms that were matched.
+    """
+    if native_mask is None:
+        native_mask = np.ones(len(native_table), dtype=bool)
+    if predicted_mask is None:
+        predicted_mask = np.ones(len(predicted_table), dtype=bool)
+    if pairing is None:
+        pairing = pair_residues(native_table, predicted_table, max_offset)
+
+    # Integer key per atom: (native residue, atom name code)
+    n_names = pairing["n_names"]
+
+    def atom_keys(residues, names, mask):
+        rows = np.flatnonzero(mask & (residues >= 0))
+        keys = residues[rows].astype(np.int64) * n_names + names[rows]
+        # Keep the first occurrence of each key (alternate locations, duplicated records)
+        keys, first = np.unique(keys, return_index=True)
+        return keys, rows[first]
+
+    native_keys, native_rows = atom_keys(pairing["native_residues"], pairing["native_names"], native_mask)
+    predicted_keys, predicted_rows = atom_keys(pairing["predicted_residues"], pairing["predicted_names"],
+                                               predicted_mask)
+
+    _, native_matched, predicted_matched = np.intersect1d(native_keys, predicted_keys,
+                                                          assume_unique=True, return_indices=True)
+    native_rows, predicted_rows = native_rows[native_matched], predicted_rows[predicted_matched]
+    order = np.argsort(native_rows)
+    coverage = len(order) / len(native_keys) if len(native_keys) else 0.0
+    return native_rows[order], predicted_rows[order], coverage
+
+
+def parse_pdb(pdb_file, atom_names=None, all_atoms=False, cache=None):
+    """
+    Parse a PDB file to extract atomic coordinates for specific atom types or all atoms.
+    """
+    atom_table = load_atom_table(pdb_file, cache)
+    mask = select_atoms(atom_table, atom_names, all_atoms)
+    return atom_table["xyz"][mask].astype(np.float64)
+
+class CoordinateBuffers:
+    """
+    Preallocated coordinate arrays reused from one batch of predictions to the next.
+
+    Each named array grows to the largest batch requested and is handed out as a view of the
+    requested shape, so streaming thousands of predictions in fixed-size batches allocates the
+    coordinate arrays once. A view stays valid until the next request of the same name.
+    """
+
+    def __init__(self, dtype=np.float64):
+        """
+        :param dtype: Dtype of the predicted coordinates (np.float32 halves their memory).
+        """
+        self.dtype = np.dtype(dtype)
+        self.arrays = {}
+
+    def array(self, name, shape, dtype=None):
+        """
+        Return a (non-initialized) view of the named array with the given shape.
+
+        :param name: Name of the array, e.g. a CG-RMSD column.
+        :param shape: Shape of the view.
+        :param dtype: Dtype of the array, by default the dtype of the buffers.
+        """
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        size = int(np.prod(shape))
+        flat = self.arrays.get((name, dtype))
+        if flat is None or flat.size < size:
+            flat = self.arrays[(name, dtype)] = np.empty(size, dtype=dtype)
+        return flat[:size].reshape(shape)
+
+    def nbytes(self):
+        """
+        Total size of the preallocated arrays, in bytes.
+        """
+        return sum(flat.nbytes for flat in self.arrays.values())
+
+
+def superpose_batch(true_atoms, predicted_atoms, buffers=None):
+    """
+    Optimally superpose a batch of predicted structures onto the native structure (Kabsch algorithm).
+
+    Both sides are centered on their centroids, the M covariance matrices are computed
+    with a single einsum and decomposed with one batched SVD. Atoms missing from a prediction
+    can be marked with NaN: they are left out of the superposition and RMSD of that prediction.
+    Float32 predictions are not converted: they are centered in a scratch array of their own
+    dtype (taken from `buffers` when given) and every sum is accumulated in float64.
+
+    :param true_atoms: Numpy array (N, 3) of native structure atom coordinates.
+    :param predicted_atoms: Numpy array (M, N, 3) of predicted structure atom coordinates (float32 or float64).
+    :param buffers: Optional CoordinateBuffers providing the scratch array.
+    :return: Tuple (rmsd, rotations, translations) of shapes (M,), (M, 3, 3) and (M, 3),
+             such that predicted_atoms[m] @ rotations[m].T + translations[m] is superposed on the native.
+    """
+    true_atoms = np.asarray(true_atoms, dtype=np.float64)
+    predicted_atoms = np.asarray(predicted_atoms)
+    if predicted_atoms.dtype not in (np.float32, np.float64):
+        predicted_atoms = predicted_atoms.astype(np.float64)
+    if predicted_atoms.ndim != 3 or predicted_atoms.shape[1:] != true_atoms.shape:
+        raise ValueError(f"Shape mismatch: {true_atoms.shape} vs {predicted_atoms.shape}")
+
+    # Weight 1 for atoms present in the prediction, 0 for missing (NaN) atoms
+    present = np.isfinite(predicted_atoms).all(axis=2)
+    weights = present.astype(np.float64)
+    n_atoms = weights.sum(axis=1)
+    if np.any(n_atoms < 3):
+        raise ValueError("At least 3 matched atoms are needed for a superposition")
+
+    # Center the predictions on their matched atoms, in place in the scratch array (0 for missing atoms)
+    if buffers is None:
+        predicted_centered = np.empty(predicted_atoms.shape, dtype=predicted_atoms.dtype)
+    else:
+        predicted_centered = buffers.array("centered", predicted_atoms.shape, predicted_atoms.dtype)
+    np.copyto(predicted_centered, predicted_atoms)
+    predicted_centered[~present] = 0.0
+    predicted_centers = np.einsum("mni->mi", predicted_centered, dtype=np.float64) / n_atoms[:, None]
+    predicted_centered -= predicted_centers[:, None, :].astype(predicted_centered.dtype)
+    predicted_centered *= present[:, :, None]
+
+    # The native is centered once; its centroid over the atoms matched by each prediction is a small correction
+    origin = true_atoms.mean(axis=0)
+    true_atoms = true_atoms - origin
+    true_centers = weights @ true_atoms / n_atoms[:, None]
+
+    # Covariance matrices of every prediction against the native, then one batched SVD
+    covariances = np.einsum("mni,nj->mij", predicted_centered, true_atoms, dtype=np.float64)
+    covariances -= np.einsum("mi,mj->mij", np.einsum("mni->mi", predicted_centered, dtype=np.float64), true_centers)
+    u, singular_values, vt = np.linalg.svd(covariances)
+
+    # Correct improper rotations (reflections)
+    signs = np.sign(np.linalg.det(np.matmul(u, vt)))
+    signs[signs == 0] = 1.0
+    vt[:, 2, :] *= signs[:, None]
+    singular_values[:, 2] *= signs
+    rotations = np.matmul(u, vt).transpose(0, 2, 1)
+    translations = true_centers + origin - np.einsum("mij,mj->mi", rotations, predicted_centers)
+
+    # RMSD from the residual of the optimal superposition
+    squared_norms = (np.einsum("mni,mni->m", predicted_centered, predicted_centered, dtype=np.float64)
+                     + weights @ np.einsum("ni,ni->n", true_atoms, true_atoms)
+                     - n_atoms * np.einsum("mi,mi->m", true_centers, true_centers))
+    squared_deviation = np.maximum(squared_norms - 2.0 * singular_values.sum(axis=1), 0.0)
+    rmsd = np.sqrt(squared_deviation / n_atoms)
+    return rmsd, rotations, translations
+
+
+def residue_deviations(true_atoms, predicted_atoms, rotations, translations, residue_starts, buffers=None):
+    """
+    Deviation of every residue of superposed predictions from the native.
+
+    Each prediction is moved by its superposition, and the distances of its atoms to their native positions
+    are reduced, per residue, to their root mean square; with one bead per residue, this is the deviation
+    of each bead. Only the superposition already computed by superpose_batch is used.
+
+    :param true_atoms: Numpy array (N, 3) of native structure atom coordinates.
+    :param predicted_atoms: Numpy array (M, N, 3) of predicted coordinates, NaN for missing atoms.
+    :param rotations: Numpy array (M, 3, 3) returned by superpose_batch.
+    :param translations: Numpy array (M, 3) returned by superpose_batch.
+    :param residue_starts: Sorted numpy array (R,) of the index of the first atom of every residue.
+    :param buffers: Optional CoordinateBuffers providing the scratch array (the one of superpose_batch).
+    :return: Float32 numpy array (M, R) of deviations, NaN for residues without a matched atom.
+    """
+    predicted_atoms = np.asarray(predicted_atoms)
+    dtype = predicted_atoms.dtype if predicted_atoms.dtype == np.float32 else np.float64
+    if buffers is None:
+        moved = np.empty(predicted_atoms.shape, dtype=dtype)
+    else:
+        moved = buffers.array("centered", predicted_atoms.shape, dtype)
+    np.matmul(predicted_atoms, rotations.transpose(0, 2, 1).astype(dtype), out=moved)
+    moved += translations[:, None, :].astype(dtype)
+    moved -= np.asarray(true_atoms, dtype=dtype)
+
+    squared = np.einsum("mni,mni->mn", moved, moved, dtype=np.float64)
+    present = np.isfinite(squared)
+    squared[~present] = 0.0
+    sums = np.add.reduceat(squared, residue_starts, axis=1)
+    counts = np.add.reduceat(present.astype(np.int32), residue_starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sqrt(sums / counts).astype(np.float32)
+
+
+def representation_slug(representation):
+    """
+    Turn a representation into a string usable in file and folder names.
+    """
+    return representation.replace("'", "p").replace("/", "-").replace("+", "_").replace(" ", "")
+
+
+def coverage_column(cg_column):
+    """
+    Name of the coverage column reported next to a CG-RMSD column.
+    """
+    return "Coverage" + cg_column[len("CG-RMSD"):]
+
+
+def build_selections(atom_names, all_atoms=False, representations=None):
+    """
+    Map each CG-RMSD column of the output to the representation it is computed on.
+
+    :param atom_names: List of atom names to consider for computation (ignored in sweep mode).
+    :param all_atoms: Boolean, if True, include all atoms in computation (ignored in sweep mode).
+    :param representations: Optional list of representations or dict {name: representation} (sweep mode).
+    :return: Dictionary {column name: (representation, plots subfolder name)}.
+    """
+    if representations is None:
+        return {"CG-RMSD": ("all" if all_atoms else "+".join(atom_names or []), "")}
+    if not isinstance(representations, dict):
+        representations = {representation: representation for representation in representations}
+    return {f"CG-RMSD {name}": (representation, representation_slug(name))
+            for name, representation in representations.items()}
+
+
+def representation_name(column, selections):
+    """
+    Name under which the values of a CG-RMSD column are stored: the representation name of
+    a sweep column, or the representation itself (e.g. "C5'") for the single 'CG-RMSD' column.
+    """
+    if column == "CG-RMSD":
+        return selections[column][0]
+    return column[len("CG-RMSD "):]
+
+
+def prepare_native(native_pdb, selections, cache=None):
+    """
+    Parse a native structure once and select the atoms of every representation.
+
+    :param native_pdb: Path to the native PDB file.
+    :param selections: Dictionary returned by build_selections.
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :return: Dictionary with the native atom table and, per CG-RMSD column, the selection mask,
+             the selected rows, their coordinates, and the first selected atom and label of every residue.
+             Columns without atoms are left out.
+    """
+    native_table = load_atom_table(native_pdb, cache)
+    native = {"table": np.array(native_table), "columns": {}}
+    residues = residue_ids(native_table)
+    pairing = pair_residues(native_table, native_table)
+    for column, (representation, _) in selections.items():
+        mask = select_representation(native_table, representation)
+        # Matching the native with itself drops its alternate locations and duplicated atoms
+        rows, _, _ = match_atoms(native_table, native_table, mask, mask, pairing=pairing)
+        if rows.size == 0:
+            print(f"No atoms found in {native_pdb} for {representation}. Skipping.")
+            continue
+        # The selected rows are in table order, so the atoms of each residue are contiguous
+        residue_starts = np.flatnonzero(np.diff(residues[rows], prepend=-1))
+        native["columns"][column] = {
+            "representation": representation,
+            "mask": mask,
+            "rows": rows,
+            "atoms": native_table["xyz"][rows].astype(np.float64),
+            "residue_starts": residue_starts,
+            "residue_labels": residue_labels(native_table[rows[residue_starts]]),
+        }
+    return native
+
+
+def score_predictions(native, predicted_paths, cache=None, tables=None, buffers=None, names=None):
+    """
+    Compute the CG-RMSD of a batch of predicted structures against a prepared native.
+
+    Each prediction is parsed and its residues paired with the native ones once; for each representation,
+    its atoms are matched to the native
+    atoms, written to one (M, N, 3) array of the batch, and all predictions are superposed in one batched call.
+    With `buffers`, these arrays are preallocated ones reused by the next batch, in the dtype of the buffers.
+
+    :param native: Dictionary returned by prepare_native.
+    :param predicted_paths: List of paths to predicted PDB files.
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param tables: Optional iterator of (path, atom table or exception) already loading the
+                   predictions (see read_ahead); the next len(predicted_paths) items are used.
+    :param buffers: Optional CoordinateBuffers; the predicted atoms returned in superpositions are then
+                    views of its arrays, overwritten by the next call with the same buffers.
+    :param names: Optional list of model names, one per prediction (default: the file names of the predictions).
+    :return: Tuple (results, superpositions, errors):
+             results is {model: {column: value}} with CG-RMSD and coverage values,
+             superpositions is {column: (models, predicted atoms in native order, rotations, translations, rmsd,
+             per-residue deviations (see residue_deviations), or None for a native prepared without residues)},
+             errors is a list of (model, message) for the files that could not be scored, or not for
+             every representation (fewer than 3 atoms matching the native).
+    """
+    native_table = native["table"]
+    results = {}
+    errors = []
+    stacks = {column: ([], []) for column in native["columns"]}
+    coordinates = {}
+    for column, selection in native["columns"].items():
+        shape = (len(predicted_paths),) + selection["atoms"].shape
+        coordinates[column] = np.empty(shape) if buffers is None else buffers.array(column, shape)
+
+    if tables is None:
+        tables = read_ahead(predicted_paths, cache, depth=0)
+    for index in range(len(predicted_paths)):
+        predicted_path, predicted_table = next(tables)
+        pdb_file = os.path.basename(predicted_path) if names is None else names[index]
+        if isinstance(predicted_table, Exception):
+            e = predicted_table
+            errors.append((pdb_file, f"{type(e).__name__}: {e}"))
+            results[pdb_file] = {column: "Error" for column in native["columns"]}
+            count("files_errored")
+            continue
+        count("files_processed")
+        skipped = False
+        with timer("select"):
+            pairing = pair_residues(native_table, predicted_table)
+        for column, selection in native["columns"].items():
+            with timer("select"):
+                mask = select_representation(predicted_table, selection["representation"])
+                matched_native, matched_predicted, coverage = match_atoms(
+                    native_table, predicted_table, selection["mask"], mask, pairing=pairing)
+            if len(matched_native) < 3:
+                reason = "fewer than 3 atoms match the native"
+                errors.append((pdb_file, reason if column == "CG-RMSD" else f"{selection['representation']}: {reason}"))
+                skipped = True
+                log_event("skip", model=pdb_file, representation=selection["representation"], reason=reason)
+                continue
+
+            # Predicted coordinates in native atom order, NaN for unmatched native atoms
+            predicted_atoms = coordinates[column][len(stacks[column][0])]
+            predicted_atoms.fill(np.nan)
+            positions = np.searchsorted(selection["rows"], matched_native)
+            predicted_atoms[positions] = predicted_table["xyz"][matched_predicted]
+            stacks[column][0].append(pdb_file)
+            stacks[column][1].append(coverage)
+        if skipped:
+            count("files_skipped_mismatch")
+
+    # Superpose every prediction on the native in one batched call per representation
+    superpositions = {}
+    for column, (models, coverages) in stacks.items():
+        if not models:
+            continue
+        stacked_atoms = coordinates[column][:len(models)]
+        selection = native["columns"][column]
+        with timer("align"):
+            rmsd, rotations, translations = superpose_batch(selection["atoms"], stacked_atoms, buffers)
+            profiles = None
+            if "residue_starts" in selection:
+                profiles = residue_deviations(selection["atoms"], stacked_atoms, rotations, translations,
+                                              selection["residue_starts"], buffers)
+        for pdb_file, cgRMSD, coverage in zip(models, rmsd, coverages):
+            results.setdefault(pdb_file, {})[column] = cgRMSD
+            results[pdb_file][coverage_column(column)] = coverage
+        superpositions[column] = (models, stacked_atoms, rotations, translations, rmsd, profiles)
+    return results, superpositions, errors
@@ -1,8 +1,18 @@
 import os
 import csv
+import shutil
+import zipfile
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from scipy.spatial.transform import Rotation as R
-import matplotlib.pyplot as plt
+from instrumentation import timer, for_target, collector, log_event
+# The scoring core depends only on NumPy; its names are re-exported here for existing callers
+from cg_core import (PDB_LINE_WIDTH, PDB_COLUMNS, ATOM_TABLE_DTYPE, CIF_COLUMNS, STRUCTURE_EXTENSIONS, parse_pdb_buffer,
+                     parse_pdb_stream, parse_cif_stream, is_structure_file, structure_name, read_atom_table,
+                     load_atom_table, read_ahead, select_atoms, residue_ids, parse_representation, select_representation,
+                     align_residues, match_atoms, parse_pdb, superpose_batch, representation_slug, coverage_column,
+                     build_selections, representation_name, prepare_native, score_predictions, CoordinateBuffers)
 
 
 def ensure_dir_exists(file_path):
@@ -14,113 +24,348 @@ def ensure_dir_exists(file_path):
         os.makedirs(file_path)
 
 
-def parse_pdb(pdb_file, atom_names=None, all_atoms=False):
-    """
-    Parse a PDB file to extract atomic coordinates for specific atom types or all atoms.
-    """
-    atoms = []
-    with open(pdb_file, 'r') as pdb:
-        for line in pdb:
-            if line.startswith("ATOM"):
-                current_atom = line[12:16].strip()
-                if all_atoms or (atom_names and current_atom in atom_names):
-                    x = float(line[30:38].strip())
-                    y = float(line[38:46].strip())
-                    z = float(line[46:54].strip())
-                    atoms.append([x, y, z])
-    return np.array(atoms)
-
 def compute_cgRMSD(true_atoms, predicted_atoms):
     """
     Compute the coarse-grained RMSD (CG-RMSD) between native and predicted atoms.
 
     :param true_atoms: Numpy array of native structure atom coordinates.
     :param predicted_atoms: Numpy array of predicted structure atom coordinates.
-    :return: Rotation object, normalized CG-RMSD value.
+    :return: Rotation object, CG-RMSD value after optimal superposition.
     """
     if true_atoms.shape != predicted_atoms.shape:
         raise ValueError(f"Shape mismatch: {true_atoms.shape} vs {predicted_atoms.shape}")
-    
-    # Align vectors and calculate raw CG-RMSD
-    rotation, raw_cgRMSD = R.align_vectors(true_atoms, predicted_atoms, return_sensitivity=False)
-    
-   # Normalize CG-RMSD by dividing by the number of atoms
-    normalized_cgRMSD = raw_cgRMSD / len(true_atoms)
-    
-    return rotation, normalized_cgRMSD  # Return both values
 
-def process_pdb_folder(native_pdb, predicted_folder, output_file, plots_folder, atom_names, all_atoms=False):
+    from scipy.spatial.transform import Rotation
+
+    rmsd, rotations, _ = superpose_batch(true_atoms, predicted_atoms[None])
+    return Rotation.from_matrix(rotations[0]), rmsd[0]
+
+
+# Per-process state of the scoring workers, set once by _init_worker
+_worker_natives = {}
+_worker_cache = None
+_worker_read_ahead = 0
+_worker_buffers = None
+
+
+def _init_worker(natives, cache, depth=0, dtype=np.float64):
+    """
+    Receive the prepared natives once per worker process, and allocate its coordinate buffers.
+    """
+    global _worker_natives, _worker_cache, _worker_read_ahead, _worker_buffers
+    _worker_natives = natives
+    _worker_cache = cache
+    _worker_read_ahead = depth
+    _worker_buffers = CoordinateBuffers(dtype)
+
+
+def _score_task(structure_id, predicted_paths):
+    """
+    Score one chunk of predictions of one structure in a worker process.
+
+    The timers and counters of the chunk are returned with its results (see instrumentation.RunMetrics).
+    The results are pickled back to the main process, so the buffers are free for the next chunk.
+    """
+    collector().reset()
+    with for_target(structure_id):
+        tables = read_ahead(predicted_paths, _worker_cache, _worker_read_ahead)
+        outputs = score_predictions(_worker_natives[structure_id], predicted_paths, _worker_cache, tables,
+                                    _worker_buffers)
+    return (structure_id,) + outputs + (collector().snapshot(),)
+
+
+def _bounded_map(executor, function, tasks, window):
     """
-    Process a folder of predicted PDB files, compute normalized CG-RMSD for each file, and save results and plots.
+    Like executor.map, with at most `window` tasks submitted ahead of the results consumed,
+    so that results do not pile up in memory when they are written more slowly than they are computed.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(function, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def superposition_file(output_file):
+    """
+    Path of the file holding the superpositions saved next to a CG-RMSD CSV file.
+    """
+    return f"{os.path.splitext(output_file)[0]}_superposition.npz"
+
+
+def _write_npy(archive, name, array):
+    """
+    Write one array to an open .npz archive, as np.savez does.
+    """
+    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+        np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+
+
+class SuperpositionWriter:
+    """
+    Save the superpositions of one native chunk by chunk, so that plots can be rendered later without re-scoring.
+
+    For the i-th CG-RMSD column, the .npz file holds 'native_i' (N, 3), 'models_i' (M,), 'predicted_i' (M, N, 3)
+    in float32 and native atom order with NaN for unmatched atoms, 'rotations_i' (M, 3, 3), 'translations_i' (M, 3)
+    and 'rmsd_i' (M,), the per-residue deviations 'profiles_i' (M, R) in float32 with the residue labels
+    'residues_i' (R,), plus the 'columns' and plot subfolder names ('subfolders') of all columns.
+    The predicted coordinates of every chunk are appended to a temporary file as soon as they are added,
+    so memory does not grow with the number of predictions; the .npz file is assembled by close().
+    """
+
+    def __init__(self, superposition_path, native, selections):
+        """
+        :param superposition_path: Path to the .npz file.
+        :param native: Dictionary returned by prepare_native.
+        :param selections: Dictionary returned by build_selections.
+        """
+        self.superposition_path = superposition_path
+        self.native = native
+        self.selections = selections
+        self.parts = {}
+
+    def add(self, superpositions):
+        """
+        Append the superpositions of one chunk of predictions.
+
+        :param superpositions: Dictionary {column: superposition tuple} returned by score_predictions.
+        """
+        for column, (models, predicted, rotations, translations, rmsd, profiles) in superpositions.items():
+            if column not in self.parts:
+                self.parts[column] = {"models": [], "rotations": [], "translations": [], "rmsd": [], "profiles": [],
+                                      "predicted": tempfile.TemporaryFile()}
+            part = self.parts[column]
+            part["models"].extend(models)
+            part["rotations"].append(rotations)
+            part["translations"].append(translations)
+            part["rmsd"].append(rmsd)
+            part["profiles"].append(profiles)
+            np.ascontiguousarray(predicted, dtype=np.float32).tofile(part["predicted"])
+
+    def profiles(self):
+        """
+        Return the per-residue deviations added so far, as {column: (models, residue labels, float32 array (M, R))}.
+        """
+        return {column: (part["models"], self.native["columns"][column]["residue_labels"],
+                         np.concatenate(part["profiles"]))
+                for column, part in self.parts.items()}
+
+    def close(self):
+        """
+        Write the .npz file and remove the temporary files.
+        """
+        columns = [column for column in self.native["columns"] if column in self.parts]
+        profiles = self.profiles()
+        ensure_dir_exists(os.path.dirname(self.superposition_path))
+        temp_path = f"{self.superposition_path}.{os.getpid()}.tmp"
+        try:
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+                _write_npy(archive, "columns", np.array(columns, dtype=str))
+                _write_npy(archive, "subfolders", np.array([self.selections[column][1] for column in columns], dtype=str))
+                for index, column in enumerate(columns):
+                    part = self.parts[column]
+                    native_atoms = self.native["columns"][column]["atoms"]
+                    _write_npy(archive, f"native_{index}", native_atoms)
+                    _write_npy(archive, f"models_{index}", np.array(part["models"], dtype=str))
+                    _write_npy(archive, f"rotations_{index}", np.concatenate(part["rotations"]))
+                    _write_npy(archive, f"translations_{index}", np.concatenate(part["translations"]))
+                    _write_npy(archive, f"rmsd_{index}", np.concatenate(part["rmsd"]))
+                    _write_npy(archive, f"residues_{index}", profiles[column][1])
+                    _write_npy(archive, f"profiles_{index}", profiles[column][2])
+                    # The predicted coordinates are copied from the temporary file behind an .npy header
+                    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)), "fortran_order": False,
+                              "shape": (len(part["models"]),) + native_atoms.shape}
+                    with archive.open(f"predicted_{index}.npy", "w", force_zip64=True) as member:
+                        np.lib.format.write_array_header_2_0(member, header)
+                        part["predicted"].seek(0)
+                        shutil.copyfileobj(part["predicted"], member, 1 << 22)
+            os.replace(temp_path, self.superposition_path)
+        finally:
+            for part in self.parts.values():
+                part["predicted"].close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def _finish_structure(structure_id, output_file, native, selections, predicted_files, results, superposition_writer,
+                      store=None):
+    """
+    Save the results of one native once all its predictions are scored: CSV sorted by model name,
+    superposition file (see SuperpositionWriter) and, optionally, the CG-RMSD values and per-residue
+    deviations in the results store.
+    """
+    with timer("write", structure_id):
+        ensure_dir_exists(os.path.dirname(output_file))
+        columns = [name for column in native["columns"] for name in (column, coverage_column(column))]
+        with open(output_file, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=["Model"] + columns)
+            writer.writeheader()
+            writer.writerows(dict(results[pdb_file], Model=pdb_file)
+                             for pdb_file in predicted_files if pdb_file in results)
+        superposition_writer.close()
+        if store is not None:
+            store.write_cg_rmsd(structure_id, [
+                (pdb_file, representation_name(column, selections), values.get(column),
+                 values.get(coverage_column(column)))
+                for pdb_file, values in sorted(results.items()) for column in native["columns"]
+            ])
+            for column, (models, residues, deviations) in superposition_writer.profiles().items():
+                store.write_profiles(structure_id, representation_name(column, selections), models, residues,
+                                     deviations)
+
+
+def process_structures(jobs, atom_names, all_atoms=False, cache=None, representations=None, workers=1, chunk_size=16,
+                       store=None, read_ahead_depth=4, float32=False):
+    """
+    Compute CG-RMSD for several natives and their folders of predictions, possibly on several cores.
+
+    Every native is parsed once in the main process and sent once to each worker. The predictions
+    are split into (native, chunk of predictions) tasks run by a process pool; results are gathered
+    back into one CSV per native, sorted by model name, so the output does not depend on the
+    number of workers. The superpositions are saved next to each CSV (see superposition_file)
+    for the render stage of render_plots.py; no plot is drawn here.
+    Predictions are read and decompressed by background threads, up to `read_ahead_depth` files
+    ahead of the chunk being scored, so I/O overlaps with matching and superposition.
+    Chunks are streamed: their coordinates are written to preallocated arrays reused by the next chunk,
+    their superpositions are appended to disk as they arrive, and each native is written out as soon as
+    its last chunk is scored, so peak memory depends on `chunk_size`, not on the number of predictions.
+
+    :param jobs: List of (structure_id, native_pdb, predicted_folder, output_file) tuples.
+    :param atom_names: List of atom names to consider for computation (ignored in sweep mode).
+    :param all_atoms: Boolean, if True, include all atoms in computation (ignored in sweep mode).
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param representations: Optional list of representations or dict {name: representation} (sweep mode).
+    :param workers: Number of worker processes; 1 runs everything in the current process.
+    :param chunk_size: Number of predictions scored per task.
+    :param store: Optional ResultsStore receiving the CG-RMSD values of every structure.
+    :param read_ahead_depth: Number of predictions loaded ahead by background threads (0 to disable).
+    :param float32: Boolean, if True, keep the predicted coordinates in float32 (half the memory; CG-RMSD
+                    values then differ from the float64 ones by about 1e-6 Å).
+    :return: List of (structure_id, model, message) for the files that could not be scored.
+    """
+    selections = build_selections(atom_names, all_atoms, representations)
+    dtype = np.float32 if float32 else np.float64
+
+    # Parse every native once
+    natives, predicted_files, output_files, tasks = {}, {}, {}, []
+    for structure_id, native_pdb, predicted_folder, output_file in jobs:
+        with for_target(structure_id):
+            native = prepare_native(native_pdb, selections, cache)
+        if not native["columns"]:
+            continue
+        natives[structure_id] = native
+        output_files[structure_id] = output_file
+        predicted_files[structure_id] = sorted(f for f in os.listdir(predicted_folder) if is_structure_file(f))
+        paths = [os.path.join(predicted_folder, f) for f in predicted_files[structure_id]]
+        tasks.extend((structure_id, paths[start:start + chunk_size]) for start in range(0, len(paths), chunk_size))
+    remaining = {structure_id: 0 for structure_id in natives}
+    for structure_id, _ in tasks:
+        remaining[structure_id] += 1
+
+    # Score every chunk, in this process or in a pool of workers
+    executor = None
+    if workers > 1 and len(tasks) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(natives, cache, read_ahead_depth, dtype))
+        outputs = _bounded_map(executor, _score_task, tasks, 2 * workers)
+    else:
+        # One read-ahead over all the chunks, so the next files load while a chunk is superposed
+        tables = read_ahead((path for _, paths in tasks for path in paths), cache, read_ahead_depth,
+                            (structure_id for structure_id, paths in tasks for _ in paths))
+        buffers = CoordinateBuffers(dtype)
+
+        def score_chunks():
+            for structure_id, paths in tasks:
+                with for_target(structure_id):
+                    output = score_predictions(natives[structure_id], paths, cache, tables, buffers)
+                yield (structure_id,) + output + (None,)
+        outputs = score_chunks()
+
+    # Gather the chunks of each native, and write it out after its last chunk
+    gathered = {structure_id: ({}, [], SuperpositionWriter(superposition_file(output_files[structure_id]),
+                                                           natives[structure_id], selections))
+                for structure_id in natives}
+    all_errors = []
+
+    def finish(structure_id):
+        results, errors, writer = gathered.pop(structure_id)
+        _finish_structure(structure_id, output_files[structure_id], natives[structure_id], selections,
+                          predicted_files[structure_id], results, writer, store)
+        for pdb_file, message in sorted(errors):
+            print(f"Error processing {pdb_file}: {message}")
+            log_event("error", target=structure_id, model=pdb_file, message=message)
+            all_errors.append((structure_id, pdb_file, message))
+
+    try:
+        for structure_id, results, superpositions, errors, snapshot in outputs:
+            collector().merge(snapshot)
+            gathered[structure_id][0].update(results)
+            gathered[structure_id][1].extend(errors)
+            gathered[structure_id][2].add(superpositions)
+            remaining[structure_id] -= 1
+            if remaining[structure_id] == 0:
+                finish(structure_id)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    # Natives without predictions still get their (empty) output files
+    for structure_id in list(gathered):
+        finish(structure_id)
+    return all_errors
+
+
+def write_errors(errors, errors_file):
+    """
+    Save the per-file errors returned by process_structures to a tab-separated log file.
+
+    :param errors: List of (structure_id, model, message) tuples.
+    :param errors_file: Path to the log file.
+    """
+    ensure_dir_exists(os.path.dirname(errors_file))
+    with open(errors_file, 'w') as log:
+        for structure_id, pdb_file, message in errors:
+            log.write(f"{structure_id}\t{pdb_file}\t{message}\n")
+
+
+def process_pdb_folder(native_pdb, predicted_folder, output_file, plots_folder, atom_names, all_atoms=False, cache=None,
+                       representations=None, workers=1, plots="none", store=None, float32=False):
+    """
+    Process a folder of predicted PDB files, compute CG-RMSD for each file, and save results and plots.
+
+    Every structure is parsed once. In sweep mode (`representations` given), every representation
+    is selected from the same atom table and the CSV gets one 'CG-RMSD <representation>' column
+    per representation; plots are then saved in one subfolder per representation.
+    Predicted atoms are matched to native atoms by (chain, residue index, atom name), so
+    predictions with missing or extra atoms are kept: the fraction of native atoms matched is
+    written to a 'Coverage' column next to each CG-RMSD column. For each representation, all
+    predictions are superposed in one batched call.
+
+    Plots are rendered after scoring, from the saved superpositions, and only when requested.
 
     :param native_pdb: Path to the native PDB file.
     :param predicted_folder: Path to the folder containing predicted PDB files.
     :param output_file: Path to the CSV file to save results.
     :param plots_folder: Path to the folder to save plot images.
-    :param atom_names: List of atom names to consider for computation.
-    :param all_atoms: Boolean, if True, include all atoms in computation.
+    :param atom_names: List of atom names to consider for computation (ignored in sweep mode).
+    :param all_atoms: Boolean, if True, include all atoms in computation (ignored in sweep mode).
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param representations: Optional list of representations (e.g. ["P", "C4'", "P+C4'+N1/N9", "all"])
+                            or dict {name: representation} to score in one pass.
+    :param workers: Number of worker processes.
+    :param plots: Which superpositions to plot: 'none' (default), 'all', 'best:K', 'worst:K' or 'best:K,worst:K'.
+    :param store: Optional ResultsStore receiving the CG-RMSD values.
+    :param float32: Boolean, if True, keep the predicted coordinates in float32 (see process_structures).
+    :return: List of (structure_id, model, message) for the files that could not be scored.
     """
-    ensure_dir_exists(os.path.dirname(output_file))
-    ensure_dir_exists(plots_folder)  # Ensure base plots directory exists
-
-    # Parse the native PDB file
-    true_atoms = parse_pdb(native_pdb, atom_names, all_atoms)
-    if true_atoms.size == 0:
-        print(f"No atoms found in {native_pdb}. Skipping.")
-        return
+    structure_id = structure_name(native_pdb)
+    job = (structure_id, native_pdb, predicted_folder, output_file)
+    errors = process_structures([job], atom_names, all_atoms, cache, representations, workers, store=store,
+                                float32=float32)
 
-    # Process each predicted file
-    predicted_files = [f for f in os.listdir(predicted_folder) if f.endswith(".pdb")]
-    results = []
-
-    for pdb_file in predicted_files:
-        predicted_path = os.path.join(predicted_folder, pdb_file)
-        try:
-            predicted_atoms = parse_pdb(predicted_path, atom_names, all_atoms)
-            if true_atoms.shape != predicted_atoms.shape:
-                print(f"Skipping {pdb_file}: Shape mismatch.")
-                continue
-
-            # Compute normalized CG-RMSD and generate plot
-            rotation, normalized_cgRMSD = compute_cgRMSD(true_atoms, predicted_atoms)
-
-            # Ensure subdirectory exists for saving the plot
-            structure_subfolder = os.path.dirname(os.path.join(plots_folder, pdb_file))
-            ensure_dir_exists(structure_subfolder)
-
-            plot_file = os.path.join(plots_folder, f"{os.path.splitext(pdb_file)[0]}.png")
-            plot_points(true_atoms, predicted_atoms, rotation, plot_file)
-
-            # Append model and calculated CG-RMSD to results
-            results.append({"Model": pdb_file, "CG-RMSD": normalized_cgRMSD})
-
-        except Exception as e:
-            print(f"Error processing {pdb_file}: {e}")
-            results.append({"Model": pdb_file, "CG-RMSD": "Error"})
-
-    # Save results to CSV
-    with open(output_file, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=["Model", "CG-RMSD"])
-        writer.writeheader()
-        writer.writerows(results)
-
-def plot_points(true_atoms, p_atoms, rotation, plot_file):
-    """
-    Plot the native, predicted, rotated, and translated atomic coordinates, and save to a file.
-    """
-    rot_atoms = rotation.apply(p_atoms)
-    translation = true_atoms.mean(axis=0) - rot_atoms.mean(axis=0)
-    trans_atoms = rot_atoms + translation
-
-    fig = plt.figure()
-    ax = fig.add_subplot(111, projection="3d")
-    ax.scatter(true_atoms[:, 0], true_atoms[:, 1], true_atoms[:, 2], label="Native atoms")
-    ax.scatter(p_atoms[:, 0], p_atoms[:, 1], p_atoms[:, 2], label="Predicted atoms")
-    ax.scatter(rot_atoms[:, 0], rot_atoms[:, 1], rot_atoms[:, 2], label="Rotated atoms")
-    ax.scatter(
-        trans_atoms[:, 0], trans_atoms[:, 1], trans_atoms[:, 2], label="Translated atoms"
-    )
-    plt.legend()
-    plt.savefig(plot_file)  # Save the plot
-    plt.close()  # Close the plot to avoid memory leaks
-    print(f"Plot saved: {plot_file}")  # Log plot save
+    if plots != "none" and os.path.exists(superposition_file(output_file)):
+        from render_plots import render_superpositions
+        render_superpositions(superposition_file(output_file), plots_folder, plots, workers)
+    return errors
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+# Reference metric columns of the merged results and the names used in correlation outputs
+METRICS = {"rmsd": "RMSD", "mcq": "MCQ", "tm_score": "TM-score"}
+
+CORRELATION_COLUMNS = ["structure", "representation", "metric", "n", "pearson_r", "pearson_p", "spearman_r",
+                       "spearman_p"]
+
+
+def masked_pearson(x, y, valid):
+    """
+    Pearson correlation along axis 1 of broadcast arrays, using only the valid entries.
+
+    :param x: Numpy array (G, M, ...) of first values.
+    :param y: Numpy array (G, M, ...) of second values, broadcastable with x.
+    :param valid: Boolean array of the same broadcast shape marking the pairs to use.
+    :return: Tuple (r, n) of arrays with the model axis removed.
+    """
+    n = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x = np.where(valid, x, 0.0)
+        y = np.where(valid, y, 0.0)
+        x_centered = np.where(valid, x - x.sum(axis=1, keepdims=True) / n[:, None], 0.0)
+        y_centered = np.where(valid, y - y.sum(axis=1, keepdims=True) / n[:, None], 0.0)
+        r = (x_centered * y_centered).sum(axis=1) / np.sqrt(
+            (x_centered ** 2).sum(axis=1) * (y_centered ** 2).sum(axis=1))
+    return np.clip(r, -1.0, 1.0), n
+
+
+def correlation_p_values(r, n):
+    """
+    Two-sided p-values of correlation coefficients (t-test with n - 2 degrees of freedom,
+    as in scipy.stats.pearsonr and spearmanr).
+    """
+    from scipy.stats import t as student_t
+
+    dof = n - 2.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t_stat = r * np.sqrt(dof / ((1.0 - r) * (1.0 + r)))
+        p = 2.0 * student_t.sf(np.abs(t_stat), dof)
+    p = np.where(np.abs(r) >= 1.0, 0.0, p)
+    return np.where(n > 2, p, np.nan)
+
+
+def correlate_arrays(values, metrics):
+    """
+    Pearson and Spearman correlations of every (group, representation, metric) cell at once.
+
+    Pairs where either value is missing (NaN/inf) are left out of their own cell only.
+    Values and metrics are rank-transformed once (only cells with unpaired missing values are
+    ranked again), then both correlations are standardized dot products.
+
+    :param values: Numpy array (G, M, R) of CG-RMSD values: groups x models x representations.
+    :param metrics: Numpy array (G, M, K) of reference metrics: groups x models x metrics.
+    :return: Dictionary of arrays (G, R, K): 'n', 'pearson_r', 'pearson_p', 'spearman_r', 'spearman_p'.
+    """
+    from scipy.stats import rankdata
+
+    x = values[:, :, :, None]
+    y = metrics[:, :, None, :]
+    valid = np.isfinite(x) & np.isfinite(y)
+    pearson_r, n = masked_pearson(x, y, valid)
+
+    # Rank the values and the metrics once, each over its own finite entries
+    shape = np.broadcast_shapes(x.shape, y.shape)
+    x_ranks = np.broadcast_to(rankdata(values, axis=1, nan_policy="omit")[:, :, :, None], shape).copy()
+    y_ranks = np.broadcast_to(rankdata(metrics, axis=1, nan_policy="omit")[:, :, None, :], shape).copy()
+
+    # Cells where the other side has missing values are ranked again over their valid pairs only
+    partial = ((np.isfinite(x) & ~valid) | (np.isfinite(y) & ~valid)).any(axis=1)
+    if partial.any():
+        groups, representations, metric_indices = np.nonzero(partial)
+        cell_valid = valid[groups, :, representations, metric_indices]
+        x_cells = np.where(cell_valid, values[groups, :, representations], np.nan)
+        y_cells = np.where(cell_valid, metrics[groups, :, metric_indices], np.nan)
+        x_ranks[groups, :, representations, metric_indices] = rankdata(x_cells, axis=1, nan_policy="omit")
+        y_ranks[groups, :, representations, metric_indices] = rankdata(y_cells, axis=1, nan_policy="omit")
+    spearman_r, _ = masked_pearson(x_ranks, y_ranks, valid)
+
+    return {
+        "n": n,
+        "pearson_r": pearson_r,
+        "pearson_p": correlation_p_values(pearson_r, n),
+        "spearman_r": spearman_r,
+        "spearman_p": correlation_p_values(spearman_r, n),
+    }
+
+
+def to_arrays(data, group_column="structure", value_column="cg_rmsd", metrics=None, model_columns=("model",)):
+    """
+    Reshape a long results table into dense (group, model, representation) and (group, model, metric) arrays.
+
+    :param data: DataFrame with group, model, 'representation', value and metric columns
+                 (e.g. the result of ResultsStore.merged).
+    :param group_column: Column defining the groups correlations are computed in.
+    :param value_column: Column holding the CG-RMSD values.
+    :param metrics: List of metric columns; defaults to the keys of METRICS present in the data.
+    :param model_columns: Columns identifying a model inside its group.
+    :return: Tuple (values, metric_values, groups, representations, metrics); missing cells are NaN.
+    """
+    if metrics is None:
+        metrics = [metric for metric in METRICS if metric in data.columns]
+    group_codes, groups = pd.factorize(data[group_column], sort=True)
+    representation_codes, representations = pd.factorize(data["representation"], sort=True)
+
+    # Integer key of each (group, model) pair, then the position of each model inside its group
+    model_key = group_codes.astype(np.int64)
+    for column in model_columns:
+        codes, uniques = pd.factorize(data[column])
+        model_key = model_key * len(uniques) + codes
+    model_keys, model_codes = np.unique(model_key, return_inverse=True)
+    model_groups = group_codes[np.unique(model_codes, return_index=True)[1]]
+    model_positions = np.arange(len(model_keys)) - np.searchsorted(model_groups, model_groups)
+    n_models = np.bincount(model_groups, minlength=len(groups)).max(initial=0)
+    rows = model_positions[model_codes]
+
+    values = np.full((len(groups), n_models, len(representations)), np.nan)
+    values[group_codes, rows, representation_codes] = \
+        pd.to_numeric(data[value_column], errors="coerce").to_numpy(dtype=float)
+    metric_values = np.full((len(groups), n_models, len(metrics)), np.nan)
+    metric_values[group_codes, rows] = data[metrics].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    return values, metric_values, list(groups), list(representations), metrics
+
+
+def correlation_table(data, group_column="structure", value_column="cg_rmsd", metrics=None, pooled=True,
+                      pooled_name="ALL"):
+    """
+    Compute Pearson and Spearman correlations for every (structure, representation, reference metric) cell.
+
+    :param data: Long DataFrame with one row per (structure, model, representation) and the metric columns,
+                 e.g. the result of ResultsStore.merged.
+    :param group_column: Column defining the groups correlations are computed in.
+    :param value_column: Column holding the CG-RMSD values.
+    :param metrics: List of metric columns; defaults to rmsd, mcq and tm_score.
+    :param pooled: Boolean, if True, also correlate all structures pooled together.
+    :param pooled_name: Group name of the pooled rows.
+    :return: Tidy DataFrame with the columns of CORRELATION_COLUMNS.
+    """
+    frames = [(data, group_column, ("model",))]
+    if pooled:
+        # Models are only unique within a structure
+        frames.append((data.assign(pooled_group=pooled_name), "pooled_group", (group_column, "model")))
+
+    tables = []
+    for frame, column, model_columns in frames:
+        values, metric_values, groups, representations, metric_names = to_arrays(frame, column, value_column, metrics,
+                                                                                 model_columns)
+        results = correlate_arrays(values, metric_values)
+        index = pd.MultiIndex.from_product(
+            [groups, representations, [METRICS.get(metric, metric) for metric in metric_names]],
+            names=["structure", "representation", "metric"])
+        table = pd.DataFrame({name: array.reshape(-1) for name, array in results.items()}, index=index)
+        tables.append(table.reset_index())
+
+    table = pd.concat(tables, ignore_index=True)
+    table["n"] = table["n"].astype(int)
+    return table[CORRELATION_COLUMNS]
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import cProfile
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+# Structured log of the pipeline; silent until configure_logging is called
+logger = logging.getLogger("cg_rmsd")
+logger.addHandler(logging.NullHandler())
+
+
+class RunMetrics:
+    """
+    Timers and counters of one run, in total and per target (structure id).
+
+    Timers add up the wall time of every call, from every thread, so the time of a stage run in
+    background threads (e.g. parsing during read-ahead) can exceed the run time. Worker processes
+    keep their own RunMetrics and send a snapshot back, merged into the one of the main process.
+    The current target is kept per thread: background threads record under the target they are given
+    (see for_target), not under the one of the thread that started them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every timer and counter.
+        """
+        with self.lock:
+            self.started = time.time()
+            self.totals = {"timers": {}, "counters": {}}
+            self.targets = {}
+        self.local.target = None
+
+    @property
+    def current_target(self):
+        """
+        Target (structure id) the records of the calling thread are attributed to, or None.
+        """
+        return getattr(self.local, "target", None)
+
+    def _section(self, target):
+        """
+        Timers and counters of one target, or the totals when target is None.
+        """
+        if target is None:
+            return self.totals
+        return self.targets.setdefault(target, {"timers": {}, "counters": {}})
+
+    def _add(self, sections, kind, name, value):
+        """
+        Add a timer ({"seconds", "calls"}) or a counter value to every section.
+        """
+        with self.lock:
+            for section in sections:
+                if kind == "timers":
+                    timer = section["timers"].setdefault(name, {"seconds": 0.0, "calls": 0})
+                    timer["seconds"] += value["seconds"]
+                    timer["calls"] += value["calls"]
+                else:
+                    section["counters"][name] = section["counters"].get(name, 0) + value
+
+    def _record_sections(self, target):
+        """
+        Sections updated by one record: the totals, and the target (or the current target) if any.
+        """
+        target = self.current_target if target is None else target
+        return [self.totals] if target is None else [self.totals, self._section(target)]
+
+    def add_time(self, stage, seconds, target=None):
+        """
+        Add the duration of one call of a stage.
+        """
+        self._add(self._record_sections(target), "timers", stage, {"seconds": seconds, "calls": 1})
+
+    def count(self, name, value=1, target=None):
+        """
+        Increment a counter.
+        """
+        self._add(self._record_sections(target), "counters", name, value)
+
+    @contextmanager
+    def timer(self, stage, target=None):
+        """
+        Time the enclosed block as one call of `stage`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, target)
+
+    @contextmanager
+    def target(self, target):
+        """
+        Attribute the records of the enclosed block, in the calling thread, to a target (structure id).
+        """
+        previous, self.local.target = self.current_target, target
+        try:
+            yield
+        finally:
+            self.local.target = previous
+
+    def snapshot(self):
+        """
+        Return the timers and counters as a JSON-serializable dictionary.
+        """
+        with self.lock:
+            return json.loads(json.dumps({"totals": self.totals, "targets": self.targets}))
+
+    def merge(self, snapshot):
+        """
+        Add the timers and counters of a snapshot (e.g. returned by a worker process).
+        """
+        if not snapshot:
+            return
+        # Totals of the snapshot already include its targets
+        for target, section in [(None, snapshot["totals"])] + list(snapshot["targets"].items()):
+            for kind in ("timers", "counters"):
+                for name, value in section[kind].items():
+                    self._add([self._section(target)], kind, name, value)
+
+    def write(self, metrics_file, **fields):
+        """
+        Write the run metrics to a JSON file.
+
+        :param metrics_file: Path to the JSON file.
+        :param fields: Additional top-level fields (e.g. steps, workers).
+        """
+        report = {
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "wall_seconds": time.time() - self.started,
+            **fields,
+            **self.snapshot(),
+        }
+        directory = os.path.dirname(metrics_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(metrics_file, "w") as handle:
+            json.dump(report, handle, indent=2)
+
+    def summary(self):
+        """
+        One line of the total time of every stage and of the counters, for the console.
+        """
+        snapshot = self.snapshot()["totals"]
+        timers = ", ".join(f"{stage} {timer['seconds']:.2f} s" for stage, timer in snapshot["timers"].items())
+        counters = ", ".join(f"{name} {value}" for name, value in snapshot["counters"].items())
+        return "; ".join(part for part in (timers, counters) if part)
+
+
+# Metrics of the current process
+_metrics = RunMetrics()
+
+
+def collector():
+    """
+    Return the RunMetrics of the current process.
+    """
+    return _metrics
+
+
+def timer(stage, target=None):
+    """
+    Time the enclosed block as one call of `stage` in the metrics of the current process.
+    """
+    return _metrics.timer(stage, target)
+
+
+def timed(stage):
+    """
+    Decorator timing every call of a function as one call of `stage`.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _metrics.timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, target=None):
+    """
+    Increment a counter in the metrics of the current process.
+    """
+    _metrics.count(name, value, target)
+
+
+def for_target(target):
+    """
+    Attribute the records of the enclosed block, in the calling thread, to a target (structure id).
+    """
+    return _metrics.target(target)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as JSON lines: time, level, event and the fields given to log_event.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(log_file, level="INFO"):
+    """
+    Send the structured log of the pipeline to a JSON lines file ('-' for standard error).
+
+    :param log_file: Path to the log file, '-', or None to keep the log silent.
+    :param level: Logging level name.
+    """
+    for handler in [handler for handler in logger.handlers if isinstance(handler.formatter, JsonFormatter)]:
+        logger.removeHandler(handler)
+        handler.close()
+    if not log_file:
+        return
+    if log_file == "-":
+        handler = logging.StreamHandler()
+    else:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.FileHandler(log_file)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Log one event with its fields (e.g. log_event("skip", target="rp05", reason="up to date")).
+    """
+    if logger.isEnabledFor(level):
+        if _metrics.current_target is not None:
+            fields.setdefault("target", _metrics.current_target)
+        logger.log(level, event, extra={"fields": fields})
+
+
+@contextmanager
+def profiled(profile_file=None):
+    """
+    Profile the enclosed block with cProfile and save the statistics, if a file is given.
+
+    The file can be read with pstats or snakeviz. Only the current process is profiled.
+
+    :param profile_file: Path to the statistics file, or None to run the block without profiling.
+    """
+    if not profile_file:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        directory = os.path.dirname(profile_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(profile_file)
+        print(f"Profile saved to {profile_file}")
@@ -0,0 +1,184 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from correlation_engine import METRICS, to_arrays, correlate_arrays
+from model_names import model_metadata
+
+# Keys of the per-target statistics of a predictor family
+SUMMARY_KEYS = ["structure", "representation", "family"]
+
+
+def family_correlations(data, value_column="cg_rmsd", metrics=None, min_models=3):
+    """
+    Spearman correlation of the CG-RMSD values with every reference metric, inside each (structure, family) group.
+
+    All the groups are correlated at once by correlation_engine.correlate_arrays.
+
+    :param data: Long DataFrame with structure, model, family, representation, value and metric columns.
+    :param value_column: Column holding the CG-RMSD values.
+    :param metrics: List of metric columns; defaults to the keys of METRICS present in the data.
+    :param min_models: Groups with fewer complete models get NaN correlations.
+    :return: DataFrame with the SUMMARY_KEYS and one 'spearman_<metric>' column per metric.
+    """
+    if metrics is None:
+        metrics = [metric for metric in METRICS if metric in data.columns]
+    if not metrics or data.empty:
+        return pd.DataFrame(columns=SUMMARY_KEYS + [f"spearman_{metric}" for metric in metrics])
+    groups = data.groupby(["structure", "family"], observed=True, sort=True).ngroup().to_numpy()
+    frame = data.assign(group=groups)
+    values, metric_values, group_ids, representations, metric_names = to_arrays(frame, "group", value_column, metrics)
+    results = correlate_arrays(values, metric_values)
+    spearman = np.where(results["n"] >= min_models, results["spearman_r"], np.nan)
+
+    group_keys = frame.drop_duplicates("group").set_index("group").loc[group_ids, ["structure", "family"]]
+    index = pd.MultiIndex.from_product([range(len(group_ids)), representations], names=["group", "representation"])
+    table = pd.DataFrame(spearman.reshape(-1, len(metric_names)), index=index,
+                         columns=[f"spearman_{metric}" for metric in metric_names]).reset_index()
+    table["structure"] = group_keys["structure"].to_numpy()[table["group"]]
+    table["family"] = pd.Categorical(group_keys["family"].to_numpy()[table["group"]])
+    return table[SUMMARY_KEYS + [f"spearman_{metric}" for metric in metric_names]]
+
+
+def target_summaries(data, value_column="cg_rmsd", metrics=None):
+    """
+    Statistics of every predictor family on every target (structure) and representation.
+
+    The model names are parsed once into a categorical family column (see model_names.model_metadata),
+    and every statistic is one vectorized group-by over the whole results table.
+    Families are ranked on each target by their best model; tied families share the best rank, so they all win.
+
+    :param data: Long DataFrame with one row per (structure, model, representation) and the metric columns,
+                 e.g. the result of ResultsStore.merged.
+    :param value_column: Column holding the CG-RMSD values.
+    :param metrics: List of metric columns for the rank correlations; defaults to rmsd, mcq and tm_score.
+    :return: DataFrame with one row per (structure, representation, family): n_models, best, median, mean,
+             best_model, rank, families (number of families on the target), win, and the Spearman correlations.
+    """
+    data = data.assign(**{value_column: pd.to_numeric(data[value_column], errors="coerce")})
+    data = data[np.isfinite(data[value_column])].reset_index(drop=True)
+    data["family"] = model_metadata(data["model"])["family"]
+
+    grouped = data.groupby(SUMMARY_KEYS, observed=True, sort=True)[value_column]
+    summaries = grouped.agg(n_models="size", best="min", median="median", mean="mean")
+    summaries["best_model"] = data["model"].to_numpy()[grouped.idxmin().to_numpy()] if len(data) else []
+    summaries = summaries.reset_index()
+
+    targets = summaries.groupby(["structure", "representation"], observed=True)["best"]
+    summaries["rank"] = targets.rank(method="min")
+    summaries["families"] = targets.transform("size")
+    summaries["win"] = summaries["rank"] == 1
+
+    correlations = family_correlations(data, value_column, metrics)
+    return summaries.merge(correlations.astype({"family": summaries["family"].dtype}), on=SUMMARY_KEYS, how="left")
+
+
+def update_summaries(summaries, data, value_column="cg_rmsd", metrics=None):
+    """
+    Replace the statistics of the structures present in `data`, e.g. after new decoys were scored for them.
+
+    Only these structures are summarized again, so the leaderboard of many targets is refreshed at the
+    cost of the targets that changed.
+
+    :param summaries: DataFrame returned by target_summaries (or None).
+    :param data: Long results DataFrame of the changed structures (all their models).
+    :return: Updated DataFrame of target summaries.
+    """
+    updated = target_summaries(data, value_column, metrics)
+    if summaries is None or summaries.empty:
+        return updated
+    kept = summaries[~summaries["structure"].isin(updated["structure"].unique())]
+    summaries = pd.concat([kept.astype({"family": str}), updated.astype({"family": str})], ignore_index=True)
+    summaries["family"] = summaries["family"].astype("category")
+    return summaries.sort_values(SUMMARY_KEYS, ignore_index=True)
+
+
+def leaderboard(summaries):
+    """
+    Cross-target leaderboard of the predictor families, one row per (representation, family).
+
+    :param summaries: DataFrame returned by target_summaries.
+    :return: DataFrame with targets, models, wins, win_rate, mean_rank, median and mean of the per-target best
+             CG-RMSD, median of the per-target median CG-RMSD and the mean Spearman correlation with each
+             reference metric, sorted by representation and mean rank.
+    """
+    spearman_columns = [column for column in summaries.columns if column.startswith("spearman_")]
+    grouped = summaries.groupby(["representation", "family"], observed=True, sort=True)
+    board = grouped.agg(targets=("structure", "nunique"), models=("n_models", "sum"), wins=("win", "sum"),
+                        mean_rank=("rank", "mean"), median_best=("best", "median"), mean_best=("best", "mean"),
+                        median_median=("median", "median"),
+                        **{column: (column, "mean") for column in spearman_columns})
+    board.insert(3, "win_rate", board["wins"] / board["targets"])
+    board = board.reset_index()
+    board["family"] = board["family"].astype(str)
+    return board.sort_values(["representation", "mean_rank", "median_best"], ignore_index=True)
+
+
+def head_to_head(summaries, representation):
+    """
+    Fraction of their common targets on which the best model of one family beats the best model of another.
+
+    :param summaries: DataFrame returned by target_summaries.
+    :param representation: Representation name.
+    :return: Square DataFrame (family x family): row family beats column family, ties counting one half;
+             NaN for pairs of families without a common target.
+    """
+    best = summaries[summaries["representation"] == representation].pivot_table(
+        index="structure", columns="family", values="best", observed=True)
+    values = best.to_numpy()
+    first, second = values[:, :, None], values[:, None, :]
+    common = np.isfinite(first) & np.isfinite(second)
+    wins = np.where(common, (first < second) + 0.5 * (first == second), 0.0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = wins / common.sum(axis=0)
+    families = best.columns.astype(str)
+    return pd.DataFrame(rates, index=pd.Index(families, name="family"), columns=families)
+
+
+def write_leaderboard(summaries, board, output_folder):
+    """
+    Save the target summaries and the leaderboard to leaderboard_targets.csv and leaderboard.csv.
+
+    :param summaries: DataFrame returned by target_summaries.
+    :param board: DataFrame returned by leaderboard.
+    :param output_folder: Output folder.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    summaries.to_csv(os.path.join(output_folder, "leaderboard_targets.csv"), index=False)
+    board.to_csv(os.path.join(output_folder, "leaderboard.csv"), index=False)
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command-line arguments of the predictor-family leaderboard.
+    """
+    parser = argparse.ArgumentParser(description="Leaderboard of the predictor families over all targets.")
+    parser.add_argument("results", help="Results store (.sqlite), merged CSV file, or folder of merged CSV files.")
+    parser.add_argument("--representation", help="Representation to print (default: every representation).")
+    parser.add_argument("--output", help="Folder receiving leaderboard.csv, leaderboard_targets.csv and "
+                                         "head_to_head_<representation>.csv.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from results_store import load_results
+    from cg_core import representation_slug
+
+    args = parse_arguments(argv)
+    summaries = target_summaries(load_results(args.results))
+    board = leaderboard(summaries)
+    representations = [args.representation] if args.representation else board["representation"].unique().tolist()
+    for representation in representations:
+        print(f"\n{representation or 'CG-RMSD'}:")
+        print(board[board["representation"] == representation].drop(columns="representation")
+              .to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    if args.output:
+        write_leaderboard(summaries, board, args.output)
+        for representation in representations:
+            head_to_head(summaries, representation).to_csv(
+                os.path.join(args.output, f"head_to_head_{representation_slug(representation) or 'CG-RMSD'}.csv"))
+        print(f"Leaderboard saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
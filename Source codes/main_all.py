@@ -1,101 +1,482 @@
 import os
-from compute_cgRMSD import process_pdb_folder
-from merge_and_corr import merge_metrics_and_cgRMSD, compute_correlations, plot_correlations
+import sys
+import json
+import argparse
+from compute_cgRMSD import process_structures, write_errors, representation_slug, superposition_file
+from compute_cgRMSD import is_structure_file, structure_name
+from structure_cache import AtomTableCache
+from reference_metrics import write_metrics_file
+from manifest import Manifest, file_signature, folder_signature, combine_signatures
+from instrumentation import collector, timer, count, for_target, log_event, configure_logging, profiled
+# Plotting (matplotlib), merging (pandas) and statistics (SciPy) are imported by the steps that use them,
+# so that the scoring step and the command line start without loading them
 
-def main():
+# Configuration keys holding paths, resolved relative to the configuration file
+PATH_KEYS = ["native_folder", "predicted_folder", "cgRMSD_folder", "plots_folder", "cache_folder",
+             "metrics_folder", "merged_folder", "corr_plots_folder", "corr_results_folder", "manifest",
+             "results_store", "metrics_file", "log_file", "profile_file"]
+
+
+def open_store(config):
+    """
+    Open the results store declared in the configuration ('results_store'), or return None.
+    """
+    if not config.get("results_store"):
+        return None
+    from results_store import ResultsStore
+
+    return ResultsStore(config["results_store"])
+
+
+def atom_selection(config):
+    """
+    Read the atom selection of step 1 from the configuration.
+
+    :param config: Pipeline configuration dictionary ('atoms' and optional 'representations').
+    :return: Tuple (atom_names, all_atoms, representations).
+    """
+    representations = config.get("representations")
+    atoms = config.get("atoms", "")
+    if not representations and ";" in atoms:
+        representations = [name.strip() for name in atoms.split(";") if name.strip()]
+    all_atoms = atoms.lower() == "all"
+    atom_names = None if all_atoms else atoms.split(",")
+    return atom_names, all_atoms, representations or None
+
+
+def run_step1(config, manifest=None):
+    """
+    Step 1: compute CG-RMSD for every native and its folder of predictions.
+
+    With a manifest, natives whose native file, prediction folder and atom selection are
+    unchanged since the last run are skipped.
+    """
+    print("\nStep 1: Compute CG-RMSD and generate plots")
+    native_folder = config["native_folder"]
+    predicted_base_folder = config["predicted_folder"]
+    output_base_folder = config["cgRMSD_folder"]
+    # Superposition plots go to <cgRMSD_folder>/plots unless a plots folder is given
+    plots_base_folder = config.get("plots_folder") or os.path.join(output_base_folder, "plots")
+    atom_names, all_atoms, representations = atom_selection(config)
+    cache = AtomTableCache(config["cache_folder"]) if config.get("cache_folder") else None
+    workers = int(config.get("workers", 1))
+    read_ahead_depth = int(config.get("read_ahead", 4))
+    batch_size = int(config.get("batch_size", 16))
+    float32 = bool(config.get("float32", False))
+    plots_filter = config.get("plots", "none") or "none"
+    store = open_store(config)
+    store_outputs = [store.store_file] if store is not None else []
+
+    # Collect each native PDB file with its folder of predictions
+    jobs, signatures = [], {}
+    for native_file in sorted(os.listdir(native_folder)):
+        if is_structure_file(native_file):
+            native_pdb = os.path.join(native_folder, native_file)
+            structure_id = structure_name(native_file)
+            predicted_folder = os.path.join(predicted_base_folder, structure_id)
+            output_file = os.path.join(output_base_folder, f"{structure_id}.csv")
+
+            if not os.path.exists(predicted_folder):
+                print(f"Skipping {native_pdb}: Predicted folder not found.")
+                log_event("skip", target=structure_id, step=1, reason="predicted folder not found")
+                continue
+
+            if manifest is not None:
+                signature = combine_signatures("step1", file_signature(native_pdb), folder_signature(predicted_folder),
+                                               atom_names, all_atoms, representations, float32)
+                if manifest.is_current(output_file, signature, [output_file] + store_outputs):
+                    print(f"Skipping {structure_id}: CG-RMSD file is up to date.")
+                    count("targets_up_to_date", target=structure_id)
+                    log_event("skip", target=structure_id, step=1, reason="up to date")
+                    continue
+                signatures[output_file] = signature
+            jobs.append((structure_id, native_pdb, predicted_folder, output_file))
+
+    # Compute CG-RMSD
+    errors = []
+    if jobs:
+        # The profile covers the scoring loop of this process (run with 1 worker to profile the scoring itself)
+        with profiled(config.get("profile_file")):
+            errors = process_structures(jobs, atom_names, all_atoms, cache, representations, workers, store=store,
+                                        read_ahead_depth=read_ahead_depth, chunk_size=batch_size, float32=float32)
+    if errors:
+        errors_file = os.path.join(output_base_folder, "errors.log")
+        write_errors(errors, errors_file)
+        print(f"{len(errors)} file(s) could not be processed, see {errors_file}")
+
+    # Render the requested superposition plots from the saved superpositions
+    if plots_filter != "none":
+        from render_plots import render_superpositions
+
+        for structure_id, _, _, output_file in jobs:
+            if os.path.exists(superposition_file(output_file)):
+                plots_folder = os.path.join(plots_base_folder, structure_id)
+                with for_target(structure_id):
+                    render_superpositions(superposition_file(output_file), plots_folder, plots_filter, workers)
+
+    if manifest is not None:
+        for output_file, signature in signatures.items():
+            if os.path.exists(output_file):
+                manifest.record(output_file, signature)
+        manifest.save()
+
+
+def compute_metrics(config, manifest=None):
+    """
+    Compute the score file (RMSD, MCQ, TM-score) of every native and its folder of predictions
+    into the metrics folder, instead of reading score files made by external tools.
+
+    With a manifest, natives whose native file and prediction folder are unchanged are skipped.
+    """
+    native_folder = config["native_folder"]
+    predicted_base_folder = config["predicted_folder"]
+    metrics_folder = config["metrics_folder"]
+    cache = AtomTableCache(config["cache_folder"]) if config.get("cache_folder") else None
+    batch_size = int(config.get("batch_size", 16))
+
+    errors = []
+    for native_file in sorted(os.listdir(native_folder)):
+        if is_structure_file(native_file):
+            native_pdb = os.path.join(native_folder, native_file)
+            structure_id = structure_name(native_file)
+            predicted_folder = os.path.join(predicted_base_folder, structure_id)
+            metrics_path = os.path.join(metrics_folder, f"{structure_id}.csv")
+            if not os.path.exists(predicted_folder):
+                print(f"Skipping {native_pdb}: Predicted folder not found.")
+                log_event("skip", target=structure_id, step=2, reason="predicted folder not found")
+                continue
+
+            signature = None
+            if manifest is not None:
+                signature = combine_signatures("metrics", file_signature(native_pdb), folder_signature(predicted_folder))
+                if manifest.is_current(metrics_path, signature, [metrics_path]):
+                    print(f"Skipping {structure_id}: score file is up to date.")
+                    count("targets_up_to_date", target=structure_id)
+                    log_event("skip", target=structure_id, step=2, reason="score file up to date")
+                    continue
+
+            print(f"Computing scores for {structure_id}...")
+            with for_target(structure_id):
+                errors.extend((structure_id, model, message) for model, message in
+                              write_metrics_file(native_pdb, predicted_folder, metrics_path, cache, batch_size))
+            if manifest is not None:
+                manifest.record(metrics_path, signature)
+
+    if errors:
+        errors_file = os.path.join(metrics_folder, "errors.log")
+        write_errors(errors, errors_file)
+        print(f"{len(errors)} file(s) could not be scored, see {errors_file}")
+    if manifest is not None:
+        manifest.save()
+
+
+def run_step2(config, manifest=None):
+    """
+    Step 2: merge every CG-RMSD file with the score file of the same structure.
+
+    With 'compute_metrics' set, the score files are first computed from the structures (see compute_metrics).
+    With a manifest, merged files whose CG-RMSD and score files are unchanged are skipped.
+    With a results store, the score files are imported into the store instead; the merge is
+    then a single join over every structure, done when the store is queried.
+    """
+    from merge_and_corr import merge_metrics_and_cgRMSD
+
+    print("\nStep 2: Merge CG-RMSD files and scores")
+    if config.get("compute_metrics"):
+        compute_metrics(config, manifest)
+    store = open_store(config)
+    if store is not None:
+        metrics_folder = config["metrics_folder"]
+        for structure_id in store.structures():
+            metrics_path = os.path.join(metrics_folder, f"{structure_id}.csv")
+            if not os.path.exists(metrics_path):
+                print(f"Skipping {structure_id}: Score file {metrics_path} not found.")
+                log_event("skip", target=structure_id, step=2, reason="score file not found")
+                continue
+            print(f"Importing scores: {metrics_path}")
+            with timer("merge", structure_id):
+                store.import_metrics(metrics_path, structure_id)
+        return
+
+    cgRMSD_folder = config["cgRMSD_folder"]
+    metrics_folder = config["metrics_folder"]
+    merged_folder = config["merged_folder"]
+
+    os.makedirs(merged_folder, exist_ok=True)
+
+    for cgRMSD_file in sorted(os.listdir(cgRMSD_folder)):
+        if cgRMSD_file.endswith(".csv"):
+            structure_id = os.path.splitext(cgRMSD_file)[0]
+            cgRMSD_path = os.path.join(cgRMSD_folder, cgRMSD_file)
+            metrics_path = os.path.join(metrics_folder, f"{structure_id}.csv")
+            merged_file = os.path.join(merged_folder, f"merged_{structure_id}.csv")
+
+            if not os.path.exists(metrics_path):
+                print(f"Skipping {cgRMSD_file}: Score file {metrics_path} not found.")
+                log_event("skip", target=structure_id, step=2, reason="score file not found")
+                continue
+
+            signature = None
+            if manifest is not None:
+                signature = combine_signatures("step2", file_signature(cgRMSD_path), file_signature(metrics_path))
+                if manifest.is_current(merged_file, signature, [merged_file]):
+                    print(f"Skipping {cgRMSD_file}: merged file is up to date.")
+                    count("targets_up_to_date", target=structure_id)
+                    log_event("skip", target=structure_id, step=2, reason="up to date")
+                    continue
+
+            print(f"Merging: {cgRMSD_path} with {metrics_path}")
+            with for_target(structure_id):
+                merge_metrics_and_cgRMSD(cgRMSD_path, metrics_path, merged_file)
+            if manifest is not None:
+                manifest.record(merged_file, signature)
+
+    if manifest is not None:
+        manifest.save()
+
+
+def run_step3(config, manifest=None):
+    """
+    Step 3: compute correlations and correlation plots for every merged file.
+
+    With a manifest, structures whose merged file is unchanged are skipped.
+    With a results store, the correlations of every structure and representation are saved in
+    the store and the plots are drawn from the merged data it returns.
+    """
+    from merge_and_corr import (compute_correlations, plot_correlations, cg_rmsd_columns, merged_frames,
+                                store_correlations, plot_correlation_data)
+
+    print("\nStep 3: Compute correlations and generate plots")
+    store = open_store(config)
+    if store is not None:
+        plots_base_folder = config["corr_plots_folder"]
+        correlations = store_correlations(store)
+        print(f"{len(correlations)} correlation(s) saved to {store.store_file}.")
+        for (structure_id, representation), data in merged_frames(store).items():
+            plots_folder = os.path.join(plots_base_folder, f"CORR_IMG_{structure_id}__{representation_slug(representation)}")
+            cg_column = f"CG-RMSD {representation}"
+            with for_target(structure_id):
+                plot_correlation_data(data.rename(columns={"CG-RMSD": cg_column}), plots_folder, cg_column)
+        if config.get("corr_results_folder"):
+            run_leaderboard(store.merged(), config["corr_results_folder"])
+        return
+
+    merged_folder = config["merged_folder"]
+    plots_base_folder = config["corr_plots_folder"]
+    corr_results_base_folder = config["corr_results_folder"]
+
+    os.makedirs(corr_results_base_folder, exist_ok=True)
+    os.makedirs(plots_base_folder, exist_ok=True)
+
+    for merged_file in sorted(os.listdir(merged_folder)):
+        if merged_file.endswith(".csv"):
+            structure_id = os.path.splitext(merged_file)[0].replace("merged_", "")
+            merged_file_path = os.path.join(merged_folder, merged_file)
+
+            # One correlation file and plot folder per CG-RMSD column (one per representation in a sweep)
+            outputs = {}
+            for cg_column in cg_rmsd_columns(merged_file_path):
+                suffix = ""
+                if cg_column != "CG-RMSD":
+                    suffix = "__" + representation_slug(cg_column[len("CG-RMSD "):])
+                outputs[cg_column] = suffix
+
+            key = os.path.join(corr_results_base_folder, f"corr_{structure_id}")
+            signature = None
+            if manifest is not None:
+                signature = combine_signatures("step3", file_signature(merged_file_path), plots_base_folder)
+                corr_files = [os.path.join(corr_results_base_folder, f"corr_{structure_id}{suffix}.txt")
+                              for suffix in outputs.values()]
+                if manifest.is_current(key, signature, corr_files):
+                    print(f"Skipping {merged_file}: correlations are up to date.")
+                    count("targets_up_to_date", target=structure_id)
+                    log_event("skip", target=structure_id, step=3, reason="up to date")
+                    continue
+
+            with for_target(structure_id):
+                for cg_column, suffix in outputs.items():
+                    corr_results_file = os.path.join(corr_results_base_folder, f"corr_{structure_id}{suffix}.txt")
+                    plots_folder = os.path.join(plots_base_folder, f"CORR_IMG_{structure_id}{suffix}")
+                    os.makedirs(plots_folder, exist_ok=True)
+
+                    # Compute correlations
+                    print(f"Computing correlations for {merged_file} ({cg_column})...")
+                    correlations = compute_correlations(merged_file_path, cg_column)
+
+                    # Save correlations to a text file
+                    with open(corr_results_file, "w") as f:
+                        for metric, corr in correlations.items():
+                            f.write(f"{metric}:\n")
+                            f.write(f"  Pearson Correlation: r = {corr['pearson'][0]:.3f}, p = {corr['pearson'][1]:.3e}\n")
+                            f.write(f"  Spearman Correlation: r = {corr['spearman'][0]:.3f}, p = {corr['spearman'][1]:.3e}\n\n")
+                    print(f"Correlations saved for {structure_id}{suffix}.")
+
+                    # Generate and save correlation plots
+                    plot_correlations(merged_file_path, plots_folder, cg_column)
+
+            if manifest is not None:
+                manifest.record(key, signature)
+
+    if manifest is not None:
+        manifest.save()
+
+    if any(merged_file.endswith(".csv") for merged_file in os.listdir(merged_folder)):
+        from results_store import load_results
+        run_leaderboard(load_results(merged_folder), corr_results_base_folder)
+
+
+def run_leaderboard(data, output_folder):
+    """
+    Rank the predictor families over every target and save leaderboard.csv and leaderboard_targets.csv.
+
+    :param data: Long results DataFrame (structure, model, representation, cg_rmsd and the metrics).
+    :param output_folder: Folder receiving the CSV files.
+    """
+    from leaderboard import target_summaries, leaderboard, write_leaderboard
+
+    with timer("aggregate"):
+        summaries = target_summaries(data)
+        board = leaderboard(summaries)
+    write_leaderboard(summaries, board, output_folder)
+    print(f"Leaderboard of {board['family'].nunique()} predictor family(ies) over "
+          f"{summaries['structure'].nunique()} target(s) saved to {output_folder}:")
+    top = board.groupby("representation", sort=False).head(5)
+    print(top[["representation", "family", "targets", "wins", "mean_rank", "median_best"]]
+          .to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+
+
+STEPS = {1: run_step1, 2: run_step2, 3: run_step3}
+
+
+def run_pipeline(config, manifest=None):
+    """
+    Run the steps listed in the configuration ('steps', default [1, 2, 3]) in order.
+
+    :param config: Pipeline configuration dictionary.
+    :param manifest: Optional Manifest; if given, outputs whose inputs are unchanged are not rebuilt.
+
+    Every stage is timed and counted (see instrumentation.py): the totals are printed at the end,
+    and saved per target to 'metrics_file' when it is set. 'log_file' receives a JSON lines log of
+    the steps, skipped targets and errors, and 'profile_file' a cProfile profile of the scoring loop.
+    """
+    configure_logging(config.get("log_file"))
+    metrics = collector()
+    metrics.reset()
+    steps = sorted(int(step) for step in config.get("steps", [1, 2, 3]))
+    for step in steps:
+        log_event("step_started", step=step)
+        with timer(f"step{step}"):
+            STEPS[step](config, manifest)
+        log_event("step_completed", step=step)
+    print("\nWorkflow completed successfully!")
+    print(f"Run metrics: {metrics.summary()}")
+    if config.get("metrics_file"):
+        metrics.write(config["metrics_file"], steps=steps, workers=int(config.get("workers", 1)))
+        print(f"Run metrics saved to {config['metrics_file']}")
+
+
+def load_config(config_file):
+    """
+    Load a JSON pipeline configuration; relative paths are resolved against the file's folder.
+
+    :param config_file: Path to the JSON configuration file.
+    :return: Configuration dictionary.
+    """
+    with open(config_file, 'r') as handle:
+        config = json.load(handle)
+    base_folder = os.path.dirname(os.path.abspath(config_file))
+    for key in PATH_KEYS:
+        if config.get(key):
+            config[key] = os.path.join(base_folder, config[key])
+    config.setdefault("manifest", os.path.join(base_folder, f"{os.path.splitext(os.path.basename(config_file))[0]}.manifest.json"))
+    config.setdefault("metrics_file", os.path.join(base_folder, f"{os.path.splitext(os.path.basename(config_file))[0]}.metrics.json"))
+    return config
+
+
+def ask_config():
+    """
+    Build the pipeline configuration interactively, asking only for what the chosen steps need.
+    """
     # Ask the user to select the starting step
     print("\nAvailable steps:")
     print("1: Compute CG-RMSD and generate plots")
     print("2: Merge CG-RMSD files and scores")
     print("3: Compute correlations and generate plots")
     start_step = int(input("Choose the step number to start from (1, 2, or 3): "))
+    config = {"steps": [step for step in STEPS if step >= start_step]}
+
+    # Optional results store replacing the merged CSV files and correlation text files
+    config["results_store"] = input("Enter the path of the results store (.sqlite, leave empty to use CSV files): ").strip()
 
-    # Step 1: Compute CG-RMSD and save plots
     if start_step <= 1:
-        print("\nStep 1: Compute CG-RMSD and generate plots")
-        native_folder = input("Enter the path to the folder containing native PDB files: ")
-        predicted_base_folder = input("Enter the path to the folder containing predicted PDB files: ")
-        output_base_folder = input("Enter the path to save CG-RMSD files (create this folder): ")
-        plots_base_folder = input("Enter the path to save CG-RMSD plots (create this folder): ")
+        config["native_folder"] = input("Enter the path to the folder containing native PDB files: ")
+        config["predicted_folder"] = input("Enter the path to the folder containing predicted PDB files: ")
+        config["cgRMSD_folder"] = input("Enter the path to save CG-RMSD files (create this folder): ")
+        config["plots_folder"] = input("Enter the path to save CG-RMSD plots (leave empty for <CG-RMSD folder>/plots): ").strip()
 
         # Atom selection for CG-RMSD computation
-        atom_names_input = input("Enter the atom names (comma-separated, e.g., 'C5',P' or 'all' for all atoms): ")
-        all_atoms = atom_names_input.lower() == "all"
-        atom_names = None if all_atoms else atom_names_input.split(",")
-
-        # Process each native PDB file
-        for native_file in os.listdir(native_folder):
-            if native_file.endswith(".pdb"):
-                native_pdb = os.path.join(native_folder, native_file)
-                structure_id = os.path.splitext(native_file)[0]
-                predicted_folder = os.path.join(predicted_base_folder, structure_id)
-                output_file = os.path.join(output_base_folder, f"{structure_id}.csv")
-                plots_folder = os.path.join(plots_base_folder, structure_id)
+        print("Several representations separated by ';' are scored in one pass, one column each")
+        print("(beads joined with '+', alternatives with '/', e.g. 'P;C4';P+C4'+N1/N9;all').")
+        config["atoms"] = input("Enter the atom names (comma-separated, e.g., 'C5',P' or 'all' for all atoms): ")
 
-                if not os.path.exists(predicted_folder):
-                    print(f"Skipping {native_pdb}: Predicted folder not found.")
-                    continue
+        # Optional on-disk cache of parsed structures, reused across runs
+        config["cache_folder"] = input("Enter the folder for the parsed structure cache (leave empty to disable): ").strip()
 
-                # Compute CG-RMSD and generate the plot
-                process_pdb_folder(native_pdb, predicted_folder, output_file, plots_folder, atom_names, all_atoms)
+        # Number of worker processes for step 1
+        workers_input = input("Enter the number of worker processes (default 1): ").strip()
+        config["workers"] = int(workers_input) if workers_input else 1
 
-    # Step 2: Merge CG-RMSD and scores
-    if start_step <= 2:
-        print("\nStep 2: Merge CG-RMSD files and scores")
-        cgRMSD_folder = input("Enter the folder containing CG-RMSD files: ")
-        metrics_folder = input("Enter the folder containing score files: ")
-        merged_folder = input("Enter the folder to save merged files (create this folder): ")
-
-        os.makedirs(merged_folder, exist_ok=True)
-
-        for cgRMSD_file in os.listdir(cgRMSD_folder):
-            if cgRMSD_file.endswith(".csv"):
-                structure_id = os.path.splitext(cgRMSD_file)[0]
-                cgRMSD_path = os.path.join(cgRMSD_folder, cgRMSD_file)
-                metrics_path = os.path.join(metrics_folder, f"{structure_id}.csv")
-                merged_file = os.path.join(merged_folder, f"merged_{structure_id}.csv")
-
-                if not os.path.exists(metrics_path):
-                    print(f"Skipping {cgRMSD_file}: Score file {metrics_path} not found.")
-                    continue
+        # Superposition plots are rendered after scoring, only when asked for
+        config["plots"] = input("Which superposition plots to render (none, all, best:K, worst:K; default none): ").strip()
 
-                print(f"Merging: {cgRMSD_path} with {metrics_path}")
-                merge_metrics_and_cgRMSD(cgRMSD_path, metrics_path, merged_file)
+    if start_step <= 2:
+        if "cgRMSD_folder" not in config and not config["results_store"]:
+            config["cgRMSD_folder"] = input("Enter the folder containing CG-RMSD files: ")
+        config["metrics_folder"] = input("Enter the folder containing score files: ")
+        if not config["results_store"]:
+            config["merged_folder"] = input("Enter the folder to save merged files (create this folder): ")
 
-    # Step 3: Compute correlations and save plots
     if start_step <= 3:
-        print("\nStep 3: Compute correlations and generate plots")
-        plots_base_folder = input("Enter the folder to save correlation plots (create this folder): ")
-        corr_results_base_folder = input("Enter the folder to save correlation results (create this folder): ")
-
-        os.makedirs(corr_results_base_folder, exist_ok=True)
-        os.makedirs(plots_base_folder, exist_ok=True)
+        if "merged_folder" not in config and not config["results_store"]:
+            config["merged_folder"] = input("Enter the folder containing merged files: ")
+        config["corr_plots_folder"] = input("Enter the folder to save correlation plots (create this folder): ")
+        if not config["results_store"]:
+            config["corr_results_folder"] = input("Enter the folder to save correlation results (create this folder): ")
 
-        for merged_file in os.listdir(merged_folder):
-            if merged_file.endswith(".csv"):
-                structure_id = os.path.splitext(merged_file)[0].replace("merged_", "")
-                merged_file_path = os.path.join(merged_folder, merged_file)
+    return config
 
-                corr_results_file = os.path.join(corr_results_base_folder, f"corr_{structure_id}.txt")
-                plots_folder = os.path.join(plots_base_folder, f"CORR_IMG_{structure_id}")
-                os.makedirs(plots_folder, exist_ok=True)
 
-                # Compute correlations
-                print(f"Computing correlations for {merged_file}...")
-                correlations = compute_correlations(merged_file_path)
+def parse_arguments(argv):
+    """
+    Parse the command-line arguments of the pipeline.
+    """
+    parser = argparse.ArgumentParser(
+        description="CG-RMSD pipeline. Without --config, the paths and options are asked interactively.")
+    parser.add_argument("--config", help="JSON configuration file declaring inputs, outputs, atoms and steps.")
+    parser.add_argument("--steps", help="Comma-separated steps to run (e.g. '2,3'), overriding the configuration.")
+    parser.add_argument("--workers", type=int, help="Number of worker processes for step 1.")
+    parser.add_argument("--force", action="store_true", help="Rebuild every output, ignoring the manifest.")
+    args = parser.parse_args(argv)
+    if args.config is None and (args.steps or args.force):
+        parser.error("--steps and --force need --config")
+    return args
 
-                # Save correlations to a text file
-                with open(corr_results_file, "w") as f:
-                    for metric, corr in correlations.items():
-                        f.write(f"{metric}:\n")
-                        f.write(f"  Pearson Correlation: r = {corr['pearson'][0]:.3f}, p = {corr['pearson'][1]:.3e}\n")
-                        f.write(f"  Spearman Correlation: r = {corr['spearman'][0]:.3f}, p = {corr['spearman'][1]:.3e}\n\n")
-                print(f"Correlations saved for {structure_id}.")
 
-                # Generate and save correlation plots
-                plot_correlations(merged_file_path, plots_folder)
-
-    print("\nWorkflow completed successfully!")
+def main(argv=None):
+    args = parse_arguments(sys.argv[1:] if argv is None else argv)
+    if args.config is None:
+        # Interactive mode: every output is rebuilt
+        config, manifest = ask_config(), None
+    else:
+        config = load_config(args.config)
+        if args.steps:
+            config["steps"] = [int(step) for step in args.steps.split(",")]
+        manifest = Manifest(config["manifest"])
+        if args.force:
+            manifest.entries = {}
+    if args.workers:
+        config["workers"] = args.workers
+    run_pipeline(config, manifest)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
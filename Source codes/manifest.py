@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+from cg_core import is_structure_file
+
+
+def file_signature(file_path):
+    """
+    Hash the content of a file.
+
+    :param file_path: Path to the file.
+    :return: Hexadecimal SHA-1 digest of the file content.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def folder_signature(folder):
+    """
+    Hash the listing of a folder: name, size and modification time of every structure file (see is_structure_file).
+
+    Adding, removing or rewriting one file changes the signature, without reading the files.
+
+    :param folder: Path to the folder.
+    :return: Hexadecimal SHA-1 digest.
+    """
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(folder)):
+        if is_structure_file(name):
+            stat = os.stat(os.path.join(folder, name))
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def combine_signatures(*parts):
+    """
+    Combine input signatures and parameters into one signature.
+
+    :param parts: JSON-serializable values (signatures, parameters).
+    :return: Hexadecimal SHA-1 digest.
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    Record of the input signature each pipeline output was built from.
+
+    An output is up to date when it exists and the signature of its inputs has not changed
+    since it was recorded, so a re-run only rebuilds the outputs whose inputs changed.
+    """
+
+    def __init__(self, manifest_file):
+        """
+        :param manifest_file: Path to the JSON manifest file (created on first save).
+        """
+        self.manifest_file = manifest_file
+        self.entries = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as handle:
+                self.entries = json.load(handle)
+
+    def is_current(self, key, signature, outputs=()):
+        """
+        Check whether an output is up to date.
+
+        :param key: Name of the output (usually its path).
+        :param signature: Signature of the inputs the output would be built from.
+        :param outputs: Paths of the files that must exist for the output to be up to date.
+        :return: Boolean.
+        """
+        return self.entries.get(key) == signature and all(os.path.exists(path) for path in outputs)
+
+    def record(self, key, signature):
+        """
+        Record the signature of the inputs an output was built from.
+        """
+        self.entries[key] = signature
+
+    def save(self):
+        """
+        Write the manifest to disk.
+        """
+        directory = os.path.dirname(self.manifest_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_file = f"{self.manifest_file}.tmp"
+        with open(temp_file, 'w') as handle:
+            json.dump(self.entries, handle, indent=2, sort_keys=True)
+        os.replace(temp_file, self.manifest_file)
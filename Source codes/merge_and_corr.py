@@ -1,8 +1,8 @@
 import os
 import pandas as pd
 import numpy as np
-from scipy.stats import pearsonr, spearmanr
-import matplotlib.pyplot as plt
+from correlation_engine import correlate_arrays, correlation_table, CORRELATION_COLUMNS
+from instrumentation import timed
 
 
 # Ensure directory exists
@@ -15,6 +15,7 @@ def ensure_dir_exists(directory):
         os.makedirs(directory)
 
 
+@timed("merge")
 def merge_metrics_and_cgRMSD(cgRMSD_file, metrics_file, output_file):
     """
     Merge the CG-RMSD CSV file with the metrics CSV file by aligning on the 'Model' column.
@@ -45,69 +46,95 @@ def merge_metrics_and_cgRMSD(cgRMSD_file, metrics_file, output_file):
 
 
 # Compute Correlations
-def compute_correlations(data_file):
+def cg_rmsd_columns(data_file):
+    """
+    List the CG-RMSD columns of a CSV file ('CG-RMSD', or one 'CG-RMSD <representation>' per representation of a sweep).
+
+    :param data_file: Path to the CSV file containing CG-RMSD values.
+    :return: List of column names.
+    """
+    columns = pd.read_csv(data_file, nrows=0).columns
+    return [column for column in columns if column.startswith("CG-RMSD")]
+
+
+def compute_correlations(data_file, cg_column="CG-RMSD"):
     """
     Compute Pearson and Spearman correlations between CG-RMSD and other metrics (RMSD, MCQ, TM-score).
 
     :param data_file: Path to the CSV file containing CG-RMSD and metrics.
+    :param cg_column: Name of the CG-RMSD column to correlate.
     :return: Dictionary of correlation results for each metric.
     """
     # Load the merged CSV file
-    data = pd.read_csv(data_file)
+    return correlate_data(pd.read_csv(data_file), cg_column)
+
+
+@timed("correlate")
+def correlate_data(data, cg_column="CG-RMSD"):
+    """
+    Compute Pearson and Spearman correlations between CG-RMSD and other metrics (RMSD, MCQ, TM-score).
 
+    :param data: DataFrame containing the CG-RMSD column and the RMSD, MCQ and TM-score columns.
+    :param cg_column: Name of the CG-RMSD column to correlate.
+    :return: Dictionary of correlation results for each metric.
+    """
     # Extract relevant columns
-    cgRMSD = data["CG-RMSD"]
+    cgRMSD = pd.to_numeric(data[cg_column], errors="coerce")
     rmsd = data["RMSD"]
     mcq = data["MCQ"]
     tm_score = data["TM-score"]
 
     # Filter out rows with NaN or inf values to avoid errors during correlation computation
     valid_data = data[np.isfinite(cgRMSD) & np.isfinite(rmsd) & np.isfinite(mcq) & np.isfinite(tm_score)]
+    cgRMSD = cgRMSD[valid_data.index]
 
     if valid_data.empty:
         raise ValueError("Data contains only NaN or inf values after filtering. Cannot compute correlations.")
 
-    # Extract cleaned columns
-    cgRMSD = valid_data["CG-RMSD"]
-    rmsd = valid_data["RMSD"]
-    mcq = valid_data["MCQ"]
-    tm_score = valid_data["TM-score"]
-
-    # Compute Pearson and Spearman correlations for each metric
+    # Compute Pearson and Spearman correlations for all metrics at once
+    metrics = ["RMSD", "MCQ", "TM-score"]
+    results = correlate_arrays(cgRMSD.to_numpy(dtype=float)[None, :, None],
+                               valid_data[metrics].to_numpy(dtype=float)[None, :, :])
     correlations = {
-        "RMSD": {
-            "pearson": pearsonr(cgRMSD, rmsd),
-            "spearman": spearmanr(cgRMSD, rmsd),
-        },
-        "MCQ": {
-            "pearson": pearsonr(cgRMSD, mcq),
-            "spearman": spearmanr(cgRMSD, mcq),
-        },
-        "TM-score": {
-            "pearson": pearsonr(cgRMSD, tm_score),
-            "spearman": spearmanr(cgRMSD, tm_score),
-        },
+        metric: {
+            "pearson": (results["pearson_r"][0, 0, k], results["pearson_p"][0, 0, k]),
+            "spearman": (results["spearman_r"][0, 0, k], results["spearman_p"][0, 0, k]),
+        }
+        for k, metric in enumerate(metrics)
     }
 
     return correlations
 
 
 # Plot Correlations
-def plot_correlations(data_file, output_folder):
+def plot_correlations(data_file, output_folder, cg_column="CG-RMSD"):
     """
     Plot scatter plots of CG-RMSD vs other metrics and save them to the specified folder.
 
     :param data_file: Path to the CSV file containing CG-RMSD and metrics.
     :param output_folder: Folder to save the scatter plot images.
+    :param cg_column: Name of the CG-RMSD column to plot.
     """
+    # Load the merged CSV file
+    plot_correlation_data(pd.read_csv(data_file), output_folder, cg_column)
+
+
+@timed("plot")
+def plot_correlation_data(data, output_folder, cg_column="CG-RMSD"):
+    """
+    Plot scatter plots of CG-RMSD vs other metrics and save them to the specified folder.
+
+    :param data: DataFrame containing the CG-RMSD column and the RMSD, MCQ and TM-score columns.
+    :param output_folder: Folder to save the scatter plot images.
+    :param cg_column: Name of the CG-RMSD column to plot.
+    """
+    import matplotlib.pyplot as plt
+
     # Ensure the output folder exists
     ensure_dir_exists(output_folder)
 
-    # Load the merged CSV file
-    data = pd.read_csv(data_file)
-
     # Extract relevant columns
-    cgRMSD = data["CG-RMSD"]
+    cgRMSD = pd.to_numeric(data[cg_column], errors="coerce")
     rmsd = data["RMSD"]
     mcq = data["MCQ"]
     tm_score = data["TM-score"]
@@ -116,8 +143,8 @@ def plot_correlations(data_file, output_folder):
     plot_path = os.path.join(output_folder, "cg_rmsd_vs_rmsd.png")
     plt.figure()
     plt.scatter(cgRMSD, rmsd, alpha=0.7)
-    plt.title("CG-RMSD vs RMSD")
-    plt.xlabel("CG-RMSD")
+    plt.title(f"{cg_column} vs RMSD")
+    plt.xlabel(cg_column)
     plt.ylabel("RMSD")
     plt.grid()
     plt.savefig(plot_path)
@@ -128,8 +155,8 @@ def plot_correlations(data_file, output_folder):
     plot_path = os.path.join(output_folder, "cg_rmsd_vs_mcq.png")
     plt.figure()
     plt.scatter(cgRMSD, mcq, alpha=0.7)
-    plt.title("CG-RMSD vs MCQ")
-    plt.xlabel("CG-RMSD")
+    plt.title(f"{cg_column} vs MCQ")
+    plt.xlabel(cg_column)
     plt.ylabel("MCQ")
     plt.grid()
     plt.savefig(plot_path)
@@ -140,10 +167,51 @@ def plot_correlations(data_file, output_folder):
     plot_path = os.path.join(output_folder, "cg_rmsd_vs_tm_score.png")
     plt.figure()
     plt.scatter(cgRMSD, tm_score, alpha=0.7)
-    plt.title("CG-RMSD vs TM-score")
-    plt.xlabel("CG-RMSD")
+    plt.title(f"{cg_column} vs TM-score")
+    plt.xlabel(cg_column)
     plt.ylabel("TM-score")
     plt.grid()
     plt.savefig(plot_path)
     plt.close()
     print(f"Plot saved: {plot_path}")
+
+
+# Results store
+def merged_frames(store, structures=None):
+    """
+    Load the merged CG-RMSD and metrics data of the results store, one DataFrame per (structure, representation).
+
+    The frames use the column names of the merged CSV files ('Model', 'CG-RMSD', 'RMSD', 'MCQ', 'TM-score'),
+    so they can be passed to correlate_data and plot_correlation_data.
+
+    :param store: ResultsStore holding CG-RMSD values and metrics.
+    :param structures: Optional list of structure ids.
+    :return: Dictionary {(structure, representation): DataFrame}.
+    """
+    merged = store.merged(structures).rename(columns={
+        "model": "Model", "cg_rmsd": "CG-RMSD", "coverage": "Coverage",
+        "rmsd": "RMSD", "mcq": "MCQ", "tm_score": "TM-score",
+    })
+    return {key: group.drop(columns=["structure", "representation"]).reset_index(drop=True)
+            for key, group in merged.groupby(["structure", "representation"], sort=True)}
+
+
+@timed("correlate")
+def store_correlations(store, structures=None):
+    """
+    Compute the correlations of every (structure, representation) of the results store and save them in it.
+
+    All cells are computed at once by correlation_engine.correlation_table, including the rows of all
+    structures pooled together (structure 'ALL').
+
+    :param store: ResultsStore holding CG-RMSD values and metrics.
+    :param structures: Optional list of structure ids.
+    :return: DataFrame of the correlations table rows that were written.
+    """
+    correlations_df = correlation_table(store.merged(structures))
+    skipped = correlations_df["n"] < 2
+    for structure, representation in correlations_df.loc[skipped, ["structure", "representation"]].drop_duplicates().values:
+        print(f"Skipping {structure} ({representation}): not enough data to compute correlations.")
+    correlations_df = correlations_df.loc[~skipped, CORRELATION_COLUMNS].reset_index(drop=True)
+    store.write_correlations(correlations_df)
+    return correlations_df
@@ -0,0 +1,52 @@
+import re
+import functools
+import pandas as pd
+from cg_core import structure_name
+
+# Prediction file names: <predictor family>_<target>[_<model number>], e.g. alphafold3_rp13_3.pdb,
+# 3drna_rp14_bound_1.pdb or eprna_rp05.pdb
+MODEL_NAME = re.compile(r"^(?P<family>.+?)_(?P<target>rp\d+[A-Za-z0-9_]*?)(?:_(?P<number>\d+))?$")
+
+
+@functools.lru_cache(maxsize=None)
+def parse_model_name(model):
+    """
+    Split a prediction file name into its predictor family, target and model number.
+
+    Names that do not follow the '<family>_<target>[_<number>]' pattern keep the part before
+    the first underscore as family, with no target nor number. Results are cached, so every name
+    is parsed once per process however many times its results are aggregated.
+
+    :param model: Prediction file name, e.g. 'alphafold3_rp13_3.pdb'.
+    :return: Tuple (family, target, number), e.g. ('alphafold3', 'rp13', 3); target and number may be None.
+    """
+    name = structure_name(model)
+    match = MODEL_NAME.match(name)
+    if match is None:
+        return name.split("_")[0], None, None
+    number = match.group("number")
+    return match.group("family"), match.group("target"), int(number) if number is not None else None
+
+
+def model_family(model):
+    """
+    Predictor family of a prediction file name, e.g. 'alphafold3' for 'alphafold3_rp13_3.pdb'.
+    """
+    return parse_model_name(model)[0]
+
+
+def model_metadata(models):
+    """
+    Parse prediction file names into categorical family and target columns and a model number column.
+
+    Every distinct name is parsed once (see parse_model_name), so a long results table (one row per model
+    and representation) is annotated at the cost of its distinct models.
+
+    :param models: Sequence or Series of prediction file names.
+    :return: DataFrame with one row per name: 'family' and 'target' (categorical) and 'number' (nullable integer).
+    """
+    codes, names = pd.factorize(pd.Series(models, dtype=object))
+    parsed = pd.DataFrame([parse_model_name(name) for name in names], columns=["family", "target", "number"],
+                          index=range(len(names)))
+    parsed = parsed.astype({"family": "category", "target": "category", "number": "Int64"})
+    return parsed.iloc[codes].reset_index(drop=True)
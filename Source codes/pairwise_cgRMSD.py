@@ -0,0 +1,253 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from cg_core import prepare_native, score_predictions, representation_slug, coverage_column, is_structure_file
+
+
+def load_decoys(predicted_paths, representation, cache=None, reference=None, min_coverage=0.5):
+    """
+    Parse a set of decoys and put the atoms of one representation in a common order.
+
+    Atoms are matched to a reference structure (by default the first decoy) with the same
+    matching as the scoring step, and only the atoms present in every kept decoy are used,
+    so all pairwise distances are computed on the same atom set.
+
+    :param predicted_paths: List of paths to the decoy PDB files.
+    :param representation: Representation string, e.g. "C4'" or "P+C4'+N1/N9".
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param reference: Optional path to the structure defining the atom order (e.g. the native).
+    :param min_coverage: Decoys matching a smaller fraction of the reference atoms are left out.
+    :return: Tuple (models, coordinates): list of model names and numpy array (M, N, 3).
+    """
+    column = "CG-RMSD"
+    selections = {column: (representation, representation_slug(representation))}
+    native = prepare_native(reference or predicted_paths[0], selections, cache)
+    if column not in native["columns"]:
+        raise ValueError(f"No atoms found for {representation} in the reference structure.")
+    results, superpositions, errors = score_predictions(native, predicted_paths, cache)
+    for model, message in errors:
+        print(f"Error processing {model}: {message}")
+    if column not in superpositions:
+        raise ValueError("No decoy matches the reference structure.")
+
+    models, coordinates = superpositions[column][:2]
+    coverages = np.array([results[model][coverage_column(column)] for model in models])
+    kept = coverages >= min_coverage
+    for model, coverage in zip(models, coverages):
+        if coverage < min_coverage:
+            print(f"Skipping {model}: only {coverage:.0%} of the reference atoms are matched.")
+
+    models = [model for model, keep in zip(models, kept) if keep]
+    coordinates = coordinates[kept]
+    common = np.isfinite(coordinates).all(axis=(0, 2))
+    if common.sum() < 3:
+        raise ValueError("Fewer than 3 atoms are present in every decoy.")
+    if not common.all():
+        print(f"{common.sum()} of {len(common)} reference atoms are present in every decoy.")
+    return models, coordinates[:, common]
+
+
+def condensed_index(i, j, n):
+    """
+    Position of the pair (i, j), i < j, in a condensed distance matrix of n items (scipy order).
+    """
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def tile_size(n_models, n_atoms, max_bytes):
+    """
+    Largest tile of model pairs whose working arrays fit in `max_bytes`.
+
+    A tile of t x t pairs holds two coordinate blocks (t * N * 3 values each) and, per pair,
+    a 3x3 covariance matrix with its SVD and determinant (about 40 float64 values).
+    """
+    pair_bytes = 40 * 8
+    block_bytes = 2 * n_atoms * 3 * 8
+    tile = int((-block_bytes + np.sqrt(block_bytes ** 2 + 4 * pair_bytes * max_bytes)) / (2 * pair_bytes))
+    return int(np.clip(tile, 1, max(n_models, 1)))
+
+
+def pairwise_rmsd(first, second, first_norms, second_norms):
+    """
+    CG-RMSD after optimal superposition of every pair of two blocks of centered structures.
+
+    All the covariance matrices of the tile come from one matrix product, and only the singular
+    values are needed (Kabsch RMSD, with the sign of the determinant correcting reflections).
+
+    :param first: Numpy array (A, N, 3) of centered coordinates.
+    :param second: Numpy array (B, N, 3) of centered coordinates.
+    :param first_norms: Numpy array (A,) of the squared norms of the first block.
+    :param second_norms: Numpy array (B,) of the squared norms of the second block.
+    :return: Numpy array (A, B) of CG-RMSD values.
+    """
+    n_first, n_atoms, _ = first.shape
+    n_second = second.shape[0]
+    products = (first.transpose(0, 2, 1).reshape(n_first * 3, n_atoms)
+                @ second.transpose(1, 0, 2).reshape(n_atoms, n_second * 3))
+    covariances = products.reshape(n_first, 3, n_second, 3).transpose(0, 2, 1, 3)
+    singular_values = np.linalg.svd(covariances, compute_uv=False)
+    signs = np.sign(np.linalg.det(covariances))
+    signs[signs == 0] = 1.0
+    singular_values[..., 2] *= signs
+    squared_deviation = first_norms[:, None] + second_norms[None, :] - 2.0 * singular_values.sum(axis=2)
+    return np.sqrt(np.maximum(squared_deviation, 0.0) / n_atoms)
+
+
+# Per-process state of the pairwise workers, set once by _init_worker
+_worker_centered = None
+_worker_norms = None
+
+
+def _init_worker(centered, norms):
+    """
+    Receive the centered decoys once per worker process.
+    """
+    global _worker_centered, _worker_norms
+    _worker_centered = centered
+    _worker_norms = norms
+
+
+def _tile_task(row_start, row_stop, column_start, column_stop):
+    """
+    Compute one tile of the upper triangle in a worker process.
+    """
+    tile = pairwise_rmsd(_worker_centered[row_start:row_stop], _worker_centered[column_start:column_stop],
+                         _worker_norms[row_start:row_stop], _worker_norms[column_start:column_stop])
+    return row_start, column_start, tile.astype(np.float32)
+
+
+def pairwise_cgRMSD(coordinates, output_file, max_bytes=256 * 1024 ** 2, workers=1):
+    """
+    Compute the CG-RMSD of every pair of decoys into a condensed distance matrix on disk.
+
+    The upper triangle of the M x M matrix is split into tiles sized to fit in `max_bytes`,
+    every tile is one batched superposition, and tiles are spread over worker processes.
+    The result is a float32 `.npy` file in the condensed order of scipy.spatial.distance,
+    returned memory-mapped so it can be passed directly to scipy.cluster.hierarchy.linkage.
+
+    :param coordinates: Numpy array (M, N, 3) of decoy coordinates in a common atom order.
+    :param output_file: Path to the output `.npy` file.
+    :param max_bytes: Memory ceiling of the working arrays of one tile.
+    :param workers: Number of worker processes.
+    :return: Memory-mapped numpy array of length M * (M - 1) / 2.
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    n_models, n_atoms, _ = coordinates.shape
+    if n_models < 2:
+        raise ValueError("At least 2 decoys are needed for a pairwise matrix.")
+    centered = coordinates - coordinates.mean(axis=1, keepdims=True)
+    norms = np.einsum("mni,mni->m", centered, centered)
+
+    tile = tile_size(n_models, n_atoms, max_bytes)
+    tasks = [(row, min(row + tile, n_models), column, min(column + tile, n_models))
+             for row in range(0, n_models, tile) for column in range(row, n_models, tile)]
+    print(f"{n_models} decoys, {n_atoms} atoms: {len(tasks)} tile(s) of up to {tile} x {tile} pairs.")
+
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_file = f"{os.path.splitext(output_file)[0]}.{os.getpid()}.tmp.npy"
+    distances = np.lib.format.open_memmap(temp_file, mode="w+", dtype=np.float32,
+                                          shape=(n_models * (n_models - 1) // 2,))
+
+    if workers > 1 and len(tasks) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(centered, norms))
+        tiles = executor.map(_tile_task, *zip(*tasks))
+    else:
+        executor = None
+        _init_worker(centered, norms)
+        tiles = (_tile_task(*task) for task in tasks)
+
+    try:
+        # Copy the upper-triangle part of every tile, one contiguous row segment at a time
+        for row_start, column_start, values in tiles:
+            for offset, row in enumerate(range(row_start, row_start + values.shape[0])):
+                first_column = max(column_start, row + 1)
+                last_column = column_start + values.shape[1]
+                if first_column >= last_column:
+                    continue
+                start = condensed_index(row, first_column, n_models)
+                distances[start:start + last_column - first_column] = values[offset, first_column - column_start:]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    distances.flush()
+    del distances
+    os.replace(temp_file, output_file)
+    return np.load(output_file, mmap_mode="r")
+
+
+def models_file(output_file):
+    """
+    Return the path of the file listing the models of a pairwise matrix, in matrix order.
+    """
+    return f"{os.path.splitext(output_file)[0]}_models.txt"
+
+
+def cluster_representatives(distances, models, n_clusters, method="average"):
+    """
+    Cluster the decoys and pick the medoid of each cluster as its representative.
+
+    :param distances: Condensed distance matrix returned by pairwise_cgRMSD.
+    :param models: List of the model names, in matrix order.
+    :param n_clusters: Maximum number of clusters.
+    :param method: Linkage method of scipy.cluster.hierarchy.linkage.
+    :return: List of (cluster, representative model, cluster size), largest clusters first.
+    """
+    from scipy.cluster.hierarchy import linkage, fcluster
+
+    labels = fcluster(linkage(np.asarray(distances, dtype=np.float64), method=method), n_clusters, criterion="maxclust")
+    n_models = len(models)
+    clusters = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        # Medoid: the member with the smallest sum of distances to the other members
+        rows, columns = np.triu_indices(len(members), k=1)
+        within = np.zeros((len(members), len(members)))
+        within[rows, columns] = distances[condensed_index(members[rows], members[columns], n_models)]
+        within[columns, rows] = within[rows, columns]
+        medoid = members[np.argmin(within.sum(axis=1))]
+        clusters.append((int(label), models[medoid], len(members)))
+    return sorted(clusters, key=lambda cluster: -cluster[2])
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command-line arguments of the pairwise CG-RMSD computation.
+    """
+    parser = argparse.ArgumentParser(description="All-vs-all CG-RMSD matrix of the decoys of one target.")
+    parser.add_argument("predicted_folder", help="Folder containing the decoy PDB files.")
+    parser.add_argument("output_file", help="Output .npy file of the condensed distance matrix.")
+    parser.add_argument("--representation", default="C4'", help="Representation, e.g. \"C4'\" or \"P+C4'+N1/N9\".")
+    parser.add_argument("--reference", help="Structure defining the atom order (default: the first decoy).")
+    parser.add_argument("--cache-folder", help="Folder of the parsed structure cache.")
+    parser.add_argument("--max-memory", type=float, default=256, help="Memory ceiling of one tile, in MB.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes.")
+    parser.add_argument("--clusters", type=int, help="Print the representatives of this many clusters.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    cache = None
+    if args.cache_folder:
+        from structure_cache import AtomTableCache
+        cache = AtomTableCache(args.cache_folder)
+
+    predicted_paths = [os.path.join(args.predicted_folder, name)
+                       for name in sorted(os.listdir(args.predicted_folder)) if is_structure_file(name)]
+    models, coordinates = load_decoys(predicted_paths, args.representation, cache, args.reference)
+    distances = pairwise_cgRMSD(coordinates, args.output_file, int(args.max_memory * 1024 ** 2), args.workers)
+    with open(models_file(args.output_file), "w") as handle:
+        handle.write("\n".join(models) + "\n")
+    print(f"Pairwise CG-RMSD matrix saved: {args.output_file}")
+
+    if args.clusters:
+        for label, representative, size in cluster_representatives(distances, models, args.clusters):
+            print(f"Cluster {label}: {size} decoy(s), representative {representative}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ import os
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-from scipy.stats import pearsonr, spearmanr
+from correlation_engine import correlation_table
 
 
 def analyze_correlation():
@@ -20,22 +20,29 @@ def analyze_correlation():
         print("No CSV files found in the specified folder.")
         return
 
-    # Load the first CSV file
-    file_path = os.path.join(folder_path, files[0])
-    print(f"Processing file: {file_path}")
-    df = pd.read_csv(file_path)
-
-    # Debugging: Print available columns
-    print("Columns in the file:", df.columns.tolist())
-
-    # Remove extra spaces in column names (if any)
-    df.columns = df.columns.str.strip()
-
-    # Check for required columns
+    # Load every CSV file, one structure per file
     required_columns = ["CG-RMSD", "RMSD", "MCQ", "TM-score"]
-    if not all(col in df.columns for col in required_columns):
-        print(f"The file does not contain all required columns: {required_columns}")
+    frames = []
+    for file in sorted(files):
+        file_path = os.path.join(folder_path, file)
+        print(f"Processing file: {file_path}")
+        file_df = pd.read_csv(file_path)
+
+        # Remove extra spaces in column names (if any)
+        file_df.columns = file_df.columns.str.strip()
+
+        # Check for required columns
+        if not all(col in file_df.columns for col in required_columns):
+            print(f"The file does not contain all required columns: {required_columns}")
+            continue
+        file_df["structure"] = os.path.splitext(file)[0]
+        file_df["model"] = file_df["Model"] if "Model" in file_df.columns else file_df.index
+        frames.append(file_df)
+
+    if not frames:
+        print("No CSV file contains the required columns.")
         return
+    df = pd.concat(frames, ignore_index=True)
 
     # Ask for the correlation type
     correlation_type = input("Which correlation would you like to plot? (pearson/spearman/both): ").strip().lower()
@@ -48,14 +55,13 @@ def analyze_correlation():
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
 
-    # Calculate correlations
-    correlation_results = {}
+    # Calculate the correlations of every structure and of all structures pooled ('ALL') at once
     metrics = ["RMSD", "MCQ", "TM-score"]
-
-    if correlation_type in ["pearson", "both"]:
-        correlation_results["Pearson"] = {metric: pearsonr(df["CG-RMSD"], df[metric])[0] for metric in metrics}
-    if correlation_type in ["spearman", "both"]:
-        correlation_results["Spearman"] = {metric: spearmanr(df["CG-RMSD"], df[metric])[0] for metric in metrics}
+    correlations = correlation_table(df.assign(representation="CG-RMSD"), value_column="CG-RMSD", metrics=metrics)
+    correlation_results = {
+        name: correlations.pivot(index="metric", columns="structure", values=f"{name.lower()}_r").loc[metrics]
+        for name in ["Pearson", "Spearman"]
+    }
 
     # Plot correlation scatterplots
     for metric in metrics:
@@ -89,14 +95,14 @@ def analyze_correlation():
 
     # Create a heatmap for correlations
     if correlation_type in ["pearson", "both"]:
-        pearson_heatmap = pd.DataFrame(correlation_results["Pearson"], index=["Pearson"]).T
+        pearson_heatmap = correlation_results["Pearson"]
         sns.heatmap(pearson_heatmap, annot=True, cmap="coolwarm", cbar=True)
         plt.title("Pearson Correlation Heatmap")
         plt.savefig(os.path.join(save_folder, "pearson_heatmap.png"))
         plt.close()
 
     if correlation_type in ["spearman", "both"]:
-        spearman_heatmap = pd.DataFrame(correlation_results["Spearman"], index=["Spearman"]).T
+        spearman_heatmap = correlation_results["Spearman"]
         sns.heatmap(spearman_heatmap, annot=True, cmap="coolwarm", cbar=True)
         plt.title("Spearman Correlation Heatmap")
         plt.savefig(os.path.join(save_folder, "spearman_heatmap.png"))
@@ -0,0 +1,287 @@
+import os
+import numpy as np
+from cg_core import (load_atom_table, select_representation, match_atoms, score_predictions, superpose_batch,
+                     _chain_residues, is_structure_file, read_ahead, CoordinateBuffers)
+
+# Backbone and glycosidic torsions of MCQ: (residue offset, atom name) of the 4 atoms of each angle
+TORSIONS = {
+    "alpha": ((-1, "O3'"), (0, "P"), (0, "O5'"), (0, "C5'")),
+    "beta": ((0, "P"), (0, "O5'"), (0, "C5'"), (0, "C4'")),
+    "gamma": ((0, "O5'"), (0, "C5'"), (0, "C4'"), (0, "C3'")),
+    "delta": ((0, "C5'"), (0, "C4'"), (0, "C3'"), (0, "O3'")),
+    "epsilon": ((0, "C4'"), (0, "C3'"), (0, "O3'"), (1, "P")),
+    "zeta": ((0, "C3'"), (0, "O3'"), (1, "P"), (1, "O5'")),
+}
+CHI_PURINE = ((0, "O4'"), (0, "C1'"), (0, "N9"), (0, "C4"))
+CHI_PYRIMIDINE = ((0, "O4'"), (0, "C1'"), (0, "N1"), (0, "C2"))
+
+# Atom of each residue used by the TM-score of RNA structures
+TM_ATOM = "C3'"
+
+
+def heavy_atoms(atom_table):
+    """
+    Build the boolean mask of the non-hydrogen atoms of an atom table.
+    """
+    names = np.char.lstrip(atom_table["name"].astype(str), "0123456789")
+    return ~np.char.startswith(names, "H")
+
+
+def rna_d0(length):
+    """
+    Distance scale of the TM-score of RNA structures (as in RNA-align / US-align).
+
+    :param length: Number of residues of the native structure.
+    :return: d0 in Angstroms.
+    """
+    if length < 12:
+        return 0.3
+    if length < 16:
+        return 0.4
+    if length < 20:
+        return 0.5
+    if length < 24:
+        return 0.6
+    if length < 30:
+        return 0.7
+    return 0.6 * np.sqrt(length - 0.5) - 2.5
+
+
+def tm_score(native_atoms, predicted_atoms, d0=None, max_iterations=20, batch_atoms=2 * 1024 ** 2):
+    """
+    TM-score of a batch of predictions against the native, one atom per residue.
+
+    The superposition maximizing the score is searched as in the TM-score program: starting
+    from the superposition of fragments of length L, L/2, L/4, ... (down to 4 residues), the atoms
+    closer than a distance cutoff are re-superposed until the selection stops changing.
+    Every refinement step superposes all the (fragment, prediction) pairs still changing at once.
+
+    :param native_atoms: Numpy array (L, 3) of native coordinates (e.g. C3' atoms).
+    :param predicted_atoms: Numpy array (M, L, 3) in native order, NaN for unmatched residues.
+    :param d0: Distance scale; defaults to rna_d0(L).
+    :param max_iterations: Largest number of refinements of one starting superposition.
+    :param batch_atoms: Number of atoms ((fragment, prediction) pairs x L) superposed in one batch.
+    :return: Numpy array (M,) of TM-scores (NaN for predictions with fewer than 3 matched residues).
+    """
+    length = len(native_atoms)
+    d0 = rna_d0(length) if d0 is None else d0
+    d_search = float(np.clip(d0, 4.5, 8.0))
+    present = np.isfinite(predicted_atoms).all(axis=2)
+    scored = present.sum(axis=1) >= 3
+    best = np.full(len(predicted_atoms), np.nan)
+    if not scored.any():
+        return best
+    predicted_atoms = predicted_atoms[scored]
+    present = present[scored]
+    scores = np.zeros(len(predicted_atoms))
+
+    # Starting fragments
+    seeds = []
+    fragment = length
+    while fragment >= min(4, length):
+        step = max(fragment // 2, 1)
+        for start in range(0, length - fragment + 1, step):
+            seed = np.zeros(length, dtype=bool)
+            seed[start:start + fragment] = True
+            seeds.append(seed)
+        if fragment == 4 or fragment <= 1:
+            break
+        fragment = max(fragment // 2, 4)
+    seeds = np.array(seeds)
+
+    # Every (fragment, prediction) pair is one member of the superposition batch, refined until its
+    # selection stops changing; chunks of pairs bound the memory
+    n_models = len(predicted_atoms)
+    pair_chunk = max(1, batch_atoms // length)
+    pair_seeds, pair_models = np.divmod(np.arange(len(seeds) * n_models), n_models)
+    for chunk_start in range(0, len(pair_seeds), pair_chunk):
+        models = pair_models[chunk_start:chunk_start + pair_chunk]
+        selection = present[models] & seeds[pair_seeds[chunk_start:chunk_start + pair_chunk]]
+        active = np.arange(len(models))
+        for _ in range(max_iterations):
+            # Pairs with fewer than 3 selected atoms fall back to all the matched atoms of the prediction
+            current = selection[active]
+            current = np.where((current.sum(axis=1) >= 3)[:, None], current, present[models[active]])
+            atoms = predicted_atoms[models[active]]
+            _, rotations, translations = superpose_batch(native_atoms, np.where(current[:, :, None], atoms, np.nan))
+            aligned = np.einsum("pni,pji->pnj", atoms, rotations) + translations[:, None, :]
+            distances = np.linalg.norm(aligned - native_atoms, axis=2)
+            np.fmax.at(scores, models[active], np.nansum(1.0 / (1.0 + (distances / d0) ** 2), axis=1) / length)
+
+            updated = present[models[active]] & (distances < d_search)
+            changed = (updated != current).any(axis=1)
+            selection[active] = updated
+            active = active[changed]
+            if active.size == 0:
+                break
+
+    best[scored] = scores
+    return best
+
+
+def dihedrals(p0, p1, p2, p3):
+    """
+    Dihedral angles (radians) of arrays of 4 points, vectorized over all leading axes.
+    """
+    b0 = p0 - p1
+    b1 = p2 - p1
+    b2 = p3 - p2
+    b1 = b1 / np.linalg.norm(b1, axis=-1, keepdims=True)
+    v = b0 - np.sum(b0 * b1, axis=-1, keepdims=True) * b1
+    w = b2 - np.sum(b2 * b1, axis=-1, keepdims=True) * b1
+    x = np.sum(v * w, axis=-1)
+    y = np.sum(np.cross(b1, v) * w, axis=-1)
+    return np.arctan2(y, x)
+
+
+def torsion_positions(native_table, rows):
+    """
+    Locate the atoms of every torsion of every native residue.
+
+    Neighboring residues are found by residue number (see cg_core._chain_residues), so the torsions
+    that need a residue missing from the native (across a numbering gap) are left out.
+
+    :param native_table: Atom table of the native structure.
+    :param rows: Native rows of the matched atoms (the atom order of the stacked predictions).
+    :return: Integer array (R, 7, 4) of the positions in `rows` of the atoms of the alpha ... zeta and chi
+             torsions of every residue; -1 for missing atoms.
+    """
+    chains, residues, _ = _chain_residues(native_table)
+    names, name_codes = np.unique(native_table["name"], return_inverse=True)
+    span = int(residues.max(initial=0)) + 3
+    keys = (chains[rows].astype(np.int64) * span + residues[rows] + 1) * len(names) + name_codes[rows]
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    # One entry per native residue: chain, residue index and whether it is a purine (has an N9 atom)
+    residue_keys = np.unique(chains[rows].astype(np.int64) * span + residues[rows] + 1)
+    name_index = {str(name): code for code, name in enumerate(names)}
+
+    def lookup(offset, name):
+        if name not in name_index:
+            return np.full(len(residue_keys), -1)
+        wanted = (residue_keys + offset) * len(names) + name_index[name]
+        found = np.clip(np.searchsorted(sorted_keys, wanted), 0, len(sorted_keys) - 1)
+        return np.where(sorted_keys[found] == wanted, order[found], -1)
+
+    def atoms(definition):
+        return np.stack([lookup(offset, name) for offset, name in definition], axis=1)
+
+    purine = lookup(0, "N9") >= 0
+    chi = np.where(purine[:, None], atoms(CHI_PURINE), atoms(CHI_PYRIMIDINE))
+    return np.stack([atoms(definition) for definition in TORSIONS.values()] + [chi], axis=1)
+
+
+def torsion_angles(atoms, torsions):
+    """
+    Compute the torsion angles of every residue of a batch of structures at once.
+
+    :param atoms: Numpy array (M, N, 3) of coordinates in native atom order, NaN for missing atoms.
+    :param torsions: Positions array (R, K, 4) returned by torsion_positions.
+    :return: Numpy array (M, R, K) of angles in radians, NaN where an atom is missing.
+    """
+    # A trailing NaN atom stands for the missing positions (-1)
+    atoms = np.concatenate((atoms, np.full((atoms.shape[0], 1, 3), np.nan)), axis=1)
+    points = atoms[:, torsions]
+    return dihedrals(points[..., 0, :], points[..., 1, :], points[..., 2, :], points[..., 3, :])
+
+
+def mcq(native_angles, predicted_angles):
+    """
+    Mean of Circular Quantities between the torsion angles of the native and of each prediction.
+
+    :param native_angles: Numpy array (R, K) of native angles in radians.
+    :param predicted_angles: Numpy array (M, R, K) of predicted angles in radians.
+    :return: Numpy array (M,) of MCQ values in degrees (NaN without any comparable angle).
+    """
+    difference = np.abs(predicted_angles - native_angles[None])
+    difference = np.minimum(difference, 2.0 * np.pi - difference)
+    valid = np.isfinite(difference)
+    sines = np.where(valid, np.sin(difference), 0.0).sum(axis=(1, 2))
+    cosines = np.where(valid, np.cos(difference), 0.0).sum(axis=(1, 2))
+    values = np.degrees(np.arctan2(sines, cosines))
+    return np.where(valid.any(axis=(1, 2)), values, np.nan)
+
+
+def prepare_metrics_native(native_pdb, cache=None):
+    """
+    Parse a native structure once and select its heavy atoms, in the format of cg_core.prepare_native.
+
+    :param native_pdb: Path to the native PDB file.
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :return: Dictionary with the native atom table and an 'RMSD' column of every heavy atom.
+    """
+    native_table = np.array(load_atom_table(native_pdb, cache))
+    mask = select_representation(native_table, "all") & heavy_atoms(native_table)
+    rows, _, _ = match_atoms(native_table, native_table, mask, mask)
+    return {"table": native_table, "columns": {"RMSD": {
+        "representation": "all", "mask": mask, "rows": rows, "atoms": native_table["xyz"][rows].astype(np.float64),
+    }}}
+
+
+def score_metrics(native_pdb, predicted_paths, cache=None, batch_size=16):
+    """
+    Compute the all-atom RMSD, TM-score and MCQ of the predictions of a native.
+
+    Each structure is parsed once (through the atom table cache when given). The predictions are scored
+    in batches of `batch_size`, as in step 1: all the heavy atoms of the predictions of a batch are matched
+    to the native and stacked in arrays reused by the next batch, then every metric is computed for the
+    whole batch at once, so memory does not grow with the number of predictions.
+
+    :param native_pdb: Path to the native PDB file.
+    :param predicted_paths: List of paths to predicted PDB files.
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param batch_size: Number of predictions scored at once.
+    :return: Tuple (metrics, errors): dictionary {model: (rmsd, mcq, tm_score)} and list of (model, message).
+    """
+    native = prepare_metrics_native(native_pdb, cache)
+    native_table = native["table"]
+    rows = native["columns"]["RMSD"]["rows"]
+    native_atoms = native["columns"]["RMSD"]["atoms"]
+    # TM-score on one atom per residue, normalized by the native length
+    tm_positions = np.flatnonzero(native_table["name"][rows] == TM_ATOM)
+    # MCQ over the backbone and glycosidic torsions of every residue
+    torsions = torsion_positions(native_table, rows)
+    native_angles = torsion_angles(native_atoms[None], torsions)[0]
+
+    metrics, errors = {}, []
+    tables = read_ahead(predicted_paths, cache)
+    buffers = CoordinateBuffers()
+    for start in range(0, len(predicted_paths), batch_size):
+        _, superpositions, batch_errors = score_predictions(native, predicted_paths[start:start + batch_size], cache,
+                                                            tables, buffers)
+        errors.extend(batch_errors)
+        if "RMSD" not in superpositions:
+            continue
+        models, stacked_atoms, _, _, rmsd, _ = superpositions["RMSD"]
+        tm_scores = tm_score(native_atoms[tm_positions], stacked_atoms[:, tm_positions])
+        mcq_values = mcq(native_angles, torsion_angles(stacked_atoms, torsions))
+        metrics.update((model, (rmsd[index], mcq_values[index], tm_scores[index]))
+                       for index, model in enumerate(models))
+    return metrics, errors
+
+
+def write_metrics_file(native_pdb, predicted_folder, metrics_file, cache=None, batch_size=16):
+    """
+    Score every prediction of a folder and write a score file in the format of data/SCORES.
+
+    :param native_pdb: Path to the native PDB file.
+    :param predicted_folder: Folder containing the predicted PDB files.
+    :param metrics_file: Path to the output CSV file (Model, RMSD, MCQ, TM-score).
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param batch_size: Number of predictions scored at once (see score_metrics).
+    :return: List of (model, message) for the files that could not be scored.
+    """
+    predicted_paths = [os.path.join(predicted_folder, name)
+                       for name in sorted(os.listdir(predicted_folder)) if is_structure_file(name)]
+    metrics, errors = score_metrics(native_pdb, predicted_paths, cache, batch_size)
+
+    directory = os.path.dirname(metrics_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(metrics_file, "w") as handle:
+        handle.write("Model, RMSD, MCQ, TM-score\n")
+        for model, (rmsd, mcq_value, tm_value) in metrics.items():
+            handle.write(f"{model},{rmsd:.3f},{mcq_value:.2f},{tm_value:.3f}\n")
+    print(f"Scores saved to {metrics_file}")
+    return errors
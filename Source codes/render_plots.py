@@ -0,0 +1,112 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # Headless backend: plots are only saved to files
+import matplotlib.pyplot as plt
+from compute_cgRMSD import ensure_dir_exists
+from instrumentation import timed
+
+
+def plot_points(true_atoms, p_atoms, rotation, translation, plot_file):
+    """
+    Plot the native, predicted, rotated, and translated atomic coordinates, and save to a file.
+
+    :param true_atoms: Numpy array (N, 3) of native atom coordinates.
+    :param p_atoms: Numpy array (N, 3) of predicted atom coordinates.
+    :param rotation: Rotation matrix (3, 3) superposing the prediction on the native.
+    :param translation: Translation vector (3,) applied after the rotation.
+    :param plot_file: Path to the image file.
+    """
+    rot_atoms = p_atoms @ rotation.T
+    trans_atoms = rot_atoms + translation
+
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection="3d")
+    ax.scatter(true_atoms[:, 0], true_atoms[:, 1], true_atoms[:, 2], label="Native atoms")
+    ax.scatter(p_atoms[:, 0], p_atoms[:, 1], p_atoms[:, 2], label="Predicted atoms")
+    ax.scatter(rot_atoms[:, 0], rot_atoms[:, 1], rot_atoms[:, 2], label="Rotated atoms")
+    ax.scatter(
+        trans_atoms[:, 0], trans_atoms[:, 1], trans_atoms[:, 2], label="Translated atoms"
+    )
+    plt.legend()
+    plt.savefig(plot_file)  # Save the plot
+    plt.close(fig)  # Close the plot to avoid memory leaks
+    print(f"Plot saved: {plot_file}")  # Log plot save
+
+
+def select_models(rmsd, which="all"):
+    """
+    Choose which superpositions to plot from their CG-RMSD values.
+
+    :param rmsd: Numpy array of CG-RMSD values, one per model.
+    :param which: 'all', 'none', 'best:K', 'worst:K', or several filters separated by commas (e.g. 'best:5,worst:5').
+    :return: Sorted numpy array of the selected model indices.
+    """
+    order = np.argsort(rmsd, kind="stable")
+    selected = set()
+    for item in which.replace(" ", "").lower().split(","):
+        if item == "all":
+            selected.update(range(len(rmsd)))
+        elif item in ("", "none"):
+            continue
+        elif item.startswith("best:"):
+            selected.update(order[:int(item[len("best:"):])].tolist())
+        elif item.startswith("worst:"):
+            count = int(item[len("worst:"):])
+            selected.update(order[len(order) - count:].tolist() if count > 0 else [])
+        else:
+            raise ValueError(f"Unknown plot filter '{item}', expected 'all', 'none', 'best:K' or 'worst:K'")
+    return np.array(sorted(selected), dtype=int)
+
+
+def _render_task(true_atoms, p_atoms, rotation, translation, plot_file):
+    """
+    Render one plot in a worker process, reporting the error instead of raising it.
+    """
+    try:
+        plot_points(true_atoms, p_atoms, rotation, translation, plot_file)
+        return None
+    except Exception as e:
+        return f"{os.path.basename(plot_file)}: {type(e).__name__}: {e}"
+
+
+@timed("plot")
+def render_superpositions(superposition_file, plots_folder, which="all", workers=1):
+    """
+    Render the superposition plots saved by the scoring step (compute_cgRMSD.process_structures).
+
+    :param superposition_file: Path to the .npz superposition file of one native.
+    :param plots_folder: Folder to save the plot images (one subfolder per representation in sweep mode).
+    :param which: Filter of the models to plot, see select_models.
+    :param workers: Number of worker processes rendering plots.
+    :return: List of error messages for the plots that could not be rendered.
+    """
+    tasks = []
+    with np.load(superposition_file) as superpositions:
+        for index, subfolder in enumerate(superpositions["subfolders"]):
+            column_plots_folder = os.path.join(plots_folder, str(subfolder))
+            ensure_dir_exists(column_plots_folder)
+            true_atoms = superpositions[f"native_{index}"]
+            models = superpositions[f"models_{index}"]
+            predicted = superpositions[f"predicted_{index}"]
+            rotations = superpositions[f"rotations_{index}"]
+            translations = superpositions[f"translations_{index}"]
+
+            for model in select_models(superpositions[f"rmsd_{index}"], which):
+                # Unmatched atoms (NaN) are left out of the plot
+                matched = np.isfinite(predicted[model]).all(axis=1)
+                plot_file = os.path.join(column_plots_folder, f"{os.path.splitext(str(models[model]))[0]}.png")
+                tasks.append((true_atoms[matched], predicted[model][matched],
+                              rotations[model], translations[model], plot_file))
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_render_task, *zip(*tasks)))
+    else:
+        outcomes = [_render_task(*task) for task in tasks]
+
+    errors = [outcome for outcome in outcomes if outcome is not None]
+    for error in errors:
+        print(f"Error rendering {error}")
+    return errors
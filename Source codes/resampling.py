@@ -0,0 +1,271 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+from correlation_engine import METRICS, to_arrays
+from results_store import load_results
+
+
+def weighted_sum(weights, values):
+    """
+    Weighted sums over the model axis.
+
+    :param weights: Numpy array (B, M) of model weights (resample counts).
+    :param values: Numpy array (M, ...) shared by every resample, or (B, M, ...).
+    :return: Numpy array (B, ...).
+    """
+    if values.ndim >= 2 and values.shape[0] == weights.shape[0] and values.shape[1] == weights.shape[1]:
+        return np.einsum("bm,bm...->b...", weights, values)
+    return np.einsum("bm,m...->b...", weights, values)
+
+
+def weighted_correlations(x, y, weights):
+    """
+    Pearson correlation of every representation with the metric, with weighted models.
+
+    With bootstrap counts as weights, this is the correlation of the resampled data set, without
+    building it.
+
+    :param x: Numpy array (M, R) or (B, M, R) of CG-RMSD values (or ranks).
+    :param y: Numpy array (M,) or (B, M) of metric values (or ranks).
+    :param weights: Numpy array (B, M) of model weights.
+    :return: Numpy array (B, R).
+    """
+    n = weights.sum(axis=1)[:, None]
+    sum_x = weighted_sum(weights, x)
+    sum_y = weighted_sum(weights, y)[:, None]
+    xy = x * y[..., None]
+    covariance = weighted_sum(weights, xy) - sum_x * sum_y / n
+    var_x = weighted_sum(weights, x ** 2) - sum_x ** 2 / n
+    var_y = weighted_sum(weights, y ** 2)[:, None] - sum_y ** 2 / n
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = covariance / np.sqrt(var_x * var_y)
+    return np.clip(r, -1.0, 1.0)
+
+
+def weighted_ranks(values, weights):
+    """
+    Average ranks of the models in each resampled data set, ties included.
+
+    A model drawn w times with c smaller values drawn before it holds the ranks c + 1 ... c + w,
+    so all its copies get the average rank c + (w + 1) / 2 (equal values share one group).
+
+    :param values: Numpy array (M,) of values.
+    :param weights: Numpy array (B, M) of resample counts.
+    :return: Numpy array (B, M) of ranks (meaningless for models with a zero count).
+    """
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    first = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    last = np.r_[first[1:] - 1, len(values) - 1]
+    group = np.repeat(np.arange(len(first)), last - first + 1)
+
+    sorted_weights = weights[:, order]
+    counts = np.cumsum(sorted_weights, axis=1)
+    if len(first) == len(values):
+        # No ties: every model is its own group
+        sorted_ranks = counts - (sorted_weights - 1.0) / 2.0
+    else:
+        before = np.where(first > 0, counts[:, np.maximum(first - 1, 0)], 0.0)
+        group_ranks = before + (counts[:, last] - before + 1.0) / 2.0
+        sorted_ranks = group_ranks[:, group]
+    ranks = np.empty_like(counts)
+    ranks[:, order] = sorted_ranks
+    return ranks
+
+
+def _bootstrap_batch(x, y, method, seed, size):
+    """
+    Correlations of one batch of bootstrap resamples (models drawn with replacement).
+    """
+    rng = np.random.default_rng(seed)
+    models = len(y)
+    indices = rng.integers(0, models, size=(size, models))  # All the resamples of the batch at once
+    weights = np.bincount((np.arange(size)[:, None] * models + indices).ravel(),
+                          minlength=size * models).reshape(size, models).astype(float)
+    if method == "pearson":
+        return weighted_correlations(x, y, weights)
+
+    # Spearman: the ranks differ in every resample, one representation at a time keeps the arrays small.
+    # The weighted mean rank is always (M + 1) / 2, so centered ranks need no mean correction.
+    center = (models + 1.0) / 2.0
+    y_ranks = weighted_ranks(y, weights) - center
+    y_weighted = weights * y_ranks
+    var_y = np.einsum("bm,bm->b", y_weighted, y_ranks)
+    correlations = np.empty((size, x.shape[1]))
+    for column in range(x.shape[1]):
+        x_ranks = weighted_ranks(x[:, column], weights) - center
+        covariance = np.einsum("bm,bm->b", y_weighted, x_ranks)
+        var_x = np.einsum("bm,bm,bm->b", weights, x_ranks, x_ranks)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlations[:, column] = covariance / np.sqrt(var_x * var_y)
+    return np.clip(correlations, -1.0, 1.0)
+
+
+def _permutation_batch(z, y, pairs, seed, size):
+    """
+    Correlation differences of one batch of paired permutations.
+
+    Each permutation swaps the standardized values of the two representations of a pair for a
+    random subset of models. The swapped sums are matrix products of the swap masks, so no
+    permuted copy of the data is built.
+    """
+    rng = np.random.default_rng(seed)
+    swaps = (rng.random((size, len(y))) < 0.5).astype(float)
+    first = z[:, pairs[:, 0]]
+    second = z[:, pairs[:, 1]]
+    y_centered = y - y.mean()
+    n = len(y)
+
+    # Sums of the first member of each pair after swapping; the second member holds the rest
+    cross = first.T @ y_centered + swaps @ ((second - first) * y_centered[:, None])
+    total = first.sum(axis=0) + swaps @ (second - first)
+    squares = (first ** 2).sum(axis=0) + swaps @ (second ** 2 - first ** 2)
+    cross_other = (first + second).T @ y_centered - cross
+    total_other = (first + second).sum(axis=0) - total
+    squares_other = (first ** 2 + second ** 2).sum(axis=0) - squares
+
+    norm_y = np.sqrt((y_centered ** 2).sum())
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r_first = cross / (np.sqrt(squares - total ** 2 / n) * norm_y)
+        r_second = cross_other / (np.sqrt(squares_other - total_other ** 2 / n) * norm_y)
+    return r_first - r_second
+
+
+def run_batches(function, args, n_resamples, batch_size=250, workers=1, seed=0):
+    """
+    Run resamples in batches, optionally split across worker processes.
+
+    Each batch draws from its own child of the seed, so the result only depends on the seed
+    and the batch size, not on the number of workers.
+
+    :param function: Batch function called as function(*args, seed, size), returning an array (size, ...).
+    :param args: Tuple of the arguments shared by every batch.
+    :param n_resamples: Total number of resamples.
+    :param batch_size: Number of resamples computed at once.
+    :param workers: Number of worker processes.
+    :param seed: Seed of the random generator.
+    :return: Numpy array (n_resamples, ...) of the concatenated batch results.
+    """
+    sizes = [min(batch_size, n_resamples - start) for start in range(0, n_resamples, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = list(executor.map(function, *zip(*[args + (batch_seed, size)
+                                                          for batch_seed, size in zip(seeds, sizes)])))
+    else:
+        batches = [function(*args, batch_seed, size) for batch_seed, size in zip(seeds, sizes)]
+    return np.concatenate(batches)
+
+
+def complete_models(data, metric="rmsd", structure=None):
+    """
+    Extract the models with a finite value for every representation and for the metric.
+
+    :param data: Long DataFrame with structure, model, representation, cg_rmsd and metric columns
+                 (e.g. the result of ResultsStore.merged).
+    :param metric: Metric column to correlate with.
+    :param structure: Structure id, or None to pool every structure.
+    :return: Tuple (x, y, representations): Numpy arrays (M, R) and (M,), and the representation names.
+    """
+    if structure is None:
+        values, metric_values, _, representations, _ = to_arrays(
+            data.assign(pooled_group="ALL"), "pooled_group", metrics=[metric], model_columns=("structure", "model"))
+    else:
+        values, metric_values, _, representations, _ = to_arrays(
+            data[data["structure"] == structure], metrics=[metric])
+    x = values[0]
+    y = metric_values[0, :, 0]
+    complete = np.isfinite(x).all(axis=1) & np.isfinite(y)
+    return x[complete], y[complete], representations
+
+
+def significance_tables(x, y, representations, method="spearman", n_resamples=10000, confidence=0.95,
+                        batch_size=250, workers=1, seed=0):
+    """
+    Bootstrap confidence intervals of the correlation of each representation with a metric, and of the
+    difference between every pair of representations, with paired permutation p-values.
+
+    :param x: Numpy array (M, R) of CG-RMSD values of complete models (see complete_models).
+    :param y: Numpy array (M,) of the metric values.
+    :param representations: List of the R representation names.
+    :param method: 'pearson' or 'spearman'.
+    :param n_resamples: Number of bootstrap resamples and of permutations.
+    :param confidence: Confidence level of the percentile intervals.
+    :param batch_size: Number of resamples computed at once.
+    :param workers: Number of worker processes.
+    :param seed: Seed of the random generator.
+    :return: Tuple (correlations_df, differences_df).
+    """
+    if method not in ("pearson", "spearman"):
+        raise ValueError(f"Unknown correlation method '{method}', expected 'pearson' or 'spearman'")
+    if len(y) < 3:
+        raise ValueError("At least 3 complete models are needed to resample correlations.")
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    tails = [(1.0 - confidence) / 2.0 * 100.0, (1.0 + confidence) / 2.0 * 100.0]
+
+    # Bootstrap: one (n_resamples, R) array of correlations, shared by the intervals of every pair
+    samples = run_batches(_bootstrap_batch, (x, y, method), n_resamples, batch_size, workers, seed)
+    if method == "spearman":
+        x, y = rankdata(x, axis=0), rankdata(y)
+    observed = weighted_correlations(x, y, np.ones((1, len(y))))[0]
+    low, high = np.nanpercentile(samples, tails, axis=0)
+    correlations_df = pd.DataFrame({"representation": representations, "r": observed, "ci_low": low,
+                                    "ci_high": high})
+
+    # Paired permutations of the differences between every pair of representations
+    pairs = np.array([(a, b) for a in range(len(representations)) for b in range(a + 1, len(representations))],
+                     dtype=int).reshape(-1, 2)
+    differences = observed[pairs[:, 0]] - observed[pairs[:, 1]]
+    z = (x - x.mean(axis=0)) / x.std(axis=0)  # Swapped values must be on the same scale
+    null = run_batches(_permutation_batch, (z, y, pairs), n_resamples, batch_size, workers, seed + 1)
+    p_values = ((np.abs(null) >= np.abs(differences) - 1e-12).sum(axis=0) + 1) / (n_resamples + 1)
+    difference_samples = samples[:, pairs[:, 0]] - samples[:, pairs[:, 1]]
+    # np.nanpercentile drops the percentile axis of an empty array (a single representation has no pair)
+    low, high = np.nanpercentile(difference_samples, tails, axis=0) if len(pairs) else np.empty((2, 0))
+    differences_df = pd.DataFrame({
+        "representation_a": [representations[a] for a in pairs[:, 0]],
+        "representation_b": [representations[b] for b in pairs[:, 1]],
+        "difference": differences, "ci_low": low, "ci_high": high, "p_value": p_values,
+    })
+    return correlations_df, differences_df
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command-line arguments of the resampling analysis.
+    """
+    parser = argparse.ArgumentParser(
+        description="Bootstrap confidence intervals and paired permutation tests of CG-RMSD correlations.")
+    parser.add_argument("results", help="Results store (.sqlite), merged CSV file, or folder of merged CSV files.")
+    parser.add_argument("--metric", default="rmsd", choices=list(METRICS), help="Reference metric.")
+    parser.add_argument("--method", default="spearman", choices=["pearson", "spearman"])
+    parser.add_argument("--structure", help="Structure id to analyze (default: every structure pooled).")
+    parser.add_argument("--resamples", type=int, default=10000, help="Number of resamples and permutations.")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Prefix of the output CSV files (<prefix>_correlations.csv, <prefix>_differences.csv).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    x, y, representations = complete_models(load_results(args.results), args.metric, args.structure)
+    print(f"{len(y)} complete model(s), {len(representations)} representation(s), {args.resamples} resamples.")
+    correlations_df, differences_df = significance_tables(
+        x, y, representations, args.method, args.resamples, args.confidence, workers=args.workers, seed=args.seed)
+
+    print(correlations_df.sort_values("r", ascending=args.metric == "tm_score").to_string(index=False))
+    if len(differences_df):
+        print(differences_df.sort_values("p_value").to_string(index=False))
+    if args.output:
+        correlations_df.to_csv(f"{args.output}_correlations.csv", index=False)
+        differences_df.to_csv(f"{args.output}_differences.csv", index=False)
+        print(f"Results saved to {args.output}_correlations.csv and {args.output}_differences.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import numpy as np
+import pandas as pd
+from results_store import ResultsStore
+from model_names import model_family
+
+
+def group_profiles(deviations, groups):
+    """
+    Mean deviation of every residue over the models of each group, leaving out missing (NaN) residues.
+
+    The sums of all the groups come from one matrix product of a group membership matrix with the
+    deviations, so the whole (models x residues) matrix is aggregated at once.
+
+    :param deviations: Numpy array (M, R) of per-residue deviations.
+    :param groups: List of M group names (e.g. predictor families).
+    :return: Tuple (names, means, counts): sorted group names (G,), numpy arrays (G, R) of the mean deviations
+             (NaN where no model of the group has the residue) and of the number of models averaged.
+    """
+    deviations = np.asarray(deviations, dtype=np.float64)
+    names, codes = np.unique(np.asarray(groups, dtype=str), return_inverse=True)
+    membership = np.zeros((len(names), len(codes)))
+    membership[codes, np.arange(len(codes))] = 1.0
+    present = np.isfinite(deviations)
+    sums = membership @ np.where(present, deviations, 0.0)
+    counts = membership @ present
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return names, means, counts.astype(int)
+
+
+def family_profiles(store, structure, representation):
+    """
+    Mean deviation of every residue of one structure per predictor family, from the results store.
+
+    :param store: ResultsStore holding the per-residue deviations (step 1 run with 'results_store').
+    :param structure: Structure id.
+    :param representation: Representation name, as in the cg_rmsd table.
+    :return: DataFrame indexed by family, one column per residue label, plus a 'models' column.
+    """
+    models, residues, deviations = store.profile(structure, representation)
+    families = [model_family(model) for model in models]
+    names, means, _ = group_profiles(deviations, families)
+    profiles_df = pd.DataFrame(means, index=pd.Index(names, name="family"), columns=residues)
+    profiles_df.insert(0, "models", pd.Series(families).value_counts().reindex(names).to_numpy())
+    return profiles_df
+
+
+def worst_residues(profiles_df, count=5):
+    """
+    The residues with the largest mean deviation of each family.
+
+    :param profiles_df: DataFrame returned by family_profiles.
+    :param count: Number of residues per family.
+    :return: DataFrame with family, rank, residue and deviation columns.
+    """
+    deviations = profiles_df.drop(columns="models")
+    rows = []
+    for family, values in deviations.iterrows():
+        for rank, (residue, deviation) in enumerate(values.dropna().nlargest(count).items(), start=1):
+            rows.append((family, rank, residue, deviation))
+    return pd.DataFrame(rows, columns=["family", "rank", "residue", "deviation"])
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command-line arguments of the per-residue deviation summary.
+    """
+    parser = argparse.ArgumentParser(description="Mean per-residue deviation of every predictor family.")
+    parser.add_argument("store", help="Results store (.sqlite) filled by step 1.")
+    parser.add_argument("structure", help="Structure id, e.g. rp05.")
+    parser.add_argument("--representation", help="Representation (default: the first one stored for the structure).")
+    parser.add_argument("--worst", type=int, default=5, help="Number of worst residues printed per family.")
+    parser.add_argument("--output", help="CSV file receiving the family x residue table.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    store = ResultsStore(args.store)
+    representation = args.representation
+    if representation is None:
+        stored = store.profiles()
+        stored = stored[stored["structure"] == args.structure]
+        if stored.empty:
+            raise SystemExit(f"No per-residue deviations stored for {args.structure}.")
+        representation = stored["representation"].iloc[0]
+
+    profiles_df = family_profiles(store, args.structure, representation)
+    print(f"{args.structure} ({representation}): {profiles_df['models'].sum()} model(s), "
+          f"{profiles_df.shape[1] - 1} residue(s), {len(profiles_df)} famil{'y' if len(profiles_df) == 1 else 'ies'}.")
+    print(worst_residues(profiles_df, args.worst).to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+    if args.output:
+        profiles_df.to_csv(args.output)
+        print(f"Per-residue deviations saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
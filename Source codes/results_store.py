@@ -0,0 +1,254 @@
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+import numpy as np
+import pandas as pd
+from correlation_engine import METRICS
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cg_rmsd (
+    structure TEXT NOT NULL,
+    model TEXT NOT NULL,
+    representation TEXT NOT NULL,
+    cg_rmsd REAL,
+    coverage REAL,
+    PRIMARY KEY (structure, model, representation)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    structure TEXT NOT NULL,
+    model TEXT NOT NULL,
+    rmsd REAL,
+    mcq REAL,
+    tm_score REAL,
+    PRIMARY KEY (structure, model)
+);
+CREATE TABLE IF NOT EXISTS correlations (
+    structure TEXT NOT NULL,
+    representation TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    n INTEGER,
+    pearson_r REAL,
+    pearson_p REAL,
+    spearman_r REAL,
+    spearman_p REAL,
+    PRIMARY KEY (structure, representation, metric)
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    structure TEXT NOT NULL,
+    representation TEXT NOT NULL,
+    n_models INTEGER NOT NULL,
+    n_residues INTEGER NOT NULL,
+    models TEXT NOT NULL,
+    residues TEXT NOT NULL,
+    deviations BLOB NOT NULL,
+    PRIMARY KEY (structure, representation)
+);
+"""
+
+# Column names of the reference metrics, as in the score and merged CSV files
+METRIC_COLUMNS = {"rmsd": "RMSD", "mcq": "MCQ", "tm_score": "TM-score"}
+
+
+class ResultsStore:
+    """
+    Single SQLite results dataset shared by all the steps of the pipeline.
+
+    CG-RMSD values are stored keyed by (structure, model, representation), reference metrics by
+    (structure, model) and correlations by (structure, representation, metric). Every step appends
+    to or queries these tables instead of writing and re-reading one CSV file per structure.
+    Per-residue deviations are stored as one float32 (models x residues) matrix per (structure,
+    representation), with the model names and residue labels as newline-separated text.
+    """
+
+    def __init__(self, store_file):
+        """
+        :param store_file: Path to the SQLite database (created if needed).
+        """
+        self.store_file = store_file
+        directory = os.path.dirname(store_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        """
+        Open a connection to the database for the enclosed block; it is committed (or rolled back on error)
+        and closed at the end of the block.
+        """
+        with closing(sqlite3.connect(self.store_file)) as connection, connection:
+            yield connection
+
+    def write_cg_rmsd(self, structure, rows):
+        """
+        Replace the CG-RMSD values of one structure.
+
+        :param structure: Structure id (e.g. 'rp05').
+        :param rows: Iterable of (model, representation, cg_rmsd, coverage) tuples; None or NaN for missing values.
+        """
+        with self.connect() as connection:
+            connection.execute("DELETE FROM cg_rmsd WHERE structure = ?", (structure,))
+            connection.executemany(
+                "INSERT INTO cg_rmsd VALUES (?, ?, ?, ?, ?)",
+                [(structure, model, representation, _to_float(value), _to_float(coverage))
+                 for model, representation, value, coverage in rows])
+
+    def import_metrics(self, metrics_file, structure):
+        """
+        Replace the reference metrics (RMSD, MCQ, TM-score) of one structure with a score CSV file.
+
+        Model names are reduced to the part after 'normalized_', as in merge_metrics_and_cgRMSD.
+
+        :param metrics_file: Path to the score CSV file (Model, RMSD, MCQ, TM-score).
+        :param structure: Structure id.
+        """
+        metrics_df = pd.read_csv(metrics_file, header=None, names=["model"] + list(METRIC_COLUMNS))
+        metrics_df["model"] = metrics_df["model"].astype(str).str.strip().str.split("normalized_").str[-1]
+        for column in METRIC_COLUMNS:
+            metrics_df[column] = pd.to_numeric(metrics_df[column], errors="coerce")
+        # Drop the header line and any line without a single numeric value
+        metrics_df = metrics_df.dropna(subset=list(METRIC_COLUMNS), how="all")
+        self.write_metrics(structure, metrics_df)
+
+    def write_metrics(self, structure, metrics_df):
+        """
+        Replace the reference metrics of one structure.
+
+        :param structure: Structure id.
+        :param metrics_df: DataFrame with 'model', 'rmsd', 'mcq' and 'tm_score' columns.
+        """
+        rows = metrics_df[["model", "rmsd", "mcq", "tm_score"]].itertuples(index=False)
+        with self.connect() as connection:
+            connection.execute("DELETE FROM metrics WHERE structure = ?", (structure,))
+            connection.executemany(
+                "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?)",
+                [(structure, model, _to_float(rmsd), _to_float(mcq), _to_float(tm_score))
+                 for model, rmsd, mcq, tm_score in rows])
+
+    def write_correlations(self, correlations_df):
+        """
+        Insert or replace correlation results.
+
+        :param correlations_df: DataFrame with the columns of the correlations table.
+        """
+        columns = ["structure", "representation", "metric", "n", "pearson_r", "pearson_p", "spearman_r", "spearman_p"]
+        rows = [(structure, representation, metric, int(n), _to_float(pearson_r), _to_float(pearson_p),
+                 _to_float(spearman_r), _to_float(spearman_p))
+                for structure, representation, metric, n, pearson_r, pearson_p, spearman_r, spearman_p
+                in correlations_df[columns].itertuples(index=False)]
+        with self.connect() as connection:
+            connection.executemany(f"INSERT OR REPLACE INTO correlations VALUES ({', '.join('?' * len(columns))})", rows)
+
+    def write_profiles(self, structure, representation, models, residues, deviations):
+        """
+        Replace the per-residue deviations of one structure and representation.
+
+        :param structure: Structure id.
+        :param representation: Representation name, as in the cg_rmsd table.
+        :param models: List of the model names, one per row of the matrix.
+        :param residues: List of the residue labels, one per column of the matrix.
+        :param deviations: Numpy array (models, residues) of deviations, NaN for missing residues.
+        """
+        deviations = np.ascontiguousarray(deviations, dtype=np.float32)
+        if deviations.shape != (len(models), len(residues)):
+            raise ValueError(f"Shape mismatch: {deviations.shape} vs {len(models)} models x {len(residues)} residues")
+        with self.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (structure, representation, len(models), len(residues), "\n".join(models),
+                                "\n".join(str(residue) for residue in residues), deviations.tobytes()))
+
+    def profile(self, structure, representation):
+        """
+        Load the per-residue deviations of one structure and representation.
+
+        :return: Tuple (models, residues, deviations): lists of model names and residue labels, and a
+                 read-only float32 numpy array (models, residues) read directly from the stored bytes.
+        """
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT n_models, n_residues, models, residues, deviations FROM profiles "
+                "WHERE structure = ? AND representation = ?", (structure, representation)).fetchone()
+        if row is None:
+            raise KeyError(f"No per-residue deviations for {structure} ({representation})")
+        n_models, n_residues, models, residues, deviations = row
+        deviations = np.frombuffer(deviations, dtype=np.float32).reshape(n_models, n_residues)
+        return models.split("\n") if n_models else [], residues.split("\n") if n_residues else [], deviations
+
+    def profiles(self):
+        """
+        List the stored per-residue deviations: structure, representation, n_models and n_residues.
+        """
+        return self.query("SELECT structure, representation, n_models, n_residues FROM profiles "
+                          "ORDER BY structure, representation")
+
+    def query(self, sql, params=()):
+        """
+        Run a SQL query and return the result as a DataFrame.
+        """
+        with self.connect() as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+
+    def structures(self):
+        """
+        List the structures that have CG-RMSD values.
+        """
+        return self.query("SELECT DISTINCT structure FROM cg_rmsd ORDER BY structure")["structure"].tolist()
+
+    def merged(self, structures=None):
+        """
+        Join the CG-RMSD values with the reference metrics of every structure in one query.
+
+        :param structures: Optional list of structure ids to restrict the result to.
+        :return: DataFrame with structure, model, representation, cg_rmsd, coverage, rmsd, mcq and tm_score columns.
+        """
+        sql = ("SELECT c.structure, c.model, c.representation, c.cg_rmsd, c.coverage, m.rmsd, m.mcq, m.tm_score "
+               "FROM cg_rmsd AS c JOIN metrics AS m ON c.structure = m.structure AND c.model = m.model")
+        params = ()
+        if structures:
+            sql += f" WHERE c.structure IN ({', '.join('?' * len(structures))})"
+            params = tuple(structures)
+        return self.query(sql + " ORDER BY c.structure, c.representation, c.model", params)
+
+    def correlations(self):
+        """
+        Load every correlation result.
+        """
+        return self.query("SELECT * FROM correlations ORDER BY structure, representation, metric")
+
+
+def _to_float(value):
+    """
+    Convert a value to a float for storage, None for missing or non-numeric values.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if np.isfinite(value) else None
+
+
+def load_results(results_path):
+    """
+    Load CG-RMSD values and metrics as one long DataFrame (structure, model, representation, cg_rmsd, metrics).
+
+    :param results_path: Results store (.sqlite), merged CSV file, or folder of merged CSV files.
+    """
+    if results_path.endswith(".sqlite"):
+        return ResultsStore(results_path).merged()
+
+    if os.path.isdir(results_path):
+        files = [os.path.join(results_path, name) for name in sorted(os.listdir(results_path)) if name.endswith(".csv")]
+    else:
+        files = [results_path]
+    frames = []
+    for merged_file in files:
+        data = pd.read_csv(merged_file)
+        cg_columns = [column for column in data.columns if column.startswith("CG-RMSD")]
+        long_data = data.melt(id_vars=["Model"] + list(METRICS.values()), value_vars=cg_columns,
+                              var_name="representation", value_name="cg_rmsd")
+        long_data["representation"] = long_data["representation"].str.replace("CG-RMSD", "").str.strip()
+        long_data["structure"] = os.path.splitext(os.path.basename(merged_file))[0].replace("merged_", "")
+        frames.append(long_data.rename(columns={"Model": "model", **{name: metric for metric, name in METRICS.items()}}))
+    return pd.concat(frames, ignore_index=True)
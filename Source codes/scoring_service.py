@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from urllib.request import Request, urlopen
+import numpy as np
+from cg_core import (prepare_native, score_predictions, superpose_batch, build_selections, parse_pdb_buffer,
+                     read_ahead, representation_name, coverage_column)
+
+DEFAULT_PORT = 8765
+
+# Representations scored when a request does not list any
+DEFAULT_REPRESENTATIONS = ["C4'"]
+
+
+class NativeCache:
+    """
+    In-memory LRU cache of prepared natives (see cg_core.prepare_native).
+
+    Entries are keyed by the native file (path, size and modification time, so an updated file is
+    prepared again) and the requested representations, and hold the native atom table with the
+    selected atoms of every representation. The least recently used entries are evicted once the
+    arrays of all entries exceed `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2, cache=None):
+        """
+        :param max_bytes: Memory budget of the cached natives, in bytes.
+        :param cache: Optional AtomTableCache used to load parsed structures.
+        """
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(native_pdb, representations):
+        """
+        Cache key of a native file and a list of representations.
+        """
+        stat = os.stat(native_pdb)
+        return os.path.abspath(native_pdb), stat.st_size, stat.st_mtime_ns, tuple(representations)
+
+    def get(self, native_pdb, representations):
+        """
+        Return the prepared native and its selections, preparing them on a cache miss.
+
+        :param native_pdb: Path to the native structure file.
+        :param representations: List of representations, e.g. ["C4'", "P+C4'+N1/N9"].
+        :return: Tuple (native, selections) as used by cg_core.score_predictions.
+        """
+        key = self.key(native_pdb, representations)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][:2]
+            self.misses += 1
+
+        selections = build_selections(None, representations=representations)
+        native = prepare_native(native_pdb, selections, self.cache)
+        size = native["table"].nbytes + sum(array.nbytes for column in native["columns"].values()
+                                            for array in column.values() if isinstance(array, np.ndarray))
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (native, selections, size)
+                self.total_bytes += size
+                # Keep at least the entry just added, even when it alone exceeds the budget
+                while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                    _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted_size
+        return native, selections
+
+    def stats(self):
+        """
+        Number of entries, memory used, hits and misses of the cache.
+        """
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def _to_json_float(value):
+    """
+    Convert a value to a float for a JSON response, None for missing values.
+    """
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def score_request(request, natives, cache=None, read_ahead_depth=4):
+    """
+    Score a batch of predictions against a native, as described by a request dictionary.
+
+    The request holds 'native' (path to the native file), optional 'representations' (default
+    DEFAULT_REPRESENTATIONS) and 'predictions', a list of items of one of the forms:
+      - "path/to/model.pdb" or {"path": "path/to/model.pdb"}: a structure file read by the service;
+      - {"name": "model_1", "pdb": "<content of a PDB file>"}: a structure sent in the request;
+      - {"name": "model_1", "coordinates": {representation: [[x, y, z], ...]}}: coordinates already in
+        the native atom order of each representation (see native_atoms), NaN or null for missing atoms.
+    Structures are matched to the native as in cg_core.score_predictions; coordinates are
+    superposed directly. Predictions are keyed by their path as given in the request (or their name),
+    which must be unique; predictions that cannot be scored for a representation are listed in 'errors'.
+
+    :param request: Request dictionary.
+    :param natives: NativeCache holding the prepared natives.
+    :param cache: Optional AtomTableCache used to load the prediction files.
+    :param read_ahead_depth: Number of prediction files loaded ahead by background threads.
+    :return: Dictionary with 'results' {model: {representation: {"cg_rmsd", "coverage"}}} and
+             'errors' [{"model", "message"}].
+    """
+    representations = request.get("representations") or DEFAULT_REPRESENTATIONS
+    native, selections = natives.get(request["native"], representations)
+
+    structures, buffers, names = [], [], set()
+    for item in request.get("predictions", []):
+        if isinstance(item, str):
+            item = {"path": item}
+        name = item.get("path", item.get("name"))
+        if name in names:
+            raise ValueError(f"Prediction {name} is listed twice.")
+        names.add(name)
+        if "path" in item:
+            structures.append(("path", name, item["path"]))
+        elif "pdb" in item:
+            structures.append(("pdb", name, item["pdb"]))
+        elif "coordinates" in item:
+            buffers.append((name, item["coordinates"]))
+        else:
+            raise ValueError("Every prediction needs a 'path', a 'pdb' or 'coordinates' field.")
+
+    # Structure files and PDB contents, in request order, with the files read ahead in background threads
+    file_tables = read_ahead([value for kind, _, value in structures if kind == "path"], cache, read_ahead_depth)
+
+    def tables():
+        for kind, name, value in structures:
+            if kind == "path":
+                yield next(file_tables)
+                continue
+            try:
+                yield name, parse_pdb_buffer(value.encode())
+            except Exception as e:
+                yield name, e
+
+    model_names = [name for _, name, _ in structures]
+    results, _, errors = score_predictions(native, model_names, cache, tables(), names=model_names)
+    response = {"results": {}, "errors": [{"model": model, "message": message} for model, message in errors]}
+    for model, values in results.items():
+        for column in native["columns"]:
+            if isinstance(values.get(column), float):
+                response["results"].setdefault(model, {})[representation_name(column, selections)] = {
+                    "cg_rmsd": _to_json_float(values[column]),
+                    "coverage": _to_json_float(values[coverage_column(column)]),
+                }
+
+    # Coordinate buffers of each representation, superposed in one batched call
+    for column, selection in native["columns"].items():
+        name = representation_name(column, selections)
+        models, stacked = [], []
+        for model, coordinates in buffers:
+            if name not in coordinates:
+                continue
+            atoms = np.array(coordinates[name], dtype=float)
+            if atoms.shape != selection["atoms"].shape:
+                response["errors"].append({"model": model, "message": f"{name}: expected {len(selection['atoms'])} "
+                                                                      f"atoms in native order, got {atoms.shape}"})
+                continue
+            models.append(model)
+            stacked.append(atoms)
+        if not models:
+            continue
+        stacked = np.stack(stacked)
+        coverages = np.isfinite(stacked).all(axis=2).mean(axis=1)
+        try:
+            rmsd, _, _ = superpose_batch(selection["atoms"], stacked)
+        except ValueError as e:
+            response["errors"].extend({"model": model, "message": f"{name}: {e}"} for model in models)
+            continue
+        for model, value, coverage in zip(models, rmsd, coverages):
+            response["results"].setdefault(model, {})[name] = {"cg_rmsd": _to_json_float(value),
+                                                              "coverage": _to_json_float(coverage)}
+    return response
+
+
+def native_atoms(native, selections, representation):
+    """
+    List the atoms of a representation in native order, as expected by coordinate buffers.
+
+    :return: List of [chain, residue number, insertion code, atom name].
+    """
+    for column, selection in native["columns"].items():
+        if representation_name(column, selections) == representation:
+            rows = native["table"][selection["rows"]]
+            return [[str(atom["chain"]), int(atom["resseq"]), str(atom["icode"]), str(atom["name"])] for atom in rows]
+    raise ValueError(f"No atoms found for {representation} in the native structure.")
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """
+    HTTP endpoints of the scoring service:
+      - GET /health: status and native cache statistics;
+      - GET /atoms?native=<path>&representation=<representation>: atom order of coordinate buffers;
+      - POST /score: score a batch of predictions (JSON request, see score_request).
+    """
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, handler):
+        try:
+            self.send_json(200, handler())
+        except (KeyError, ValueError, TypeError, FileNotFoundError, json.JSONDecodeError) as e:
+            self.send_json(400, {"error": f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/health":
+            self.handle_request(lambda: {"status": "ok", "natives": self.server.natives.stats()})
+        elif url.path == "/atoms":
+            def atoms():
+                representation = query["representation"]
+                native, selections = self.server.natives.get(query["native"], [representation])
+                return {"representation": representation, "atoms": native_atoms(native, selections, representation)}
+            self.handle_request(atoms)
+        else:
+            self.send_json(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/score":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        def score():
+            start = time.perf_counter()
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            response = score_request(request, self.server.natives, self.server.cache, self.server.read_ahead_depth)
+            response["elapsed_ms"] = (time.perf_counter() - start) * 1000.0
+            return response
+        self.handle_request(score)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, max_bytes=512 * 1024 ** 2, cache=None, read_ahead_depth=4,
+                verbose=False):
+    """
+    Create the scoring service (call serve_forever to run it).
+
+    The service reads the structure files named in the requests, so it listens on localhost by default.
+
+    :param host: Address to listen on.
+    :param port: Port to listen on (0 picks a free port).
+    :param max_bytes: Memory budget of the native cache, in bytes.
+    :param cache: Optional AtomTableCache used to load parsed structures.
+    :param read_ahead_depth: Number of prediction files loaded ahead by background threads.
+    :param verbose: Boolean, if True, log every HTTP request.
+    :return: ThreadingHTTPServer.
+    """
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.natives = NativeCache(max_bytes, cache)
+    server.cache = cache
+    server.read_ahead_depth = read_ahead_depth
+    server.verbose = verbose
+    return server
+
+
+def score_remote(native, predictions, representations=None, url=f"http://127.0.0.1:{DEFAULT_PORT}"):
+    """
+    Send a scoring request to a running service.
+
+    :param native: Path to the native structure file (as seen by the service).
+    :param predictions: List of prediction items, see score_request.
+    :param representations: Optional list of representations.
+    :param url: Base URL of the service.
+    :return: Response dictionary (results, errors, elapsed_ms).
+    """
+    payload = {"native": native, "predictions": predictions}
+    if representations:
+        payload["representations"] = representations
+    request = Request(f"{url}/score", data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    with urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command-line arguments of the scoring service.
+    """
+    parser = argparse.ArgumentParser(description="Resident CG-RMSD scoring service keeping the natives in memory.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--max-memory", type=float, default=512, help="Memory budget of the native cache, in MB.")
+    parser.add_argument("--cache-folder", help="Folder of the parsed structure cache.")
+    parser.add_argument("--read-ahead", type=int, default=4, help="Number of prediction files loaded ahead.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    cache = None
+    if args.cache_folder:
+        from structure_cache import AtomTableCache
+        cache = AtomTableCache(args.cache_folder)
+    server = make_server(args.host, args.port, int(args.max_memory * 1024 ** 2), cache, args.read_ahead, args.verbose)
+    print(f"Scoring service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import threading
+import hashlib
+import numpy as np
+from cg_core import read_atom_table, ATOM_TABLE_VERSION, ATOM_TABLE_DTYPE
+
+
+class AtomTableCache:
+    """
+    On-disk cache of parsed atom tables.
+
+    Each parsed structure is stored as a `.npy` file and loaded back memory-mapped,
+    so unchanged inputs are never parsed twice. Entries are keyed by the absolute
+    path, size and modification time of the PDB file, or by a hash of its content, and by the
+    ATOM_TABLE_VERSION and dtype of the atom tables, so a parser change does not serve stale tables.
+    When the cache grows beyond `max_bytes`, the least recently used entries are removed.
+
+    The total size of the entries is kept in memory (the folder is listed once, on the first write)
+    and the folder is only scanned again when the total goes over `max_bytes`. Eviction then goes
+    down to `EVICT_TO` of `max_bytes`, so filling a full cache does not scan it on every miss.
+    Entries written by other processes sharing the folder are counted at the next scan.
+    """
+
+    # Fraction of max_bytes kept after an eviction
+    EVICT_TO = 0.9
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 ** 2, content_hash=False):
+        """
+        :param cache_dir: Folder holding the cached atom tables.
+        :param max_bytes: Maximum total size of the cache in bytes.
+        :param content_hash: Boolean, if True, key entries on the file content instead of its size and mtime.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.lock = threading.Lock()
+        self.total_bytes = None  # Unknown until the first write
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, pdb_file):
+        """
+        Compute the cache key of a PDB file.
+
+        :param pdb_file: Path to the PDB file.
+        :return: Hexadecimal key string.
+        """
+        digest = hashlib.sha1(f"{ATOM_TABLE_VERSION}:{ATOM_TABLE_DTYPE.descr}\n".encode())
+        if self.content_hash:
+            with open(pdb_file, 'rb') as pdb:
+                for block in iter(lambda: pdb.read(1 << 20), b""):
+                    digest.update(block)
+        else:
+            stat = os.stat(pdb_file)
+            digest.update(os.path.abspath(pdb_file).encode())
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    def entry_path(self, pdb_file):
+        """
+        Return the path of the cache entry for a PDB file.
+        """
+        return os.path.join(self.cache_dir, f"{self.key(pdb_file)}.npy")
+
+    def load(self, pdb_file):
+        """
+        Load the atom table of a PDB file, parsing it only on a cache miss.
+
+        :param pdb_file: Path to the PDB file.
+        :return: Atom table, memory-mapped from the cache entry.
+        """
+        entry = self.entry_path(pdb_file)
+        try:
+            atom_table = np.load(entry, mmap_mode='r')
+        except FileNotFoundError:
+            pass  # Miss, or entry evicted by another process
+        except (OSError, ValueError):
+            # Truncated or corrupt entry: parse the file again
+            self.remove(entry)
+        else:
+            try:
+                os.utime(entry)  # Mark the entry as recently used
+            except FileNotFoundError:
+                pass  # Evicted since it was mapped; the mapping stays valid
+            return atom_table
+
+        atom_table = read_atom_table(pdb_file)
+        if atom_table.size == 0:
+            return atom_table  # Empty tables cannot be memory-mapped
+
+        temp_entry = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_entry, 'wb') as handle:
+            np.save(handle, atom_table)
+        os.replace(temp_entry, entry)
+        try:
+            self.add_bytes(os.path.getsize(entry))
+            return np.load(entry, mmap_mode='r')
+        except FileNotFoundError:
+            return atom_table  # Evicted by another process right after it was written
+
+    def add_bytes(self, size):
+        """
+        Count a new entry in the total size of the cache and evict entries if it goes over `max_bytes`.
+
+        :param size: Size of the new entry in bytes.
+        """
+        with self.lock:
+            if self.total_bytes is None:
+                # The first scan already includes the new entry
+                self.total_bytes = sum(entry_size for _, entry_size, _ in self.entries())
+            else:
+                self.total_bytes += size
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def entries(self):
+        """
+        List the cache entries as (modification time, size, path) tuples.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in `EVICT_TO` of `max_bytes`.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * self.EVICT_TO:
+                    break
+                self.remove(path)
+                total -= size
+        with self.lock:
+            self.total_bytes = total
+
+    @staticmethod
+    def remove(path):
+        """
+        Remove a cache entry, unless another process already removed it.
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                self.remove(os.path.join(self.cache_dir, name))
+        with self.lock:
+            self.total_bytes = 0
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+from correlation_engine import correlate_arrays, to_arrays
+
+
+def random_results(seed=0, groups=3, models=25, representations=2, metrics=3):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(groups, models, representations))
+    metric_values = values.mean(axis=2, keepdims=True) + rng.normal(size=(groups, models, metrics))
+    # Ties, and missing values on both sides
+    values[:, :, 1] = np.round(values[:, :, 1], 1)
+    values[rng.random(values.shape) < 0.1] = np.nan
+    metric_values[rng.random(metric_values.shape) < 0.1] = np.nan
+    metric_values[0, 3, 0] = np.inf
+    return values, metric_values
+
+
+def test_masked_correlations_match_scipy():
+    values, metric_values = random_results()
+
+    results = correlate_arrays(values, metric_values)
+
+    for group in range(values.shape[0]):
+        for representation in range(values.shape[2]):
+            for metric in range(metric_values.shape[2]):
+                x, y = values[group, :, representation], metric_values[group, :, metric]
+                valid = np.isfinite(x) & np.isfinite(y)
+                cell = group, representation, metric
+                pearson = stats.pearsonr(x[valid], y[valid])
+                spearman = stats.spearmanr(x[valid], y[valid])
+                assert results["n"][cell] == valid.sum()
+                assert np.isclose(results["pearson_r"][cell], pearson[0], atol=1e-12)
+                assert np.isclose(results["pearson_p"][cell], pearson[1], rtol=1e-8)
+                assert np.isclose(results["spearman_r"][cell], spearman[0], atol=1e-12)
+                assert np.isclose(results["spearman_p"][cell], spearman[1], rtol=1e-8)
+
+
+def test_cells_with_fewer_than_3_pairs_have_no_p_value():
+    values = np.array([[[np.nan, 1.0], [np.nan, 2.0], [3.0, 3.0], [4.0, 5.0]]])
+    metric_values = np.array([[[1.0], [2.0], [np.nan], [4.0]]])
+
+    results = correlate_arrays(values, metric_values)
+
+    assert results["n"][0, :, 0].tolist() == [1, 3]
+    assert np.isnan(results["pearson_p"][0, 0, 0]) and np.isnan(results["spearman_p"][0, 0, 0])
+    assert np.isfinite(results["pearson_p"][0, 1, 0]) and results["spearman_r"][0, 1, 0] == 1.0
+
+
+def test_to_arrays_places_every_row():
+    data = pd.DataFrame({
+        "structure": ["b", "a", "a", "b", "a", "a"],
+        "model": ["m1", "m1", "m2", "m1", "m1", "m2"],
+        "representation": ["P", "P", "P", "C4'", "C4'", "C4'"],
+        "cg_rmsd": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        "rmsd": [10.0, 20.0, 30.0, 10.0, 20.0, 30.0],
+    })
+
+    values, metric_values, groups, representations, metrics = to_arrays(data)
+
+    assert groups == ["a", "b"] and representations == ["C4'", "P"] and metrics == ["rmsd"]
+    assert np.array_equal(values, [[[5.0, 2.0], [6.0, 3.0]], [[4.0, 1.0], [np.nan, np.nan]]], equal_nan=True)
+    assert np.array_equal(metric_values[:, :, 0], [[20.0, 30.0], [10.0, np.nan]], equal_nan=True)
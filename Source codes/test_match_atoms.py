@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from cg_core import read_atom_table, residue_ids, select_representation, match_atoms, superpose_batch
+
+NATIVE_PDB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "NATIVE", "rp05.pdb")
+
+
+def native_table():
+    return read_atom_table(NATIVE_PDB)
+
+
+def residue_numbers(atom_table):
+    starts = np.flatnonzero(np.diff(residue_ids(atom_table), prepend=-1))
+    return atom_table["resseq"][starts]
+
+
+def test_interior_gap_keeps_residues_in_place():
+    native = native_table()
+    missing = residue_numbers(native)[20]
+    predicted = native[native["resseq"] != missing]
+
+    native_rows, predicted_rows, coverage = match_atoms(native, predicted)
+
+    assert np.array_equal(native["resseq"][native_rows], predicted["resseq"][predicted_rows])
+    assert np.array_equal(native["name"][native_rows], predicted["name"][predicted_rows])
+    assert coverage == len(predicted) / len(native)
+    mask = select_representation(native, "C4'")
+    rows, matched, _ = match_atoms(native, predicted, mask, select_representation(predicted, "C4'"))
+    rmsd, _, _ = superpose_batch(native["xyz"][rows].astype(np.float64),
+                                 predicted["xyz"][matched][None].astype(np.float64))
+    assert rmsd[0] < 1e-3
+
+
+def test_renumbered_chain_pairs_by_position():
+    native = native_table()
+    missing = residue_numbers(native)[20]
+    gapped = native[native["resseq"] != missing]
+    # Prediction numbered 1..N without the gap of the native
+    predicted = gapped.copy()
+    predicted["resseq"] = residue_ids(predicted) + 1
+
+    native_rows, predicted_rows, coverage = match_atoms(gapped, predicted)
+
+    assert coverage == 1.0
+    assert np.array_equal(gapped["xyz"][native_rows], predicted["xyz"][predicted_rows])
+
+
+def test_other_sequence_is_not_matched():
+    native = native_table()
+    predicted = native.copy()
+    # Swap purines and pyrimidines: no residue keeps its name, only chance pairings at some shift remain
+    predicted["resname"] = np.select([native["resname"] == "A", native["resname"] == "G",
+                                      native["resname"] == "C", native["resname"] == "U"],
+                                     ["C", "U", "A", "G"], native["resname"])
+
+    _, _, coverage = match_atoms(native, predicted)
+
+    assert coverage < 0.5
+
+
+def two_chain_native():
+    native = native_table()
+    # Second half of the residues in chain B
+    second_half = residue_ids(native) >= len(residue_numbers(native)) // 2
+    native["chain"] = np.where(second_half, "B", "A")
+    return native, second_half
+
+
+def test_swapped_chains_pair_by_chain_id():
+    native, second_half = two_chain_native()
+    predicted = np.concatenate((native[second_half], native[~second_half]))
+
+    native_rows, predicted_rows, coverage = match_atoms(native, predicted)
+
+    assert coverage == 1.0
+    assert np.array_equal(native["xyz"][native_rows], predicted["xyz"][predicted_rows])
+
+
+def test_missing_chain_keeps_the_other_chain():
+    native, second_half = two_chain_native()
+    predicted = native[second_half]
+
+    native_rows, predicted_rows, coverage = match_atoms(native, predicted)
+
+    assert np.array_equal(native_rows, np.flatnonzero(second_half))
+    assert np.array_equal(native["xyz"][native_rows], predicted["xyz"][predicted_rows])
+    assert coverage == np.count_nonzero(second_half) / len(native)
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+from cg_core import superpose_batch
+from pairwise_cgRMSD import pairwise_cgRMSD, tile_size
+
+
+def random_decoys(seed=0, models=23, atoms=30):
+    rng = np.random.default_rng(seed)
+    native = rng.normal(scale=15, size=(atoms, 3))
+    decoys = native + rng.normal(scale=2, size=(models, atoms, 3))
+    decoys[5] *= [-1.0, 1.0, 1.0]  # Mirror image
+    return decoys
+
+
+def direct_condensed(decoys):
+    # One superposition per pair, in the condensed order of scipy.spatial.distance
+    return np.array([superpose_batch(decoys[i], decoys[j][None])[0][0]
+                     for i in range(len(decoys)) for j in range(i + 1, len(decoys))])
+
+
+def test_tiled_matrix_equals_direct_computation(tmp_path):
+    decoys = random_decoys()
+    max_bytes = 16000
+    assert tile_size(len(decoys), decoys.shape[1], max_bytes) < len(decoys) // 2
+
+    distances = pairwise_cgRMSD(decoys, os.path.join(tmp_path, "pairs.npy"), max_bytes=max_bytes)
+
+    assert distances.dtype == np.float32
+    assert np.allclose(distances, direct_condensed(decoys), atol=1e-4)
+
+
+def test_workers_give_the_same_matrix(tmp_path):
+    decoys = random_decoys(seed=1, models=12)
+
+    serial = pairwise_cgRMSD(decoys, os.path.join(tmp_path, "serial.npy"), max_bytes=16000)
+    parallel = pairwise_cgRMSD(decoys, os.path.join(tmp_path, "parallel.npy"), max_bytes=16000, workers=2)
+
+    assert np.array_equal(serial, parallel)
@@ -0,0 +1,51 @@
+import io
+import os
+import numpy as np
+from cg_core import parse_residue_numbers, parse_pdb_buffer, parse_pdb_stream, read_atom_table
+
+NATIVE_PDB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "NATIVE", "rp05.pdb")
+
+
+def atom_line(serial, name, resseq, x):
+    return f"ATOM  {serial:5d} {name:<4} {'G':>3} A{resseq:>4}    {x:8.3f}{0:8.3f}{0:8.3f}  1.00  0.00\n"
+
+
+def test_residue_numbers_decimal_blank_and_hybrid_36():
+    values = np.array([b"  12", b"  -3", b"    ", b"A000", b"ZZZZ", b"a000", b"12x4"])
+
+    numbers, invalid = parse_residue_numbers(values)
+
+    assert numbers.tolist() == [12, -3, 0, 10000, 1223055, 1223056, 0]
+    assert invalid.tolist() == [False, False, True, False, False, False, True]
+
+
+def test_unreadable_residue_numbers_are_kept_and_reported():
+    text = "HEADER    TEST\n" + atom_line(1, "P", "1", 1.0) + atom_line(2, "P", "", 2.0) + \
+           atom_line(3, "P", "A000", 3.0) + atom_line(4, "P", "?!", 4.0)
+    bad_lines = []
+
+    table = parse_pdb_buffer(text.encode(), bad_lines)
+
+    assert table["resseq"].tolist() == [1, 0, 10000, 0]
+    assert table["xyz"][:, 0].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert bad_lines == [3, 5]
+
+
+def test_stream_blocks_report_line_numbers_of_the_file():
+    text = "".join(atom_line(serial, "P", "" if serial in (3, 40) else str(serial), serial) for serial in range(1, 60))
+    bad_lines = []
+
+    table = parse_pdb_stream(io.BytesIO(text.encode()), block_size=500, bad_lines=bad_lines)
+
+    assert len(table) == 59
+    assert bad_lines == [3, 40]
+
+
+def test_stream_matches_whole_buffer():
+    with open(NATIVE_PDB, "rb") as handle:
+        data = handle.read()
+
+    table = read_atom_table(NATIVE_PDB)
+
+    assert np.array_equal(table, parse_pdb_buffer(data))
+    assert np.array_equal(table, parse_pdb_stream(io.BytesIO(data), block_size=4096))
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+from cg_core import read_atom_table, residue_ids, match_atoms
+from reference_metrics import TORSIONS, torsion_positions, torsion_angles, mcq
+
+NATIVE_PDB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "NATIVE", "rp05.pdb")
+
+
+def test_torsions_do_not_span_a_missing_residue():
+    native = read_atom_table(NATIVE_PDB)
+    starts = np.flatnonzero(np.diff(residue_ids(native), prepend=-1))
+    missing = native["resseq"][starts][20]
+    gapped = native[native["resseq"] != missing]
+    rows, _, _ = match_atoms(gapped, gapped)
+
+    torsions = torsion_positions(gapped, rows)
+
+    alpha = list(TORSIONS).index("alpha")
+    zeta = list(TORSIONS).index("zeta")
+    # The residue after the gap has no alpha, the residue before it no zeta; their neighbors keep theirs
+    assert torsions[20, alpha, 0] == -1 and np.all(torsions[21, alpha] >= 0)
+    assert torsions[19, zeta, 3] == -1 and np.all(torsions[18, zeta] >= 0)
+
+
+def test_mcq_of_prediction_with_interior_gap():
+    native = read_atom_table(NATIVE_PDB)
+    starts = np.flatnonzero(np.diff(residue_ids(native), prepend=-1))
+    predicted = native[native["resseq"] != native["resseq"][starts][20]]
+    native_rows, predicted_rows, _ = match_atoms(native, predicted)
+
+    # Predicted coordinates in native atom order, NaN for the atoms of the missing residue
+    native_all, predicted_all, _ = match_atoms(native, native)
+    positions = np.searchsorted(native_all, native_rows)
+    atoms = np.full((1, len(native_all), 3), np.nan)
+    atoms[0, positions] = predicted["xyz"][predicted_rows]
+    native_atoms = native["xyz"][native_all][None].astype(np.float64)
+    torsions = torsion_positions(native, native_all)
+
+    values = mcq(torsion_angles(native_atoms, torsions)[0], torsion_angles(atoms, torsions))
+
+    assert values[0] < 1e-3
@@ -0,0 +1,77 @@
+import numpy as np
+from scipy import stats
+from resampling import (weighted_correlations, weighted_ranks, _bootstrap_batch, _permutation_batch,
+                        significance_tables)
+
+
+def random_models(seed=0, models=30, representations=3):
+    rng = np.random.default_rng(seed)
+    y = rng.normal(size=models)
+    x = y[:, None] + rng.normal(size=(models, representations))
+    x[:, -1] = np.round(x[:, -1])  # Ties
+    return x, np.round(y, 1)
+
+
+def resample_indices(seed, size, models):
+    # Same draws as _bootstrap_batch
+    return np.random.default_rng(seed).integers(0, models, size=(size, models))
+
+
+def counts(indices, models):
+    return np.stack([np.bincount(row, minlength=models) for row in indices]).astype(float)
+
+
+def test_weighted_correlations_equal_resampled_data():
+    x, y = random_models()
+    indices = resample_indices(1, 20, len(y))
+
+    r = weighted_correlations(x, y, counts(indices, len(y)))
+
+    for b, rows in enumerate(indices):
+        for column in range(x.shape[1]):
+            assert np.isclose(r[b, column], np.corrcoef(x[rows, column], y[rows])[0, 1], atol=1e-12)
+
+
+def test_weighted_ranks_equal_ranks_of_resampled_data():
+    _, y = random_models()
+    indices = resample_indices(2, 20, len(y))
+
+    ranks = weighted_ranks(y, counts(indices, len(y)))
+
+    for b, rows in enumerate(indices):
+        assert np.allclose(ranks[b, rows], stats.rankdata(y[rows]))
+
+
+def test_spearman_bootstrap_equals_resampled_data():
+    x, y = random_models()
+    indices = resample_indices(3, 20, len(y))
+
+    r = _bootstrap_batch(x, y, "spearman", 3, 20)
+
+    for b, rows in enumerate(indices):
+        for column in range(x.shape[1]):
+            assert np.isclose(r[b, column], stats.spearmanr(x[rows, column], y[rows])[0], atol=1e-12)
+
+
+def test_permutations_equal_swapped_data():
+    x, y = random_models()
+    z = (x - x.mean(axis=0)) / x.std(axis=0)
+    pairs = np.array([(0, 1), (0, 2), (1, 2)])
+    swaps = np.random.default_rng(4).random((20, len(y))) < 0.5
+
+    differences = _permutation_batch(z, y, pairs, 4, 20)
+
+    for b, swap in enumerate(swaps):
+        for index, (a, c) in enumerate(pairs):
+            first, second = np.where(swap, z[:, c], z[:, a]), np.where(swap, z[:, a], z[:, c])
+            expected = np.corrcoef(first, y)[0, 1] - np.corrcoef(second, y)[0, 1]
+            assert np.isclose(differences[b, index], expected, atol=1e-12)
+
+
+def test_single_representation_has_no_differences():
+    x, y = random_models(representations=1)
+
+    correlations_df, differences_df = significance_tables(x, y, ["C4'"], n_resamples=100)
+
+    assert len(correlations_df) == 1 and correlations_df["ci_low"][0] <= correlations_df["ci_high"][0]
+    assert differences_df.empty
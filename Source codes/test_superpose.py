@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from cg_core import superpose_batch
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    return q if np.linalg.det(q) > 0 else -q
+
+
+def reference_rmsd(native, predicted):
+    """
+    Kabsch RMSD of one prediction, computed directly on its present (non-NaN) atoms.
+    """
+    present = np.isfinite(predicted).all(axis=1)
+    p = predicted[present] - predicted[present].mean(axis=0)
+    q = native[present] - native[present].mean(axis=0)
+    u, _, vt = np.linalg.svd(p.T @ q)
+    d = np.sign(np.linalg.det(u @ vt))
+    aligned = p @ (u @ np.diag([1.0, 1.0, d]) @ vt)
+    return np.sqrt(((aligned - q) ** 2).sum(axis=1).mean())
+
+
+def decoys(rng, native, n_decoys=6, noise=0.8):
+    return np.stack([native @ random_rotation(rng).T + rng.normal(scale=10, size=3)
+                     + rng.normal(scale=noise, size=native.shape) for _ in range(n_decoys)])
+
+
+def test_batch_matches_reference_and_superposes():
+    rng = np.random.default_rng(0)
+    native = rng.normal(scale=15, size=(40, 3))
+    predicted = decoys(rng, native)
+
+    rmsd, rotations, translations = superpose_batch(native, predicted)
+
+    assert np.allclose(rmsd, [reference_rmsd(native, decoy) for decoy in predicted], atol=1e-10)
+    assert np.allclose(np.linalg.det(rotations), 1.0)
+    superposed = np.einsum("mni,mji->mnj", predicted, rotations) + translations[:, None, :]
+    assert np.allclose(np.sqrt(((superposed - native) ** 2).sum(axis=2).mean(axis=1)), rmsd)
+
+
+def test_mirror_image_gets_a_proper_rotation():
+    rng = np.random.default_rng(1)
+    native = rng.normal(scale=15, size=(40, 3))
+    mirrored = native * [-1.0, 1.0, 1.0] + rng.normal(scale=0.1, size=native.shape)
+
+    rmsd, rotations, _ = superpose_batch(native, mirrored[None])
+
+    assert np.linalg.det(rotations[0]) == pytest.approx(1.0)
+    assert rmsd[0] == pytest.approx(reference_rmsd(native, mirrored), abs=1e-10)
+    assert rmsd[0] > 1.0
+
+
+def test_missing_atoms_are_left_out():
+    rng = np.random.default_rng(2)
+    native = rng.normal(scale=15, size=(40, 3))
+    predicted = decoys(rng, native)
+    predicted[0, :5] = np.nan
+    predicted[3, [7, 20, 33]] = np.nan
+
+    rmsd, _, _ = superpose_batch(native, predicted)
+
+    assert np.all(np.isfinite(rmsd))
+    assert np.allclose(rmsd, [reference_rmsd(native, decoy) for decoy in predicted], atol=1e-10)
+
+
+def test_float32_predictions():
+    rng = np.random.default_rng(3)
+    native = rng.normal(scale=15, size=(40, 3))
+    predicted = decoys(rng, native)
+
+    rmsd, _, _ = superpose_batch(native, predicted.astype(np.float32))
+
+    assert np.allclose(rmsd, superpose_batch(native, predicted)[0], atol=1e-4)
+
+
+def test_fewer_than_3_atoms_raise():
+    native = np.zeros((4, 3))
+    predicted = np.full((1, 4, 3), np.nan)
+    predicted[0, :2] = 0.0
+
+    with pytest.raises(ValueError):
+        superpose_batch(native, predicted)
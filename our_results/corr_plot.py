@@ -1,46 +1,60 @@
 import os
+import sqlite3
 import pandas as pd
 import re
 import seaborn as sns
 import matplotlib.pyplot as plt
 
 # Prompt user for input and output directories
-input_dir = input("Please enter the path to the input directory containing correlation files: ")
+input_dir = input("Please enter the path to the input directory containing correlation files (or to a results store .sqlite file): ")
 output_dir = input("Please enter the path to the output directory to save the correlation data: ")
 
 # Create output directory if it doesn't exist
 os.makedirs(output_dir, exist_ok=True)
 
-# Step 1: Parse correlation files and extract data
-correlation_data = []
-
-for filename in os.listdir(input_dir):
-    if filename.startswith("corr_") and filename.endswith(".txt"):
-        filepath = os.path.join(input_dir, filename)
-        protein_id = filename.replace("corr_", "").replace(".txt", "")
-        corr_dict = {"Protein": protein_id}
-        
-        with open(filepath, 'r') as file:
-            content = file.read()
-            pearson_matches = re.findall(r'Pearson Correlation: r = ([\d\.\-]+)', content)
-            spearman_matches = re.findall(r'Spearman Correlation: r = ([\d\.\-]+)', content)
-            if len(pearson_matches) == 3 and len(spearman_matches) == 3:
-                corr_dict.update({
-                    "Pearson RMSD": float(pearson_matches[0]),
-                    "Pearson MCQ": float(pearson_matches[1]),
-                    "Pearson TM-score": float(pearson_matches[2]),
-                    "Spearman RMSD": float(spearman_matches[0]),
-                    "Spearman MCQ": float(spearman_matches[1]),
-                    "Spearman TM-score": float(spearman_matches[2])
-                })
-            else:
-                print(f"Warning: Incomplete data in file {filename}")
-        
-        correlation_data.append(corr_dict)
-
-# Convert to DataFrame
-corr_df = pd.DataFrame(correlation_data)
-corr_df.set_index("Protein", inplace=True)
+if os.path.isfile(input_dir):
+    # Step 1: Load typed correlation data from the results store written by main_all.py
+    with sqlite3.connect(input_dir) as connection:
+        store_df = pd.read_sql_query("SELECT * FROM correlations", connection)
+    # One row per protein, or per (protein, representation) when several representations were scored
+    if store_df["representation"].nunique() > 1:
+        store_df["Protein"] = store_df["structure"] + " " + store_df["representation"]
+    else:
+        store_df["Protein"] = store_df["structure"]
+    corr_df = store_df.pivot(index="Protein", columns="metric", values=["pearson_r", "spearman_r"])
+    corr_df.columns = [f"{'Pearson' if method == 'pearson_r' else 'Spearman'} {metric}" for method, metric in corr_df.columns]
+    corr_df = corr_df[[f"{method} {metric}" for method in ("Pearson", "Spearman") for metric in ("RMSD", "MCQ", "TM-score")]]
+else:
+    # Step 1: Parse correlation files and extract data
+    correlation_data = []
+
+    for filename in os.listdir(input_dir):
+        if filename.startswith("corr_") and filename.endswith(".txt"):
+            filepath = os.path.join(input_dir, filename)
+            protein_id = filename.replace("corr_", "").replace(".txt", "")
+            corr_dict = {"Protein": protein_id}
+
+            with open(filepath, 'r') as file:
+                content = file.read()
+                pearson_matches = re.findall(r'Pearson Correlation: r = ([\d\.\-]+)', content)
+                spearman_matches = re.findall(r'Spearman Correlation: r = ([\d\.\-]+)', content)
+                if len(pearson_matches) == 3 and len(spearman_matches) == 3:
+                    corr_dict.update({
+                        "Pearson RMSD": float(pearson_matches[0]),
+                        "Pearson MCQ": float(pearson_matches[1]),
+                        "Pearson TM-score": float(pearson_matches[2]),
+                        "Spearman RMSD": float(spearman_matches[0]),
+                        "Spearman MCQ": float(spearman_matches[1]),
+                        "Spearman TM-score": float(spearman_matches[2])
+                    })
+                else:
+                    print(f"Warning: Incomplete data in file {filename}")
+
+            correlation_data.append(corr_dict)
+
+    # Convert to DataFrame
+    corr_df = pd.DataFrame(correlation_data)
+    corr_df.set_index("Protein", inplace=True)
 
 # Save to Excel
 output_file = os.path.join(output_dir, "cgRMSD_correlations_summary.xlsx")